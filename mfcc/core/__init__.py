@@ -1 +1,3 @@
 from .mfcc import MFCC
+from .mfcc_array import MFCCArray
+from .mfcc_async import MFCCAsync
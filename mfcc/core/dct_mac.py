@@ -0,0 +1,175 @@
+import numpy as np
+from nmigen import *
+from mfcc.misc import stream
+from mfcc.misc.mul import *
+
+
+def dct_coefficients(n, first=0, count=None, coef_width=16):
+    """ROM of DCTMac: the (count, n) matrix of DCT-II
+    coefficients cos(πk(2i+1)/2n) for k in first..first+count-1, scaled
+    by 2**(coef_width-2) and rounded."""
+    if count is None:
+        count = n - first
+    k = np.arange(first, first + count)[:, None]
+    i = np.arange(n)[None, :]
+    c = np.cos(np.pi * k * (2 * i + 1) / (2 * n))
+    return np.round(c * (1 << coef_width - 2)).astype(np.int64)
+
+
+class DCTMac(Elaboratable):
+    """DCT-II computing only the coefficients first..first+count-1.
+
+    Each input sample is multiplied by the ROM coefficients of the kept
+    outputs and accumulated, nlanes coefficients per clock: a frame of nfft
+    samples takes nfft * ceil(count / nlanes) clocks. The outputs of a frame
+    are emitted while the next one is accumulated.
+    """
+    def __init__(self, width=16, nfft=16, first=0, count=None, nlanes=1, coef_width=16,
+                 multiplier_cls=Multiplier):
+        if count is None:
+            count = nfft - first
+        if not 0 <= first < nfft or not 0 < count <= nfft - first:
+            raise ValueError("Coefficients {}..{} are not within 0..{}"
+                             .format(first, first + count - 1, nfft - 1))
+        if not isinstance(nlanes, int) or nlanes <= 0:
+            raise ValueError("Lane count must be a positive integer, not {!r}"
+                             .format(nlanes))
+
+        self.width = width
+        self.nfft = nfft
+        self.first = first
+        self.count = count
+        self.nlanes = nlanes
+        self.coef_width = coef_width
+        self.ngroups = -(-count // nlanes)
+        self.muls = [multiplier_cls(signed(width), signed(coef_width)) for _ in range(nlanes)]
+
+        self.sink = stream.Endpoint([("data", (width, True))])
+        self.source = stream.Endpoint([("data", (width, True))])
+
+    def elaborate(self, platform):
+        sink = self.sink
+        source = self.source
+
+        m = Module()
+
+        # Output first + g*nlanes + l is computed by lane l on group g.
+        coefs = dct_coefficients(self.nfft, self.first, self.count, self.coef_width)
+        mask = (1 << self.coef_width) - 1
+
+        roms = []
+        for l, mul in enumerate(self.muls):
+            m.submodules["mul{}".format(l)] = mul
+            init = []
+            for g in range(self.ngroups):
+                k = g * self.nlanes + l
+                for n in range(self.nfft):
+                    init.append(int(coefs[k][n]) & mask if k < self.count else 0)
+            rom = Memory(width=self.coef_width, depth=self.ngroups * self.nfft, init=init)
+            m.submodules["rom{}".format(l)] = rom_rp = rom.read_port(domain="comb")
+            roms.append(rom_rp)
+
+        mul0 = self.muls[0]
+
+        mul_stages = [
+            Record([
+                ("group", range(self.ngroups)),
+                ("clear", 1),
+                ("end",   1),
+            ], name=f"stage_{j}") for j in range(mul0.pipe_stages + 1)
+        ]
+
+        i_stage = mul_stages[ 0]
+        o_stage = mul_stages[-1]
+
+        for i, o in zip(mul_stages, mul_stages[1:]):
+            with m.If(mul0.i.ready):
+                m.d.sync += o.eq(i)
+
+        # Input: a sample is held on the sink until its last group is issued.
+        # The last sample of a frame waits until the previous outputs are
+        # emitted.
+
+        index = Signal(range(self.nfft))
+        group = Signal(range(self.ngroups))
+        pending = Signal()
+
+        issue = Signal()
+        m.d.comb += [
+            issue.eq(sink.valid & ~(sink.last & pending)),
+            i_stage.group.eq(group),
+            i_stage.clear.eq(index == 0),
+            i_stage.end.eq(sink.last & (group == self.ngroups - 1)),
+        ]
+
+        for mul, rom_rp in zip(self.muls, roms):
+            m.d.comb += [
+                rom_rp.addr.eq(group * self.nfft + index),
+                mul.i.valid.eq(issue),
+                mul.i.a.eq(sink.data),
+                mul.i.b.eq(rom_rp.data),
+                mul.o.ready.eq(1),
+            ]
+
+        with m.If(issue & mul0.i.ready):
+            with m.If(group == self.ngroups - 1):
+                m.d.comb += sink.ready.eq(1)
+                m.d.sync += [
+                    group.eq(0),
+                    index.eq(Mux(sink.last, 0, index + 1)),
+                ]
+                with m.If(sink.last):
+                    m.d.sync += pending.eq(1)
+            with m.Else():
+                m.d.sync += group.eq(group + 1)
+
+        # Accumulate, and copy the rounded sums of a frame to the output
+        # registers once its last product is in.
+
+        acc_width = self.width + self.coef_width + self.nfft.bit_length()
+        shift = self.coef_width - 2 + (2 * self.nfft).bit_length() - 1
+
+        outs = [Signal(signed(self.width), name="out{}".format(k)) for k in range(self.count)]
+        emitting = Signal()
+
+        for l, mul in enumerate(self.muls):
+            accs = Array(Signal(signed(acc_width), name="acc{}_{}".format(l, g))
+                         for g in range(self.ngroups))
+
+            acc_next = Signal(signed(acc_width))
+            m.d.comb += acc_next.eq(Mux(o_stage.clear, 0, accs[o_stage.group]) + mul.o.c)
+
+            with m.If(mul.o.valid):
+                m.d.sync += accs[o_stage.group].eq(acc_next)
+                with m.If(o_stage.end):
+                    for g in range(self.ngroups):
+                        k = g * self.nlanes + l
+                        if k >= self.count:
+                            continue
+                        value = acc_next if g == self.ngroups - 1 else accs[g]
+                        m.d.sync += outs[k].eq((value + (1 << shift - 1)) >> shift)
+
+        with m.If(mul0.o.valid & o_stage.end):
+            m.d.sync += emitting.eq(1)
+
+        # Output
+
+        cnt_empty = Signal(range(self.count))
+        m.d.comb += [
+            source.valid.eq(emitting),
+            source.first.eq(cnt_empty == 0),
+            source.last.eq(cnt_empty == self.count - 1),
+            source.data.eq(Array(outs)[cnt_empty]),
+        ]
+
+        with m.If(source.valid & source.ready):
+            with m.If(source.last):
+                m.d.sync += [
+                    cnt_empty.eq(0),
+                    emitting.eq(0),
+                    pending.eq(0),
+                ]
+            with m.Else():
+                m.d.sync += cnt_empty.eq(cnt_empty + 1)
+
+        return m
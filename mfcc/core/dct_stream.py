@@ -1,16 +1,25 @@
 from nmigen import *
 from nmigen.sim import *
 from mfcc.misc import stream
-from mfcc.misc.fft import FFT
+from mfcc.misc.fft import FFT, TwiddleROM, Butterfly
 
 class DCTStream(Elaboratable):
-    def __init__(self, width=16, nfft=16):
+    def __init__(self, width=16, nfft=16, radix=2, nbutterflies=1, engine="fft4"):
+        if engine not in ("fft4", "makhoul"):
+            raise ValueError("Engine must be 'fft4' or 'makhoul', not {!r}"
+                             .format(engine))
         self.width = width
         self.nfft = nfft
+        self.radix = radix
+        self.nbutterflies = nbutterflies
+        self.engine = engine
         self.sink = stream.Endpoint([("data", (width, True))])
         self.source = stream.Endpoint([("data", (width, True))])
 
     def elaborate(self, platform):
+        if self.engine == "makhoul":
+            return self.elaborate_makhoul(platform)
+
         sink = self.sink
         source = self.source
 
@@ -18,7 +27,10 @@ class DCTStream(Elaboratable):
         m.submodules.fft = mfft = FFT(size=self.nfft*4,
                                       i_width=self.width,
                                       o_width=self.width,
-                                      m_width=self.width)
+                                      m_width=self.width,
+                                      radix=self.radix,
+                                      nbutterflies=self.nbutterflies,
+                                      o_size=self.nfft)
 
         cnt_fill = Signal(range(self.nfft*8))
         cnt_empty = Signal(range(self.nfft))
@@ -72,6 +84,95 @@ class DCTStream(Elaboratable):
 
         return m
 
+    def elaborate_makhoul(self, platform):
+        sink = self.sink
+        source = self.source
+
+        m = Module()
+        m.submodules.fft = mfft = FFT(size=self.nfft,
+                                      i_width=self.width,
+                                      o_width=self.width,
+                                      m_width=self.width,
+                                      radix=self.radix,
+                                      nbutterflies=self.nbutterflies)
+
+        # Makhoul: the even samples in order followed by the odd samples in
+        # reverse order go through an N-point FFT, and bin k is rotated by
+        # exp(-jπk/2N). The butterfly computes Re(V[k]·ω)/2 with a zero x₀,
+        # which keeps the 1/2N scale of the 4N-point transform.
+        # The rotation pipeline only moves when its output can be taken.
+        ce = Signal()
+        m.submodules.trom = trom = TwiddleROM(size=4*self.nfft, width=self.width)
+        m.submodules.bf = bf = EnableInserter(ce)(
+            Butterfly(width=self.width, bias_width=self.width - 2, scale_bit=1))
+        m.d.comb += ce.eq(~bf.o.stb | source.ready)
+
+        cnt_fill = Signal(range(self.nfft))
+        cnt_issue = Signal(range(self.nfft + 1))
+        cnt_empty = Signal(range(self.nfft))
+
+        issue = Signal()
+        s1_addr = Signal.like(cnt_issue)
+        s1_stb = Signal()
+        rd_addr = Signal.like(cnt_issue)
+        m.d.comb += rd_addr.eq(Mux(ce, cnt_issue, s1_addr))
+        with m.If(ce):
+            m.d.sync += [
+                s1_addr.eq(cnt_issue),
+                s1_stb.eq(issue),
+            ]
+            with m.If(issue):
+                m.d.sync += cnt_issue.eq(cnt_issue + 1)
+
+        m.d.comb += [
+            mfft.i.addr.eq(Mux(cnt_fill[0], self.nfft - 1 - (cnt_fill >> 1), cnt_fill >> 1)),
+            mfft.i.data.real.eq(sink.data),
+            mfft.i.data.imag.eq(0),
+
+            mfft.o.addr.eq(rd_addr),
+            trom.rp_addr.eq(rd_addr),
+
+            bf.i.stb.eq(s1_stb),
+            bf.i.x0.real.eq(0),
+            bf.i.x0.imag.eq(0),
+            bf.i.x1.eq(mfft.o.data),
+            bf.i.tw.eq(trom.rp_data),
+
+            source.valid.eq(bf.o.stb),
+            source.last.eq(cnt_empty == self.nfft - 1),
+            source.data.eq(bf.o.y0.real),
+        ]
+
+        with m.If(source.valid & source.ready):
+            m.d.sync += cnt_empty.eq(Mux(source.last, 0, cnt_empty + 1))
+
+        with m.FSM():
+            with m.State("FILL"):
+                m.d.comb += [
+                    mfft.i.en.eq(sink.valid),
+                    sink.ready.eq(1),
+                ]
+
+                with m.If(sink.valid):
+                    m.d.sync += cnt_fill.eq(cnt_fill + 1)
+                    with m.If(sink.last):
+                        m.d.comb += mfft.start.eq(1)
+                        m.d.sync += cnt_fill.eq(0)
+                        m.next = "WORK"
+
+            with m.State("WORK"):
+                with m.If(mfft.ready):
+                    m.d.sync += cnt_issue.eq(0)
+                    m.next = "EMPTY"
+
+            with m.State("EMPTY"):
+                m.d.comb += issue.eq(cnt_issue != self.nfft)
+
+                with m.If(source.valid & source.ready & source.last):
+                    m.next = "FILL"
+
+        return m
+
 if __name__ == "__main__":
     import random
     import matplotlib.pyplot as plt
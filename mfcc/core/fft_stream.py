@@ -1,57 +1,206 @@
 from nmigen import *
 from nmigen.sim import *
+from nmigen.utils import log2_int
 from mfcc.misc import stream
-from mfcc.misc.fft import FFT
+from mfcc.misc.fft import FFT, SdfFFT
+from mfcc.misc.mul import *
+from .pow2 import PowerSpectrum
 
 class FftStream(Elaboratable):
-    def __init__(self, width=16, nfft=512):
+    def __init__(self, width=16, nfft=512, nbanks=1, real=False, radix=2,
+                 nbutterflies=1, engine="block", m_width=None, bfp=False,
+                 i_size=None, nbins=None, first_bin=0, power_width=None, power_mode="exact",
+                 multiplier_cls=Multiplier):
+        if engine not in ("block", "sdf"):
+            raise ValueError("Engine must be 'block' or 'sdf', not {!r}"
+                             .format(engine))
+        if engine == "sdf":
+            options = {
+                "nbanks":       nbanks != 1,
+                "real":         real,
+                "radix":        radix != 2,
+                "nbutterflies": nbutterflies != 1,
+                "m_width":      m_width is not None,
+                "bfp":          bfp,
+                "i_size":       i_size not in (None, nfft),
+            }
+            unsupported = [name for name, given in options.items() if given]
+            if unsupported:
+                raise ValueError("The streaming FFT has no {} option"
+                                 .format(" or ".join(unsupported)))
         self.width = width
         self.nfft = nfft
+        self.nbanks = nbanks
+        self.real = real
+        self.radix = radix
+        self.nbutterflies = nbutterflies
+        self.engine = engine
+        self.m_width = width if m_width is None else m_width
+        self.bfp = bfp
+        # only the first i_size samples of a frame can be non-zero, and only
+        # the nbins bins from first_bin are emitted.
+        self.i_size = nfft if i_size is None else i_size
+        self.first_bin = first_bin
+        self.nbins = nfft//2 - first_bin if nbins is None else nbins
+        if first_bin < 0 or self.nbins <= 0 or first_bin + self.nbins > nfft:
+            raise ValueError("Bins {}..{} are not within 0..{}"
+                             .format(first_bin, first_bin + self.nbins - 1, nfft - 1))
         self.sink = stream.Endpoint([("data", (width, True))])
-        self.source = stream.Endpoint([("data_r", (width, True)), ("data_i", (width, True))])
+        # with power_width, the bins read out of the FFT are squared in place
+        # and the source carries their power.
+        self.bins = stream.Endpoint([("data_r", (width, True)), ("data_i", (width, True))])
+        if power_width is None:
+            self.powspec = None
+            self.source = self.bins
+        else:
+            self.powspec = PowerSpectrum(width=width,
+                                         width_output=power_width,
+                                         multiplier_cls=multiplier_cls,
+                                         mode=power_mode)
+            self.source = stream.Endpoint([("data", power_width)])
 
     def elaborate(self, platform):
+        if self.engine == "sdf":
+            m = self.elaborate_sdf(platform)
+        else:
+            m = self.elaborate_block(platform)
+
+        if self.powspec is not None:
+            m.submodules.powspec = self.powspec
+            m.d.comb += [
+                self.bins.connect(self.powspec.sink),
+                self.powspec.source.connect(self.source),
+            ]
+
+        return m
+
+    def elaborate_block(self, platform):
         sink = self.sink
-        source = self.source
+        source = self.bins
 
         m = Module()
         m.submodules.fft = mfft = FFT(size=self.nfft,
                                       i_width=self.width,
-                                      o_width=self.width,
-                                      m_width=self.width)
+                                      o_width=self.m_width,
+                                      m_width=self.m_width,
+                                      nbanks=self.nbanks,
+                                      real=self.real,
+                                      radix=self.radix,
+                                      nbutterflies=self.nbutterflies,
+                                      bfp=self.bfp,
+                                      i_size=self.i_size,
+                                      o_size=self.first_bin + self.nbins)
+
+        # The FFT memory banks are used in a round-robin order: with several
+        # banks, a frame can be loaded while the previous one is transformed
+        # and the one before is read out.
+
+        def rotate(ptr):
+            return Mux(ptr == self.nbanks - 1, 0, ptr + 1)
+
+        bank_fill = Signal(range(self.nbanks))
+        bank_work = Signal(range(self.nbanks))
+        bank_empty = Signal(range(self.nbanks))
+
+        used = Signal(range(self.nbanks + 1))       # banks being transformed or not read out yet
+        pending = Signal(range(self.nbanks + 1))    # banks filled but not transformed yet
+        done = Signal(range(self.nbanks + 1))       # banks transformed but not read out yet
+        working = Signal()
 
         cnt_fill = Signal(range(self.nfft))
-        cnt_empty = Signal(range(self.nfft//2))
+        cnt_empty = Signal(range(self.nbins))
         cnt_nxt = Signal.like(cnt_empty)
 
         produce = (source.valid & source.ready)
-        last = (cnt_empty == self.nfft//2 - 1)
+        last = (cnt_empty == self.nbins - 1)
+
+        filled = Signal()
+        start = Signal()
+        finish = Signal()
+        emptied = Signal()
 
         m.d.comb += [
+            mfft.i.bank.eq(bank_fill),
             mfft.i.addr.eq(cnt_fill),
             mfft.i.data.real.eq(sink.data),
             mfft.i.data.imag.eq(0),
 
-            mfft.o.addr.eq(Mux(produce, cnt_nxt, cnt_empty)),
-            source.data_r.eq(mfft.o.data.real),
-            source.data_i.eq(mfft.o.data.imag),
+            mfft.o.bank.eq(bank_empty),
+            mfft.o.addr.eq(Mux(produce, cnt_nxt, cnt_empty) + self.first_bin),
         ]
 
-        with m.FSM() as fsm:
-            with m.State("FILL"):
-                m.d.comb += [
-                    mfft.i.en.eq(sink.valid),
-                    sink.ready.eq(1)
-                ]
+        # The FFT output is scaled by 2**-exp, the stream output keeps the
+        # 1/nfft scale of the fixed point transform, saturated to width.
+
+        if self.bfp or self.m_width != self.width:
+            nbits = log2_int(self.nfft)
+            # left shifts of width bits or more always saturate.
+            shift_l = Signal(range(self.width + 1))
+            shift_r = Signal(range(nbits + 1))
+            with m.If(mfft.o.exp >= nbits + self.width):
+                m.d.comb += shift_l.eq(self.width)
+            with m.Elif(mfft.o.exp >= nbits):
+                m.d.comb += shift_l.eq(mfft.o.exp - nbits)
+            with m.Else():
+                m.d.comb += shift_r.eq(nbits - mfft.o.exp)
+
+            def rescale(value):
+                wide = Signal(signed(self.m_width + self.width))
+                out = Signal(signed(self.width))
+                m.d.comb += wide.eq((value << shift_l) >> shift_r)
+                with m.If(wide > 2**(self.width - 1) - 1):
+                    m.d.comb += out.eq(2**(self.width - 1) - 1)
+                with m.Elif(wide < -2**(self.width - 1)):
+                    m.d.comb += out.eq(-2**(self.width - 1))
+                with m.Else():
+                    m.d.comb += out.eq(wide)
+                return out
+
+            m.d.comb += [
+                source.data_r.eq(rescale(mfft.o.data.real)),
+                source.data_i.eq(rescale(mfft.o.data.imag)),
+            ]
+        else:
+            m.d.comb += [
+                source.data_r.eq(mfft.o.data.real),
+                source.data_i.eq(mfft.o.data.imag),
+            ]
 
-                with m.If(sink.valid):
-                    m.d.sync += cnt_fill.eq(cnt_fill + 1)
-                    with m.If(sink.last):
-                        m.d.comb += mfft.start.eq(1)
-                        m.next = "WORK"
+        # fill
 
-            with m.State("WORK"):
-                with m.If(mfft.ready):
+        with m.If(used != self.nbanks):
+            m.d.comb += [
+                mfft.i.en.eq(sink.valid),
+                sink.ready.eq(1),
+            ]
+
+            with m.If(sink.valid):
+                m.d.sync += cnt_fill.eq(cnt_fill + 1)
+                with m.If(sink.last):
+                    m.d.comb += filled.eq(1)
+                    m.d.sync += [
+                        cnt_fill.eq(0),
+                        bank_fill.eq(rotate(bank_fill)),
+                    ]
+
+        # work
+
+        m.d.comb += [
+            finish.eq(working & mfft.ready),
+            start.eq(mfft.ready & (pending != 0)),
+            mfft.bank.eq(bank_work),
+            mfft.start.eq(start),
+        ]
+
+        m.d.sync += working.eq(start | (working & ~mfft.ready))
+        with m.If(start):
+            m.d.sync += bank_work.eq(rotate(bank_work))
+
+        # empty
+
+        with m.FSM() as fsm:
+            with m.State("WAIT"):
+                with m.If(done != 0):
                     m.d.comb += cnt_nxt.eq(0)
                     m.d.sync += cnt_empty.eq(0)
                     m.next = "EMPTY"
@@ -67,8 +216,50 @@ class FftStream(Elaboratable):
                     m.d.sync += cnt_empty.eq(cnt_nxt)
 
                     with m.If(last):
-                        m.d.sync += cnt_fill.eq(0)
-                        m.next = "FILL"
+                        m.d.comb += emptied.eq(1)
+                        m.d.sync += [
+                            # the first bin of the next bank is read while waiting
+                            cnt_empty.eq(0),
+                            bank_empty.eq(rotate(bank_empty)),
+                        ]
+                        m.next = "WAIT"
+
+        m.d.sync += [
+            used.eq(used + filled - emptied),
+            pending.eq(pending + filled - start),
+            done.eq(done + finish - emptied),
+        ]
+
+        return m
+
+    def elaborate_sdf(self, platform):
+        sink = self.sink
+        source = self.bins
+
+        m = Module()
+        m.submodules.fft = mfft = SdfFFT(size=self.nfft, width=self.width)
+
+        # the streaming FFT emits all the bins, drop the unused ones.
+
+        cnt_empty = Signal(range(self.nfft))
+        unused = (cnt_empty < self.first_bin) | (cnt_empty >= self.first_bin + self.nbins)
+
+        with m.If(mfft.source.valid & mfft.source.ready):
+            m.d.sync += cnt_empty.eq(cnt_empty + 1)
+
+        m.d.comb += [
+            mfft.sink.valid.eq(sink.valid),
+            mfft.sink.last.eq(sink.last),
+            mfft.sink.data_r.eq(sink.data),
+            mfft.sink.data_i.eq(0),
+            sink.ready.eq(mfft.sink.ready),
+
+            source.valid.eq(mfft.source.valid & ~unused),
+            source.last.eq(cnt_empty == self.first_bin + self.nbins - 1),
+            source.data_r.eq(mfft.source.data_r),
+            source.data_i.eq(mfft.source.data_i),
+            mfft.source.ready.eq(source.ready | unused),
+        ]
 
         return m
 
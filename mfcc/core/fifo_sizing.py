@@ -0,0 +1,177 @@
+from nmigen.sim import Simulator, Settle
+
+from .mfcc import *
+
+
+__all__ = ["fifo_usage", "size_fifos"]
+
+
+def fifo_usage(audio, nframes=3, rate=None, link=1, **kwargs):
+    """Simulate MFCC(**kwargs) on nframes frames of each channel of audio.
+
+    A sample is given every rate cycles, or as fast as the core takes it if
+    rate is None, and a coefficient is taken every link cycles. The
+    channels are the audio rotated by a fraction of its length.
+
+    Returns the cycles per frame once the pipeline is full and, for each
+    FIFO, its depth, its peak level and the cycles its writer was stalled
+    because it was full. The "input" FIFO is the queue of the samples given
+    to the core, as the FIFO of an I2S receiver.
+    """
+    import numpy as np
+
+    dut = MFCC(**kwargs)
+    nchannels = dut.nchannels
+    stepsize = dut.nfft // 3
+    length = dut.windowlen + (nframes - 1) * stepsize
+    audios = [np.roll(audio, k * len(audio) // nchannels)[:length] for k in range(nchannels)]
+    signal = [(int(a), k) for samples in zip(*audios) for k, a in enumerate(samples)]
+
+    fifos = {"power": "fifo_power", "filter": "fifo_filter"}
+    if nchannels > 1:
+        fifos["channels"] = "channels"
+    usage = {name: {"depth": dut.fifo_depths[name], "peak": 0, "stalls": 0} for name in fifos}
+    usage["input"] = {"depth": None, "peak": 0, "stalls": 0}
+    ends = []
+
+    def bench():
+        idx = 0
+        arrived = 0
+        cycle = 0
+        while len(ends) < nframes * nchannels:
+            # the samples which have arrived and were not taken yet
+            if rate is None:
+                arrived = len(signal)
+            else:
+                arrived = min(int(cycle / rate) + 1, len(signal))
+
+            if idx < arrived:
+                data, channel = signal[idx]
+                yield dut.sink.data.eq(data)
+                if nchannels > 1:
+                    yield dut.sink.channel.eq(channel)
+                yield dut.sink.valid.eq(1)
+            else:
+                yield dut.sink.valid.eq(0)
+            yield dut.source.ready.eq(cycle % link == 0)
+            yield Settle()
+
+            if rate is not None:
+                usage["input"]["peak"] = max(usage["input"]["peak"], arrived - idx)
+            if (yield dut.sink.valid) and not (yield dut.sink.ready):
+                usage["input"]["stalls"] += 1
+            if (yield dut.sink.valid) and (yield dut.sink.ready):
+                idx += 1
+
+            for name, attr in fifos.items():
+                fifo = getattr(dut, attr)
+                level = yield fifo.level
+                usage[name]["peak"] = max(usage[name]["peak"], level)
+                if (yield fifo.sink.valid) and not (yield fifo.sink.ready):
+                    usage[name]["stalls"] += 1
+
+            if (yield dut.source.valid) and (yield dut.source.ready) and (yield dut.source.last):
+                ends.append(cycle)
+            yield
+            cycle += 1
+
+    sim = Simulator(dut)
+    sim.add_clock(1e-6)
+    sim.add_sync_process(bench)
+    sim.run()
+
+    # the first frame of every channel waits for a whole window
+    cycles = (ends[-1] - ends[nchannels - 1]) / (len(ends) - nchannels)
+    return cycles, usage
+
+
+def size_fifos(audio, nframes=3, rate=None, link=1, tolerance=0, **kwargs):
+    """Find the smallest FIFO depths of MFCC(**kwargs) which keep its frame
+    rate within tolerance of the one it has with FIFOs of nfft entries.
+
+    Each FIFO in turn is bisected down to the 2 entries of a buffered FIFO,
+    starting one entry above the peak level it reaches when it never fills
+    up. Returns the depths, which can be given as MFCC(fifo_depths=...), and
+    the results of fifo_usage() with the default, deep and chosen depths.
+    """
+    nfft = kwargs.get("nfft", 512)
+    names = ["power", "filter"]
+    if kwargs.get("nchannels", 1) > 1:
+        names.append("channels")
+
+    results = {}
+    def run(depths):
+        key = None if depths is None else tuple(sorted(depths.items()))
+        if key not in results:
+            results[key] = fifo_usage(audio, nframes=nframes, rate=rate, link=link,
+                                      fifo_depths=depths, **kwargs)
+        return results[key]
+
+    default = run(None)
+    depths = {name: nfft for name in names}
+    deep = run(depths)
+    limit = deep[0] * (1 + tolerance)
+
+    for name in names:
+        lo, hi = 2, nfft
+        guess = max(deep[1][name]["peak"] + 1, 2)
+        while lo < hi:
+            depth = guess if guess is not None and lo <= guess < hi else (lo + hi) // 2
+            guess = None
+            if run(dict(depths, **{name: depth}))[0] <= limit:
+                hi = depth
+            else:
+                lo = depth + 1
+        depths[name] = hi
+
+    return depths, {"default": default, "deep": deep, "chosen": run(depths)}
+
+
+def main():
+    import argparse
+    from scipy.io import wavfile
+
+    parser = argparse.ArgumentParser(
+        description="Size the FIFOs of the MFCC core from a simulation.")
+    parser.add_argument("wav", nargs="?", default="f2bjrop1.0.wav",
+                        help="input audio file (default: %(default)s)")
+    parser.add_argument("-n", "--nframes", type=int, default=3,
+                        help="frames per channel (default: %(default)s)")
+    parser.add_argument("--realtime", action="store_true",
+                        help="give the samples at the sample rate instead of as fast as they are taken")
+    parser.add_argument("--clock", type=float, default=1,
+                        help="clock frequency of --realtime, in MHz (default: %(default)s)")
+    parser.add_argument("--link", type=int, default=1,
+                        help="cycles per coefficient of the output link (default: %(default)s)")
+    parser.add_argument("--tolerance", type=float, default=0,
+                        help="accepted frame rate loss, as a fraction (default: %(default)s)")
+    parser.add_argument("--channels", type=int, default=1,
+                        help="channels of the core (default: %(default)s)")
+    args = parser.parse_args()
+
+    sample_rate, audio = wavfile.read(args.wav)
+    kwargs = dict(nfft=512, nfilters=32, nceptrums=16, nchannels=args.channels)
+    rate = None
+    if args.realtime:
+        rate = args.clock * 1e6 / MFCC(**kwargs).samplerate / args.channels
+
+    depths, results = size_fifos(audio, nframes=args.nframes, rate=rate, link=args.link,
+                                 tolerance=args.tolerance, **kwargs)
+
+    print("| FIFO | depth | peak | stalls | deep: peak | stalls | chosen: depth | peak | stalls |")
+    print("|------|------:|-----:|-------:|-----------:|-------:|--------------:|-----:|-------:|")
+    for name in results["default"][1]:
+        row = []
+        for key in ("default", "deep", "chosen"):
+            usage = results[key][1][name]
+            if key != "deep":
+                row.append("-" if usage["depth"] is None else usage["depth"])
+            row += [usage["peak"], usage["stalls"]]
+        print("| {} | {} |".format(name, " | ".join(map(str, row))))
+    print("cycles per frame: {:.0f} with the default depths, {:.0f} with deep FIFOs, "
+          "{:.0f} with the chosen ones".format(*(results[key][0] for key in ("default", "deep", "chosen"))))
+    print("MFCC(fifo_depths={!r})".format(depths))
+
+
+if __name__ == "__main__":
+    main()
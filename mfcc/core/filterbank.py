@@ -44,8 +44,15 @@ class FilterBank(Elaboratable):
             sample_rate=16000,
             nfft=512,
             ntap=16,
+            fmin=0,
+            fmax=None,
+            mant_width=None,
+            lanes=1,
             multiplier_cls=Multiplier
     ):
+        if not isinstance(lanes, int) or lanes <= 0:
+            raise ValueError("Lane count must be a positive integer, not {!r}"
+                             .format(lanes))
         if width_mul == None:
             self.width_mul = width
         else:
@@ -56,13 +63,72 @@ class FilterBank(Elaboratable):
         self.ntap = ntap
         self.width_output = width_output
         self.gain = gain
-        self.mul = multiplier_cls(width, self.width_mul)
-        self.sink = stream.Endpoint([("data", width)])
+        self.mant_width = mant_width
+        self.lanes = lanes
         self.source = stream.Endpoint([("data", width_output)])
-        self.points = get_filter_points(0, sample_rate/2, ntap, nfft, sample_rate=sample_rate)
+        if fmax is None:
+            fmax = sample_rate/2
+        if not 0 <= fmin < fmax <= sample_rate/2:
+            raise ValueError("Band {}..{} Hz is not within 0..{} Hz"
+                             .format(fmin, fmax, sample_rate/2))
+        self.fmin = fmin
+        self.fmax = fmax
+        self.points = get_filter_points(fmin, fmax, ntap, nfft, sample_rate=sample_rate)
+        # with mant_width, the power bins of width bits come as mant << exp
+        # (see mfcc.core.pow2.PowerNormalize), and the accumulator bits below
+        # the output and its guard bits are not kept: the truncation of the
+        # terms of the widest filter stays below one output LSB.
+        # with several lanes, the sink carries that many adjacent bins, lane 0
+        # in the low bits.
+        if mant_width is None:
+            self.muls = [multiplier_cls(width, self.width_mul) for _ in range(lanes)]
+            self.sink = stream.Endpoint([("data", width * lanes)])
+            self.guard_bits = None
+        else:
+            self.exp_width = (width - mant_width).bit_length()
+            self.muls = [multiplier_cls(mant_width, self.width_mul) for _ in range(lanes)]
+            self.sink = stream.Endpoint([("data", mant_width * lanes),
+                                         ("exp", self.exp_width * lanes)])
+            self.guard_bits = int(self.points[-1] - self.points[-3]).bit_length() + 1
+        self.mul = self.muls[0]
         self.filters = calc_filters(self.points, wsize=self.width_mul)
+        # bins outside of the filter points have no weight: the sink takes
+        # the nbins bins from first_bin. The weights of a filter reach their
+        # top one bin before its point, so the last point would only start
+        # an extra filter.
+        self.first_bin = int(self.points[0])
+        self.nbins = int(min(self.points[-1], nfft//2)) - self.first_bin
+        # the weights of a filter take 2 bins at least to reach their top,
+        # narrower filters shift the next ones.
+        if sum(emit for _, _, emit in self.lane_table()) != ntap:
+            raise ValueError("Band {}..{} Hz is too narrow for {} filters over {} FFT points"
+                             .format(fmin, fmax, ntap, nfft))
+
+    def lane_table(self):
+        """Replay the filter address and weight accumulator of elaborate()
+        over the bins of a frame: the weight of each bin, and whether it
+        starts a filter and emits the previous one."""
+        acc_mask = (1 << 2 * self.width_mul) - 1
+        highest = (1 << self.width_mul) - 1
+        i_acc = 0
+        filter_adr = 0
+        table = []
+        for k in range(self.nbins):
+            last = (k == self.nbins - 1)
+            w = i_acc >> self.width_mul
+            boundary = (w == highest) or last
+            table.append((int(w), int(boundary), int(boundary and filter_adr != 0)))
+            if boundary:
+                filter_adr = 0 if last else filter_adr + 1
+                i_acc = 0
+            else:
+                i_acc = (i_acc + self.filters[filter_adr]) & acc_mask
+        return table
 
     def elaborate(self, platform):
+        if self.lanes > 1:
+            return self.elaborate_lanes(platform)
+
         m = Module()
         mem = Memory(depth=len(self.filters), width=2*self.width_mul, init=self.filters)
         m.submodules.mem_rp = mem_rp = mem.read_port(domain="comb")
@@ -70,12 +136,16 @@ class FilterBank(Elaboratable):
 
         maxvalrange = int(math.log2(self.points[-1] - self.points[-3])) + self.width + self.width_mul
 
+        stage_layout = [
+            ("highest",    1),
+            ("data",       len(self.sink.data)),
+            ("filter_adr", len(mem_rp.addr)),
+        ]
+        if self.mant_width is not None:
+            stage_layout.append(("exp", self.exp_width))
+
         mul_stages = [
-            Record([
-                ("highest",    1),
-                ("data",       self.width),
-                ("filter_adr", len(mem_rp.addr)),
-            ], name=f"stage_{j}") for j in range(mul.pipe_stages + 1)
+            Record(stage_layout, name=f"stage_{j}") for j in range(mul.pipe_stages + 1)
         ]
 
         i_stage = mul_stages[ 0]
@@ -92,6 +162,8 @@ class FilterBank(Elaboratable):
             i_stage.highest.eq(i_acc[self.width_mul:] == ((1 << self.width_mul) - 1)),
             i_stage.data   .eq(self.sink.data),
         ]
+        if self.mant_width is not None:
+            m.d.comb += i_stage.exp.eq(self.sink.exp)
 
         i_stage.filter_adr.reset = 0
         m.d.comb += mem_rp.addr.eq(i_stage.filter_adr)
@@ -116,8 +188,21 @@ class FilterBank(Elaboratable):
 
         # Output
 
-        o_rega = Signal(maxvalrange)
-        o_regb = Signal(maxvalrange)
+        if self.mant_width is None:
+            drop = 0
+            term_c = mul.o.c
+            term_d = o_stage.data << self.width_mul
+        else:
+            drop = max(maxvalrange - (self.gain + self.width_output) - self.guard_bits, 0)
+            term_c = Signal(maxvalrange - drop)
+            term_d = Signal(maxvalrange - drop)
+            m.d.comb += [
+                term_c.eq((mul.o.c << o_stage.exp) >> drop),
+                term_d.eq((o_stage.data << (o_stage.exp + self.width_mul)) >> drop),
+            ]
+
+        o_rega = Signal(maxvalrange - drop)
+        o_regb = Signal(maxvalrange - drop)
         o_data = Signal(self.width_output)
         m.d.comb += o_data.eq(o_regb[-(self.gain + self.width_output):][:self.width_output]),
 
@@ -125,12 +210,12 @@ class FilterBank(Elaboratable):
             with m.If(o_stage.highest | mul.o.last):
                 m.d.sync += [
                     o_rega.eq(0),
-                    o_regb.eq(o_rega + (o_stage.data << self.width_mul)),
+                    o_regb.eq(o_rega + term_d),
                 ]
             with m.Else():
                 m.d.sync += [
-                    o_rega.eq(o_rega + mul.o.c),
-                    o_regb.eq(o_regb + (o_stage.data << self.width_mul) - mul.o.c),
+                    o_rega.eq(o_rega + term_c),
+                    o_regb.eq(o_regb + term_d - term_c),
                 ]
 
         with m.If(~self.source.valid | self.source.ready):
@@ -143,6 +228,190 @@ class FilterBank(Elaboratable):
 
         return m
 
+    def elaborate_lanes(self, platform):
+        m = Module()
+
+        nlanes = self.lanes
+        nbeats = -(-self.nbins // nlanes)
+        dw = len(self.sink.data) // nlanes
+        wm = self.width_mul
+
+        # The weights and filter boundaries of a frame do not depend on the
+        # data: each beat reads them for all its lanes from a ROM. A bin past
+        # the end of the frame is unused, and adds nothing.
+
+        lane_bits = wm + 4
+        lane_layout = [
+            ("w",        wm),
+            ("boundary", 1),
+            ("emit",     1),
+            ("used",     1),
+            ("last",     1),
+        ]
+
+        table = self.lane_table()
+        init = []
+        for beat in range(nbeats):
+            word = 0
+            for l in range(nlanes):
+                k = beat * nlanes + l
+                if k >= self.nbins:
+                    continue
+                w, boundary, emit = table[k]
+                entry = w | boundary << wm | emit << wm + 1 | 1 << wm + 2 | (k == self.nbins - 1) << wm + 3
+                word |= entry << l * lane_bits
+            init.append(word)
+
+        rom = Memory(depth=nbeats, width=nlanes * lane_bits, init=init)
+        m.submodules.rom_rp = rom_rp = rom.read_port(domain="comb")
+        for l, mul in enumerate(self.muls):
+            m.submodules["mul{}".format(l)] = mul
+
+        maxvalrange = int(math.log2(self.points[-1] - self.points[-3])) + self.width + self.width_mul
+
+        stage_layout = [
+            ("lane", lane_bits),
+            ("data", dw),
+        ]
+        if self.mant_width is not None:
+            stage_layout.append(("exp", self.exp_width))
+
+        # Each lane keeps the context of its products along with its own
+        # multiplier: the multipliers of a pool take their inputs and advance
+        # independently, in order.
+
+        i_stages = []
+        o_stages = []
+        for l, mul in enumerate(self.muls):
+            mul_stages = [
+                Record(stage_layout, name=f"stage{l}_{j}") for j in range(mul.pipe_stages + 1)
+            ]
+            for i, o in zip(mul_stages, mul_stages[1:]):
+                with m.If(mul.i.ready):
+                    m.d.sync += o.eq(i)
+            i_stages.append(mul_stages[ 0])
+            o_stages.append(mul_stages[-1])
+
+        def lane(rec):
+            fields = Record(lane_layout)
+            m.d.comb += fields.eq(rec.lane)
+            return fields
+
+        # Input: a beat is taken once all its lanes have taken it.
+
+        cnt = Signal(range(nbeats))
+        taken = Signal(nlanes)
+        lane_ready = Signal(nlanes)
+        m.d.comb += [
+            rom_rp.addr.eq(cnt),
+            self.sink.ready.eq(lane_ready.all()),
+        ]
+
+        for l, (mul, i_stage) in enumerate(zip(self.muls, i_stages)):
+            fields = lane(i_stage)
+            m.d.comb += [
+                i_stage.lane.eq(rom_rp.data.word_select(l, lane_bits)),
+                i_stage.data.eq(self.sink.data.word_select(l, dw)),
+                lane_ready[l].eq(taken[l] | mul.i.ready),
+                mul.i.valid.eq(self.sink.valid & ~taken[l]),
+                mul.i.a.eq(Mux(fields.used, i_stage.data, 0)),
+                mul.i.b.eq(fields.w),
+            ]
+            if self.mant_width is not None:
+                m.d.comb += i_stage.exp.eq(self.sink.exp.word_select(l, self.exp_width))
+            with m.If(self.sink.valid & self.sink.ready):
+                m.d.sync += taken[l].eq(0)
+            with m.Elif(mul.i.valid & mul.i.ready):
+                m.d.sync += taken[l].eq(1)
+
+        with m.If(self.sink.valid & self.sink.ready):
+            m.d.sync += cnt.eq(Mux(self.sink.last, 0, cnt + 1))
+
+        # Accumulate: the lanes of a beat go through the ascending and
+        # descending accumulators in order, and each boundary latches the
+        # output of the filter it ends.
+
+        if self.mant_width is None:
+            drop = 0
+        else:
+            drop = max(maxvalrange - (self.gain + self.width_output) - self.guard_bits, 0)
+
+        o_rega = Signal(maxvalrange - drop)
+        o_regb = Signal(maxvalrange - drop)
+
+        outs = Array(Signal(self.width_output, name="out{}".format(l)) for l in range(nlanes))
+        outs_last = Array(Signal(name="out{}_last".format(l)) for l in range(nlanes))
+        pending = Signal(nlanes)
+
+        rega, regb = o_rega, o_regb
+        emits = []
+        # the products of a beat are accumulated once all its lanes have
+        # them.
+        take = Signal()
+
+        for l, (mul, o_stage) in enumerate(zip(self.muls, o_stages)):
+            fields = lane(o_stage)
+            data = o_stage.data
+            term_c = Signal(maxvalrange - drop, name="term_c{}".format(l))
+            term_d = Signal(maxvalrange - drop, name="term_d{}".format(l))
+            if self.mant_width is None:
+                m.d.comb += [
+                    term_c.eq(mul.o.c),
+                    term_d.eq(Mux(fields.used, data << wm, 0)),
+                ]
+            else:
+                exp = o_stage.exp
+                m.d.comb += [
+                    term_c.eq((mul.o.c << exp) >> drop),
+                    term_d.eq(Mux(fields.used, (data << (exp + wm)) >> drop, 0)),
+                ]
+
+            next_a = Signal.like(o_rega, name="rega{}".format(l))
+            next_b = Signal.like(o_regb, name="regb{}".format(l))
+            m.d.comb += [
+                next_a.eq(Mux(fields.boundary, 0, rega + term_c)),
+                next_b.eq(Mux(fields.boundary, rega + term_d, regb + term_d - term_c)),
+            ]
+
+            with m.If(take):
+                m.d.sync += [
+                    outs[l].eq(regb[-(self.gain + self.width_output):][:self.width_output]),
+                    outs_last[l].eq(fields.last),
+                ]
+            emits.append(fields.emit)
+            rega, regb = next_a, next_b
+
+        # Output: the pending outputs of a beat are emitted in lane order,
+        # the next beat is taken once the last one leaves.
+
+        sel = Signal(range(nlanes))
+        for l in reversed(range(nlanes)):
+            with m.If(pending[l]):
+                m.d.comb += sel.eq(l)
+
+        remaining = Signal(nlanes)
+        m.d.comb += [
+            self.source.valid.eq(pending != 0),
+            self.source.data.eq(outs[sel]),
+            self.source.last.eq(outs_last[sel]),
+            remaining.eq(Mux(self.source.ready, pending & ~(1 << sel), pending)),
+        ]
+
+        m.d.comb += take.eq(Cat(mul.o.valid for mul in self.muls).all() & (remaining == 0))
+        for mul in self.muls:
+            m.d.comb += mul.o.ready.eq(take)
+
+        with m.If(take):
+            m.d.sync += [
+                o_rega.eq(rega),
+                o_regb.eq(regb),
+                pending.eq(Cat(*emits)),
+            ]
+        with m.Else():
+            m.d.sync += pending.eq(remaining)
+
+        return m
+
 
 if __name__ == "__main__":
     dut = FilterBank(width=31, width_output=32, multiplier_cls=Multiplier)
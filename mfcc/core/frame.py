@@ -47,17 +47,29 @@ class RotatingCounter(Elaboratable):
         return m
 
 class Frame(Elaboratable):
-    def __init__(self, width=16, windowlen=400, stepsize=160, nfft=512):
+    """With nchannels > 1, the samples of the channels are interleaved in
+    any order and tagged with their channel. Each channel has its own
+    Frame, and their frames are output whole, tagged with their channel."""
+    def __init__(self, width=16, windowlen=400, stepsize=160, nfft=512, nchannels=1):
         assert(windowlen <= nfft)
         self.width = width
         self.windowlen = windowlen
         self.stepsize = stepsize
         self.nfft = nfft
+        self.nchannels = nchannels
 
-        self.sink = stream.Endpoint([("data", (width, True))])
-        self.source = stream.Endpoint([("data", (width, True))])
+        layout = [("data", (width, True))]
+        if nchannels > 1:
+            layout.append(("channel", range(nchannels)))
+        self.sink = stream.Endpoint(layout)
+        self.source = stream.Endpoint(layout)
+
+        self.full = Signal()    # the whole window is in the memory
 
     def elaborate(self, platform):
+        if self.nchannels > 1:
+            return self.elaborate_channels(platform)
+
         sink = self.sink
         source = self.source
 
@@ -74,6 +86,7 @@ class Frame(Elaboratable):
 
         empty = (lvl == 0)
         full = (lvl == self.windowlen)
+        m.d.comb += self.full.eq(full)
         padding = (count_o.val >= self.windowlen)
         datasent = (source.valid & source.ready)
         jumping = (datasent & source.last)
@@ -154,6 +167,55 @@ class Frame(Elaboratable):
 
         return m
 
+    def elaborate_channels(self, platform):
+        sink = self.sink
+        source = self.source
+
+        m = Module()
+
+        frames = [Frame(width=self.width, windowlen=self.windowlen,
+                        stepsize=self.stepsize, nfft=self.nfft)
+                  for k in range(self.nchannels)]
+        for k, frame in enumerate(frames):
+            m.submodules["frame_{}".format(k)] = frame
+            m.d.comb += frame.sink.data.eq(sink.data)
+            with m.If(sink.channel == k):
+                m.d.comb += [
+                    frame.sink.valid.eq(sink.valid),
+                    sink.ready.eq(frame.sink.ready),
+                ]
+
+        # a frame is only started once its whole window is buffered: it is
+        #  output without waiting for the samples of its channel, which
+        #  can be queued behind the samples of a blocked channel.
+        sel = Signal(range(self.nchannels))
+        busy = Signal()
+
+        with m.If(busy):
+            with m.Switch(sel):
+                for k, frame in enumerate(frames):
+                    with m.Case(k):
+                        m.d.comb += frame.source.connect(source)
+            m.d.comb += source.channel.eq(sel)
+
+            with m.If(source.valid & source.ready & source.last):
+                m.d.sync += busy.eq(0)
+
+        # the next channel is picked in a round-robin order
+        with m.Else():
+            with m.Switch(sel):
+                for j in range(self.nchannels):
+                    with m.Case(j):
+                        for offset in reversed(range(1, self.nchannels + 1)):
+                            k = (j + offset) % self.nchannels
+                            with m.If(frames[k].source.valid & frames[k].full):
+                                m.d.sync += [
+                                    sel.eq(k),
+                                    busy.eq(1),
+                                ]
+
+        return m
+
 if __name__ == "__main__":
     dut = Frame(windowlen=25, stepsize=8, nfft=32)
 
@@ -1,10 +1,24 @@
 import math
+import numpy as np
 from nmigen import *
 from nmigen.sim import Simulator
+from nmigen.utils import bits_for
 from mfcc.misc import stream
 from mfcc.misc.mul import *
 
 
+def log2_table(precision, table_bits, guard_bits=2):
+    """log2(1 + i/2**table_bits) for i in [0, 2**table_bits], with
+    precision + guard_bits fractional bits. The half LSB needed to round
+    the interpolated result is folded into the table."""
+    i = np.arange((1 << table_bits) + 1)
+    y = np.round(np.log2(1 + i / (1 << table_bits)) * (1 << precision + guard_bits))
+    y = y.astype(np.int64)
+    if guard_bits > 0:
+        y += 1 << (guard_bits - 1)
+    return y
+
+
 class Log2FixCalc(Elaboratable):
     def __init__(self, width, precision, multiplier_cls=Multiplier, allow_fraction_input=False):
         self.i = stream.Endpoint([("data", width)])
@@ -104,8 +118,229 @@ class Log2FixCalc(Elaboratable):
             return m
 
 
+class Log2FixNorm(Elaboratable):
+    def __init__(self, width, precision, allow_fraction_input=False):
+        self.i = stream.Endpoint([("data", width)])
+        self.o = stream.Endpoint([("z", precision + 1), ("data", width)])
+
+        self.width = width
+        self.precision = precision
+        self.allow_fraction_input = allow_fraction_input
+
+    def elaborate(self, platform):
+        m = Module()
+
+        # a priority encoder finds the leading one, and a barrel shifter
+        # brings it to the bit `precision` of the mantissa in a single cycle.
+        # data holds the integer part of the logarithm.
+
+        msb = Signal(range(self.width))
+        for j in range(self.width):
+            with m.If(self.i.data[j]):
+                m.d.comb += msb.eq(j)
+
+        shift = Signal(range(self.width))
+        norm_z = Signal(self.precision + 1)
+        norm_data = Signal(self.width)
+
+        with m.If(msb >= self.precision):
+            m.d.comb += [
+                shift.eq(msb - self.precision),
+                norm_z.eq(self.i.data >> shift),
+                norm_data.eq(shift << self.precision),
+            ]
+        with m.Else():
+            if self.allow_fraction_input:
+                m.d.comb += [
+                    shift.eq(self.precision - msb),
+                    norm_z.eq(self.i.data << shift),
+                    norm_data.eq(-(shift << self.precision)),
+                ]
+            else:
+                m.d.comb += norm_z.eq(self.i.data)
+
+        with m.If(~self.o.valid | self.o.ready):
+            m.d.comb += self.i.ready.eq(1)
+            m.d.sync += [
+                self.o.z.eq(norm_z),
+                self.o.data.eq(norm_data),
+                self.o.valid.eq(self.i.valid),
+                self.o.last.eq(self.i.last),
+            ]
+
+        return m
+
+
+class Log2FixPipe(Elaboratable):
+    def __init__(self, width, precision, multiplier_cls=Multiplier, allow_fraction_input=False):
+        self.i = stream.Endpoint([("data", width)])
+        self.o = stream.Endpoint([("data", width)])
+
+        self.width = width
+        self.precision = precision
+        self.norm = Log2FixNorm(width, precision, allow_fraction_input)
+        self.muls = [multiplier_cls(self.precision + 1, self.precision + 1)
+                     for _ in range(self.precision - 1)]
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.norm = norm = self.norm
+        m.d.comb += self.i.connect(norm.i)
+        z = norm.o
+
+        # Iterations:
+        #  one squaring stage per fractional bit, each with its own
+        #  multiplier. The accumulated result travels along the multiplier
+        #  pipeline in the same way as FilterBank's mul_stages.
+
+        b = 1 << (self.precision - 1)
+        for k, mul in enumerate(self.muls):
+            m.submodules["mul_{}".format(k)] = mul
+
+            mul_stages = [Signal(self.width, name="stage_{}_{}".format(k, j))
+                          for j in range(mul.pipe_stages + 1)]
+            for i, o in zip(mul_stages, mul_stages[1:]):
+                with m.If(mul.i.ready):
+                    m.d.sync += o.eq(i)
+
+            m.d.comb += [
+                mul.i.a.eq(z.z),
+                mul.i.b.eq(z.z),
+                mul.i.valid.eq(z.valid),
+                mul.i.last.eq(z.last),
+                z.ready.eq(mul.i.ready),
+                mul_stages[0].eq(z.data),
+            ]
+
+            z_nxt = stream.Endpoint([("z", self.precision + 1), ("data", self.width)])
+            with m.If(mul.o.c[2 * self.precision + 1]):
+                m.d.comb += [
+                    z_nxt.z.eq(mul.o.c[self.precision + 1:]),
+                    z_nxt.data.eq(mul_stages[-1] + b),
+                ]
+            with m.Else():
+                m.d.comb += [
+                    z_nxt.z.eq(mul.o.c[self.precision:]),
+                    z_nxt.data.eq(mul_stages[-1]),
+                ]
+            m.d.comb += [
+                z_nxt.valid.eq(mul.o.valid),
+                z_nxt.last.eq(mul.o.last),
+                mul.o.ready.eq(z_nxt.ready),
+            ]
+
+            z = z_nxt
+            b >>= 1
+
+        m.d.comb += [
+            self.o.data.eq(z.data),
+            self.o.valid.eq(z.valid),
+            self.o.last.eq(z.last),
+            z.ready.eq(self.o.ready),
+        ]
+
+        return m
+
+
+class Log2FixTable(Elaboratable):
+    def __init__(self, width, precision, multiplier_cls=Multiplier, allow_fraction_input=False,
+                 table_bits=6, guard_bits=2):
+        assert(0 < table_bits < precision)
+        self.i = stream.Endpoint([("data", width)])
+        self.o = stream.Endpoint([("data", width)])
+
+        self.width = width
+        self.precision = precision
+        self.table_bits = table_bits
+        self.guard_bits = guard_bits
+
+        table = self.calc_table()
+        self.y_width = bits_for(max(table))
+        self.d_width = bits_for(max(b - a for a, b in zip(table, table[1:])))
+
+        self.norm = Log2FixNorm(width, precision, allow_fraction_input)
+        self.mul = multiplier_cls(self.d_width, precision - table_bits)
+
+    def calc_table(self):
+        return [int(y) for y in log2_table(self.precision, self.table_bits, self.guard_bits)]
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.norm = norm = self.norm
+        m.submodules.mul = mul = self.mul
+        m.d.comb += self.i.connect(norm.i)
+
+        # each word holds a point of the curve and the slope to the next one
+        table = self.calc_table()
+        init = [y0 | (y1 - y0) << self.y_width for y0, y1 in zip(table, table[1:])]
+        mem = Memory(depth=len(init), width=self.y_width + self.d_width, init=init)
+        m.submodules.mem_rp = mem_rp = mem.read_port(transparent=False)
+
+        # Lookup:
+        #  the upper bits of the mantissa index the table, the remaining ones
+        #  interpolate between two points.
+
+        rem_width = self.precision - self.table_bits
+        frac = norm.o.z[:self.precision]
+
+        lut = stream.Endpoint([("rem", rem_width), ("data", self.width)])
+
+        with m.If(~lut.valid | lut.ready):
+            m.d.comb += norm.o.ready.eq(1)
+            m.d.sync += [
+                lut.rem.eq(frac[:rem_width]),
+                lut.data.eq(norm.o.data),
+                lut.valid.eq(norm.o.valid),
+                lut.last.eq(norm.o.last),
+            ]
+        m.d.comb += [
+            mem_rp.addr.eq(frac[rem_width:]),
+            mem_rp.en.eq(norm.o.ready),
+        ]
+
+        y0 = mem_rp.data[:self.y_width]
+        dy = mem_rp.data[self.y_width:]
+
+        # Interpolation
+
+        mul_stages = [
+            Record([
+                ("y0",   self.y_width),
+                ("data", self.width),
+            ], name=f"stage_{j}") for j in range(mul.pipe_stages + 1)
+        ]
+        for i, o in zip(mul_stages, mul_stages[1:]):
+            with m.If(mul.i.ready):
+                m.d.sync += o.eq(i)
+
+        m.d.comb += [
+            mul_stages[0].y0.eq(y0),
+            mul_stages[0].data.eq(lut.data),
+
+            mul.i.a.eq(dy),
+            mul.i.b.eq(lut.rem),
+            mul.i.valid.eq(lut.valid),
+            mul.i.last.eq(lut.last),
+            lut.ready.eq(mul.i.ready),
+        ]
+
+        o_stage = mul_stages[-1]
+        interp = (o_stage.y0 + (mul.o.c >> rem_width)) >> self.guard_bits
+
+        m.d.comb += [
+            self.o.data.eq(o_stage.data + interp),
+            self.o.valid.eq(mul.o.valid),
+            self.o.last.eq(mul.o.last),
+            mul.o.ready.eq(self.o.ready),
+        ]
+
+        return m
+
+
 class Log2Fix(Elaboratable):
-    def __init__(self, width, width_output, multiplier_cls=Multiplier):
+    def __init__(self, width, width_output, multiplier_cls=Multiplier, calc_cls=Log2FixCalc):
         self.sink   = stream.Endpoint([("data", width)])
         self.source = stream.Endpoint([("data", width_output)])
 
@@ -113,7 +348,7 @@ class Log2Fix(Elaboratable):
         self.width_output = width_output
         self.precision = width_output - math.ceil(math.log2(width))
 
-        self.log2 = Log2FixCalc(width=width + self.precision, precision=self.precision, multiplier_cls=multiplier_cls)
+        self.log2 = calc_cls(width=width + self.precision, precision=self.precision, multiplier_cls=multiplier_cls)
 
     def elaborate(self, platform):
         m = Module()
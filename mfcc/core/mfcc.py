@@ -1,10 +1,13 @@
+from functools import partial
+
 from nmigen import *
-from nmigen.sim import Simulator, Passive
+from nmigen.sim import Simulator, Passive, Delay, Settle
 
 from .frame import *
 from .window import *
 from .fft_stream import *
 from .dct_stream import *
+from .dct_mac import *
 from .pow2 import *
 from .filterbank import *
 from .log import *
@@ -18,16 +21,65 @@ __all__ = ["MFCC"]
 
 class MFCC(Elaboratable):
     def __init__(self, width=16, nfft=512, samplerate=16e3,
-                 nfilters=16, nceptrums=16):
+                 nfilters=16, nceptrums=16, fmin=0, fmax=None,
+                 fft_nbanks=1, fft_real=False, fft_radix=2, fft_nbutterflies=1, fft_engine="block",
+                 fft_m_width=None, fft_bfp=False, power_mode="exact",
+                 filter_mant_width=None, dct_engine="fft4", dct_nlanes=1,
+                 mul_pool=None, mul_pipe_stages=1, nchannels=1, register_slices=None,
+                 fifo_depths=None, windowlen=None):
+        if windowlen is None:
+            windowlen = nfft
+        if not isinstance(windowlen, int) or not nfft//3 <= windowlen <= nfft:
+            raise ValueError("Window length must be an integer between the step ({}) and "
+                             "nfft ({}), not {!r}"
+                             .format(nfft//3, nfft, windowlen))
+        if not isinstance(nchannels, int) or nchannels <= 0:
+            raise ValueError("Channel count must be a positive integer, not {!r}"
+                             .format(nchannels))
+        if register_slices not in (None, "valid", "ready", "skid"):
+            raise ValueError("Register slices must be None, 'valid', 'ready' or 'skid', not {!r}"
+                             .format(register_slices))
+        if fifo_depths is not None and (not set(fifo_depths) <= {"power", "filter", "channels"} or
+                any(not isinstance(d, int) or d < 2 for d in fifo_depths.values())):
+            raise ValueError("FIFO depths must be integers of at least 2 for 'power', 'filter' "
+                             "or 'channels', not {!r}"
+                             .format(fifo_depths))
         self.width = width
         self.nfft = nfft
+        self.windowlen = windowlen
         self.samplerate = samplerate
         self.nfilters = nfilters
         self.nceptrums = nceptrums
-
+        self.fmin = fmin
+        self.fmax = fmax
+        self.fft_nbanks = fft_nbanks
+        self.fft_real = fft_real
+        self.fft_radix = fft_radix
+        self.fft_nbutterflies = fft_nbutterflies
+        self.fft_engine = fft_engine
+        self.fft_m_width = fft_m_width
+        self.fft_bfp = fft_bfp
+        self.power_mode = power_mode
+        self.filter_mant_width = filter_mant_width
+        self.dct_engine = dct_engine
+        self.dct_nlanes = dct_nlanes
+        self.mul_pool = mul_pool
+        self.mul_pipe_stages = mul_pipe_stages
+        self.nchannels = nchannels
+        self.register_slices = register_slices
+        # the FIFOs after the power spectrum and the filter bank, and the
+        # channels of the frames in the pipeline
+        self.fifo_depths = {"power": 4, "filter": nfilters, "channels": 8}
+        self.fifo_depths.update(fifo_depths or {})
+
+        # with several channels, the samples and the cepstra are tagged
+        # with their channel.
+        layout = [("data", (width, True))]
+        if nchannels > 1:
+            layout.append(("channel", range(nchannels)))
         self.reset = Signal()
-        self.sink = stream.Endpoint([("data", (width, True))])
-        self.source = stream.Endpoint([("data", (width, True))])
+        self.sink = stream.Endpoint(layout)
+        self.source = stream.Endpoint(layout)
 
     def elaborate(self, platform):
         sink = self.sink
@@ -35,72 +87,191 @@ class MFCC(Elaboratable):
 
         m = Module()
 
-        preemph = Preemph(width=self.width)
+        # the window, power spectrum, filter bank and logarithm can share a
+        # pool of multipliers, the DCT keeps its own. All of them are
+        # registered over mul_pipe_stages stages.
+        mac_multiplier_cls = partial(Multiplier, pipe_stages=self.mul_pipe_stages)
+        if self.mul_pool is None:
+            multiplier_cls = mac_multiplier_cls
+        else:
+            mul_pool = MultiplierPool(size=self.mul_pool, pipe_stages=self.mul_pipe_stages)
+            m.submodules.mul_pool = mul_pool
+            multiplier_cls = mul_pool.port
+
+        # the channels have their own pre-emphasis state and frame
+        # memories, their frames are interleaved through the other stages.
+        # The windows are zero-padded from windowlen to nfft samples.
+        preemph = Preemph(width=self.width, nchannels=self.nchannels)
         m.submodules.preemph = preemph
 
         frame = Frame(width=self.width,
-                      windowlen=self.nfft,
+                      windowlen=self.windowlen,
                       stepsize=self.nfft//3,
-                      nfft=self.nfft)
+                      nfft=self.nfft,
+                      nchannels=self.nchannels)
         m.submodules.frame = frame
 
         window = WindowHamming(width=self.width,
                                nfft=self.nfft,
-                               precision=8)
+                               precision=8,
+                               multiplier_cls=multiplier_cls)
         m.submodules.window = window
 
-        fft_stream = FftStream(width=self.width,
-                               nfft=self.nfft)
-        m.submodules.fft_stream = fft_stream
-
-        fifo_fft = stream.SyncFIFO(fft_stream.source.description,
-                                   self.nfft//2, buffered=True)
-        m.submodules.fifo_fft = fifo_fft
-
-        powspec = PowerSpectrum(width=self.width,
-                                width_output=30,
-                                multiplier_cls=Multiplier) # DoubleShifter) # XXX
-        m.submodules.powspec = powspec
-
-        fifo_power = stream.SyncFIFO(powspec.source.description,
-                                     4, buffered=True)
-        m.submodules.fifo_power = fifo_power
-
-        filterbank = FilterBank(width=powspec.width_output,
+        # the filters are built first, the FFT only computes and emits the
+        # bins they use.
+        # The bins are squared as they are read out of the FFT memory, which
+        # is only released once the filter bank has taken them.
+        power_width = 30
+        filterbank = FilterBank(width=power_width,
                                 width_output=16,
+                                width_mul=self.filter_mant_width,
                                 gain=18,
                                 sample_rate=self.samplerate,
                                 nfft=self.nfft,
                                 ntap=self.nfilters,
-                                multiplier_cls=Multiplier) # DoubleShifter) # XXX
+                                fmin=self.fmin,
+                                fmax=self.fmax,
+                                mant_width=self.filter_mant_width,
+                                multiplier_cls=multiplier_cls) # DoubleShifter) # XXX
+
+        # the block FFT skips the zero padding, the streaming one takes
+        # every sample.
+        i_size = None if self.fft_engine == "sdf" else self.windowlen
+        fft_stream = FftStream(width=self.width,
+                               nfft=self.nfft,
+                               nbanks=self.fft_nbanks,
+                               real=self.fft_real,
+                               radix=self.fft_radix,
+                               nbutterflies=self.fft_nbutterflies,
+                               engine=self.fft_engine,
+                               m_width=self.fft_m_width,
+                               bfp=self.fft_bfp,
+                               i_size=i_size,
+                               first_bin=filterbank.first_bin,
+                               nbins=filterbank.nbins,
+                               power_width=power_width,
+                               power_mode=self.power_mode,
+                               multiplier_cls=multiplier_cls) # DoubleShifter) # XXX
+        m.submodules.fft_stream = fft_stream
+        powspec = fft_stream.powspec
+
+        # the filter bank can take the power as a narrower mantissa and
+        # an exponent.
+        if self.filter_mant_width is None:
+            normalize = None
+        else:
+            normalize = PowerNormalize(width=power_width,
+                                       mant_width=self.filter_mant_width)
+            m.submodules.normalize = normalize
+
+        fifo_power = stream.SyncFIFO(filterbank.sink.description,
+                                     self.fifo_depths["power"], buffered=True)
+        m.submodules.fifo_power = fifo_power
+
         m.submodules.filterbank = filterbank
 
         fifo_filter = stream.SyncFIFO(filterbank.source.description,
-                                      self.nfilters, buffered=True)
+                                      self.fifo_depths["filter"], buffered=True)
         m.submodules.fifo_filter = fifo_filter
 
-        m.submodules.log2 = log2 = Log2Fix(filterbank.width_output, 15, multiplier_cls=Multiplier)
-
-        dct_stream = DCTStream(width=self.width, nfft=self.nfilters)
+        m.submodules.log2 = log2 = Log2Fix(filterbank.width_output, 15, multiplier_cls=multiplier_cls)
+
+        # the MAC DCT only computes the kept cepstra.
+        if self.dct_engine == "mac":
+            dct_stream = DCTMac(width=self.width, nfft=self.nfilters,
+                                first=0, count=self.nceptrums,
+                                nlanes=self.dct_nlanes,
+                                multiplier_cls=mac_multiplier_cls)
+            discard = None
+        else:
+            dct_stream = DCTStream(width=self.width, nfft=self.nfilters,
+                                   radix=self.fft_radix,
+                                   nbutterflies=self.fft_nbutterflies,
+                                   engine=self.dct_engine)
+            discard = Discard(width=self.width, first=0, count=self.nceptrums)
+            m.submodules.discard = discard
         m.submodules.dct_stream = dct_stream
 
-        discard = Discard(width=self.width, first=0, count=self.nceptrums)
-        m.submodules.discard = discard
+        # the stages can be joined by register slices, to break the
+        # valid and ready paths which go through them. The FIFOs already
+        # register both.
+        slice_cls = {
+            None:    None,
+            "valid": stream.PipeValid,
+            "ready": stream.PipeReady,
+            "skid":  stream.SkidBuffer,
+        }[self.register_slices]
+
+        def pipe(name, sink):
+            if slice_cls is None:
+                return sink
+            pipe = slice_cls(sink.description)
+            m.submodules["slice_" + name] = pipe
+            m.d.comb += pipe.source.connect(sink)
+            return pipe.sink
+
+        if normalize is None:
+            m.d.comb += fft_stream.source.connect(fifo_power.sink)
+        else:
+            m.d.comb += [
+                fft_stream.source.connect(pipe("normalize", normalize.sink)),
+                normalize.source.connect(fifo_power.sink),
+            ]
+
+        window_sink = pipe("window", window.sink)
+        source_sink = pipe("source", source)
 
         m.d.comb += [
-            sink.connect(preemph.sink),
-            preemph.source.connect(frame.sink),
-            frame.source.connect(window.sink),
-            window.source.connect(fft_stream.sink),
-            fft_stream.source.connect(fifo_fft.sink),
-            fifo_fft.source.connect(powspec.sink),
-            powspec.source.connect(fifo_power.sink),
+            sink.connect(pipe("preemph", preemph.sink)),
+            preemph.source.connect(pipe("frame", frame.sink)),
+            window.source.connect(pipe("fft_stream", fft_stream.sink)),
             fifo_power.source.connect(filterbank.sink),
             filterbank.source.connect(fifo_filter.sink),
             fifo_filter.source.connect(log2.sink),
-            log2.source.connect(dct_stream.sink),
-            dct_stream.source.connect(discard.sink),
-            discard.source.connect(source),
+            log2.source.connect(pipe("dct_stream", dct_stream.sink)),
+        ]
+
+        if discard is None:
+            m.d.comb += dct_stream.source.connect(source_sink)
+        else:
+            m.d.comb += [
+                dct_stream.source.connect(pipe("discard", discard.sink)),
+                discard.source.connect(source_sink),
+            ]
+
+        # the frames go through the stages in order: the channel of each
+        # frame is queued until its cepstra are output. A frame is only
+        # started if its channel can be queued.
+        # the streaming FFT is only flushed when its sink is idle at a frame
+        # boundary: a frame is only started once it is whole in the memory,
+        # as with several channels.
+        stall = Const(0)
+        if self.nchannels == 1:
+            channels = None
+            if self.fft_engine == "sdf":
+                stall = frame.source.first & ~frame.full
+        else:
+            channels = stream.SyncFIFO([("channel", range(self.nchannels))],
+                                       self.fifo_depths["channels"])
+            m.submodules.channels = channels
+
+            stall = frame.source.first & ~channels.sink.ready
+            m.d.comb += [
+                channels.sink.channel.eq(frame.source.channel),
+                channels.sink.valid.eq(frame.source.valid & frame.source.first &
+                                       window_sink.ready),
+
+                source_sink.channel.eq(channels.source.channel),
+                channels.source.ready.eq(source_sink.valid & source_sink.ready &
+                                         source_sink.last),
+            ]
+
+        m.d.comb += [
+            window_sink.data.eq(frame.source.data),
+            window_sink.first.eq(frame.source.first),
+            window_sink.last.eq(frame.source.last),
+            window_sink.valid.eq(frame.source.valid & ~stall),
+            frame.source.ready.eq(window_sink.ready & ~stall),
         ]
 
         # for simulator
@@ -108,22 +279,106 @@ class MFCC(Elaboratable):
         self.window = window
         self.fft_stream = fft_stream
         self.powspec = powspec
+        self.fifo_power = fifo_power
         self.filterbank = filterbank
+        self.fifo_filter = fifo_filter
         self.log2 = log2
         self.dct_stream = dct_stream
         self.discard = discard
+        self.channels = channels
 
         m = ResetInserter(self.reset)(m)
         return m
 
 
 def test():
-    import matplotlib.pyplot as plt
-    import matplotlib.colors as mcolors
+    import argparse
+    import time
+    import numpy as np
     from scipy.io import wavfile
 
-    dut = MFCC(nfft=512, nfilters=32, nceptrums=16)
-    sample_rate, audio = wavfile.read("f2bjrop1.0.wav")
+    parser = argparse.ArgumentParser(description="Simulate the MFCC core on a WAV file.")
+    parser.add_argument("wav", nargs="?", default="f2bjrop1.0.wav",
+                        help="input audio file (default: %(default)s)")
+    parser.add_argument("-o", "--output", default="mfcc.npy",
+                        help="cepstra output file (default: %(default)s)")
+    parser.add_argument("-n", "--nframes", type=int, default=None,
+                        help="stop after this many frames (default: whole file)")
+    parser.add_argument("--vcd", default=None,
+                        help="write a waveform trace to this file")
+    parser.add_argument("--collect", action="store_true",
+                        help="collect the output of every pipeline stage")
+    parser.add_argument("--plot", action="store_true",
+                        help="plot the collected stages (implies --collect)")
+    parser.add_argument("--check", action="store_true",
+                        help="compare the cepstra against mfcc.model")
+    parser.add_argument("--mul-pool", type=int, default=None,
+                        help="share this many multipliers between the stages")
+    parser.add_argument("--mul-pipe", type=int, default=1,
+                        help="pipeline stages of the multipliers (default: %(default)s)")
+    parser.add_argument("--clock", type=float, default=50,
+                        help="clock frequency of the real-time budget, in MHz (default: %(default)s)")
+    parser.add_argument("--register-slices", choices=["valid", "ready", "skid"], default=None,
+                        help="join the stages with register slices")
+    parser.add_argument("--windowlen", type=int, default=None,
+                        help="samples per window, zero-padded to the FFT size (default: 512)")
+    parser.add_argument("--channels", type=int, default=1,
+                        help="interleave this many channels, each one the audio file "
+                             "rotated by a fraction of its length (default: %(default)s)")
+    args = parser.parse_args()
+    args.collect |= args.plot
+
+    dut = MFCC(nfft=512, nfilters=32, nceptrums=16, mul_pool=args.mul_pool,
+               mul_pipe_stages=args.mul_pipe, nchannels=args.channels,
+               register_slices=args.register_slices, windowlen=args.windowlen)
+    sample_rate, audio = wavfile.read(args.wav)
+    nchannels = dut.nchannels
+    audios = [np.roll(audio, k * len(audio) // nchannels) for k in range(nchannels)]
+    # the samples of the channels are interleaved
+    signal = [(int(a), k) for samples in zip(*audios) for k, a in enumerate(samples)]
+
+    sim = Simulator(dut)
+    sim.add_clock(1e-6) # 1 MHz
+
+    windowlen = dut.frame.windowlen
+    stepsize = dut.frame.stepsize
+    nframes = max(0, (len(audio) - windowlen) // stepsize + 1)
+    if args.nframes is not None:
+        nframes = min(nframes, args.nframes)
+
+    cepstra = [[] for k in range(nchannels)]
+    ends = []
+
+    def bench():
+        idx = 0
+        cycle = 0
+        output = [[] for k in range(nchannels)]
+        yield dut.source.ready.eq(1)
+
+        while sum(map(len, cepstra)) < nframes * nchannels:
+            if idx < len(signal):
+                data, channel = signal[idx]
+                yield dut.sink.data.eq(data)
+                if nchannels > 1:
+                    yield dut.sink.channel.eq(channel)
+                yield dut.sink.valid.eq(1)
+            else:
+                yield dut.sink.valid.eq(0)
+            yield Settle()
+
+            consumed = (yield dut.sink.valid) and (yield dut.sink.ready)
+            if (yield dut.source.valid):
+                channel = (yield dut.source.channel) if nchannels > 1 else 0
+                output[channel].append((yield dut.source.data))
+                if (yield dut.source.last):
+                    cepstra[channel].append(output[channel])
+                    ends.append(cycle)
+                    output[channel] = []
+            yield
+            cycle += 1
+
+            if consumed:
+                idx += 1
 
     def gen_collector(name, src, list_o, field="data"):
         def collector():
@@ -140,68 +395,73 @@ def test():
                 yield; yield Delay()
         return collector
 
-    def bench():
-        idx = 0
-        signal = [int(a) for a in audio]
-        nframes = 3 # (len(audio) - dut.frame.nfft) // dut.frame.stepsize + 1 + 1
-        yield dut.source.ready.eq(1)
-
-        while len(chain[-1]) < nframes:
-            if idx < len(signal):
-                yield dut.sink.data.eq(signal[idx])
-            else:
-                yield dut.sink.data.eq(0) # padding
-            yield dut.sink.valid.eq(1)
-            yield; yield Delay()
-
-            while not (yield dut.sink.ready):
-                yield; yield Delay()
-            idx += 1
-
-        yield dut.sink.valid.eq(0)
-        yield dut.reset.eq(1)
-        yield
-        yield dut.reset.eq(0)
-        yield
-
-    sim = Simulator(dut)
-    sim.add_clock(1e-6) # 1 MHz
     sim.add_sync_process(bench)
 
     chain = [[] for i in range(9)]
-
-    chain[0] = [audio[i: i + dut.frame.windowlen]
-               for i in range(0, len(audio), dut.frame.stepsize)]
-
-    sim.add_sync_process(gen_collector("frame", dut.frame.source, chain[1]))
-    sim.add_sync_process(gen_collector("window", dut.window.source, chain[2]))
-    sim.add_sync_process(gen_collector("fft", dut.fft_stream.source, chain[3], field="data_r"))
-    sim.add_sync_process(gen_collector("power", dut.powspec.source, chain[4]))
-    sim.add_sync_process(gen_collector("filter", dut.filterbank.source, chain[5]))
-    sim.add_sync_process(gen_collector("log", dut.log2.source, chain[6]))
-    sim.add_sync_process(gen_collector("dct", dut.dct_stream.source, chain[7]))
-    sim.add_sync_process(gen_collector("discard", dut.discard.source, chain[8]))
-
-    with sim.write_vcd("top.vcd"):
+    if args.collect:
+        chain[0] = [audio[i: i + windowlen]
+                   for i in range(0, len(audio), stepsize)]
+
+        sim.add_sync_process(gen_collector("frame", dut.frame.source, chain[1]))
+        sim.add_sync_process(gen_collector("window", dut.window.source, chain[2]))
+        sim.add_sync_process(gen_collector("fft", dut.fft_stream.bins, chain[3], field="data_r"))
+        sim.add_sync_process(gen_collector("power", dut.powspec.source, chain[4]))
+        sim.add_sync_process(gen_collector("filter", dut.filterbank.source, chain[5]))
+        sim.add_sync_process(gen_collector("log", dut.log2.source, chain[6]))
+        sim.add_sync_process(gen_collector("dct", dut.dct_stream.source, chain[7]))
+        cepstra_src = (dut.discard or dut.dct_stream).source
+        sim.add_sync_process(gen_collector("discard", cepstra_src, chain[8]))
+
+    start = time.time()
+    if args.vcd:
+        with sim.write_vcd(args.vcd):
+            sim.run()
+    else:
         sim.run()
-
-    print("window", chain[2])
-    print("fft", chain[3])
-    print("power", chain[4])
-    print("filter", chain[5])
-    print("log", chain[6])
-    print("dct", chain[7])
-    print("discard", chain[8])
-
-    nplots = len(chain)
-    nframes = len(chain[-1])
-
-    for i in range(nframes):
-        fig, axs = plt.subplots(nplots, figsize=(10,10))
-        colors = list(mcolors.TABLEAU_COLORS)
-        for j in range(nplots):
-            axs[j].plot(chain[j][i], color=colors[j])
-    plt.show()
+    elapsed = time.time() - start
+
+    cepstra = [np.array(c, dtype=np.int16).reshape(-1, dut.nceptrums) for c in cepstra]
+    np.save(args.output, cepstra[0] if nchannels == 1 else np.array(cepstra))
+    print("{} frames in {:.1f}s: {:.2f} frames/s".format(
+          len(ends), elapsed, len(ends) / elapsed))
+
+    # the input is given as fast as it is taken: once the pipeline is full,
+    # a frame takes as many cycles as its slowest stage. The channels share
+    # the budget of one step.
+    if len(ends) > 2:
+        cycles = (ends[-1] - ends[1]) / (len(ends) - 2)
+        budget = stepsize * args.clock * 1e6 / dut.samplerate / nchannels
+        print("{:.0f} cycles per frame, real-time budget at {:g} MHz: {:.0f} cycles ({:.1%} used)"
+              .format(cycles, args.clock, budget, cycles / budget))
+
+    if args.check:
+        from ..model import MFCCModel
+        model = MFCCModel(width=dut.width, nfft=dut.nfft, windowlen=dut.windowlen,
+                          samplerate=dut.samplerate,
+                          nfilters=dut.nfilters, nceptrums=dut.nceptrums,
+                          fmin=dut.fmin, fmax=dut.fmax,
+                          fft_real=dut.fft_real, fft_m_width=dut.fft_m_width,
+                          fft_bfp=dut.fft_bfp, power_mode=dut.power_mode,
+                          filter_mant_width=dut.filter_mant_width,
+                          dct_engine=dut.dct_engine)
+        mismatches = 0
+        for c, a in zip(cepstra, audios):
+            mismatches += np.count_nonzero(c != model(a)[:len(c)])
+        print("model check: {} mismatching coefficients".format(mismatches))
+
+    if args.plot:
+        import matplotlib.pyplot as plt
+        import matplotlib.colors as mcolors
+
+        nplots = len(chain)
+        nframes = len(chain[-1])
+
+        for i in range(nframes):
+            fig, axs = plt.subplots(nplots, figsize=(10,10))
+            colors = list(mcolors.TABLEAU_COLORS)
+            for j in range(nplots):
+                axs[j].plot(chain[j][i], color=colors[j])
+        plt.show()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,265 @@
+from nmigen import *
+from nmigen.sim import Simulator, Settle
+
+from .mfcc import *
+from ..misc import stream
+
+
+__all__ = ["MFCCArray"]
+
+
+class MFCCArray(Elaboratable):
+    """ncores independent MFCC cores of nchannels channels each.
+
+    The samples of the ncores * nchannels channels are interleaved in any
+    order on sink, tagged with their channel, and split between the cores:
+    channel c goes to channel c % nchannels of core c // nchannels. The
+    frames of the cores are merged on source in a round-robin order, each
+    one whole and tagged with its channel. The other arguments are given to
+    every MFCC.
+    """
+    def __init__(self, ncores=2, nchannels=1, **kwargs):
+        if not isinstance(ncores, int) or ncores <= 0:
+            raise ValueError("Core count must be a positive integer, not {!r}"
+                             .format(ncores))
+        self.ncores = ncores
+        self.nchannels = nchannels
+        self.cores = [MFCC(nchannels=nchannels, **kwargs) for n in range(ncores)]
+
+        layout = [
+            ("data", (self.cores[0].width, True)),
+            ("channel", range(ncores * nchannels)),
+        ]
+        self.reset = Signal()
+        self.sink = stream.Endpoint(layout)
+        self.source = stream.Endpoint(layout)
+
+    def elaborate(self, platform):
+        sink = self.sink
+        source = self.source
+
+        m = Module()
+
+        for n, core in enumerate(self.cores):
+            m.submodules["core_{}".format(n)] = core
+            m.d.comb += [
+                core.reset.eq(self.reset),
+                core.sink.data.eq(sink.data),
+            ]
+
+        # splitter
+        with m.Switch(sink.channel):
+            for c in range(self.ncores * self.nchannels):
+                core = self.cores[c // self.nchannels]
+                with m.Case(c):
+                    m.d.comb += [
+                        core.sink.valid.eq(sink.valid),
+                        sink.ready.eq(core.sink.ready),
+                    ]
+                    if self.nchannels > 1:
+                        m.d.comb += core.sink.channel.eq(c % self.nchannels)
+
+        # the cores keep their frames while another one is output. The
+        # next core is picked in a round-robin order as soon as a frame
+        # ends, and kept from its first beat on.
+        sel = Signal(range(self.ncores))
+        busy = Signal()
+        grant = Signal(range(self.ncores))
+
+        m.d.comb += grant.eq(sel)
+        with m.If(~busy):
+            with m.Switch(sel):
+                for j in range(self.ncores):
+                    with m.Case(j):
+                        for offset in reversed(range(1, self.ncores + 1)):
+                            n = (j + offset) % self.ncores
+                            with m.If(self.cores[n].source.valid):
+                                m.d.comb += grant.eq(n)
+
+        with m.Switch(grant):
+            for n, core in enumerate(self.cores):
+                with m.Case(n):
+                    m.d.comb += [
+                        source.valid.eq(core.source.valid),
+                        source.first.eq(core.source.first),
+                        source.last.eq(core.source.last),
+                        source.data.eq(core.source.data),
+                        core.source.ready.eq(source.ready),
+                    ]
+                    if self.nchannels > 1:
+                        m.d.comb += source.channel.eq(n * self.nchannels + core.source.channel)
+                    else:
+                        m.d.comb += source.channel.eq(n)
+
+        with m.If(source.valid):
+            m.d.sync += [
+                sel.eq(grant),
+                busy.eq(1),
+            ]
+        with m.If(source.valid & source.ready & source.last):
+            m.d.sync += busy.eq(0)
+
+        m = ResetInserter(self.reset)(m)
+        return m
+
+
+import unittest
+
+class MFCCArrayTestCase(unittest.TestCase):
+    def check(self, ncores=2, nchannels=1, nfft=128, nfilters=8, nceptrums=8, nframes=2):
+        import numpy as np
+        from ..model import MFCCModel
+        from ..model.mfcc import chirp
+
+        dut = MFCCArray(ncores=ncores, nchannels=nchannels,
+                        nfft=nfft, nfilters=nfilters, nceptrums=nceptrums)
+        model = MFCCModel(nfft=nfft, nfilters=nfilters, nceptrums=nceptrums)
+
+        nchannels *= ncores
+        length = model.windowlen + (nframes - 1) * model.stepsize
+        audios = [chirp(length, seed=c) for c in range(nchannels)]
+        signal = [(int(a), c) for samples in zip(*audios) for c, a in enumerate(samples)]
+
+        sim = Simulator(dut)
+        sim.add_clock(1e-6)
+
+        def sender():
+            for data, channel in signal:
+                yield dut.sink.valid.eq(1)
+                yield dut.sink.data.eq(data)
+                yield dut.sink.channel.eq(channel)
+                yield Settle()
+                while not (yield dut.sink.ready):
+                    yield
+                    yield Settle()
+                yield
+            yield dut.sink.valid.eq(0)
+
+        def receiver():
+            rng = np.random.default_rng(0)
+            cepstra = [[] for c in range(nchannels)]
+            output = [[] for c in range(nchannels)]
+            ended = False
+            cycle = 0
+            while sum(map(len, cepstra)) < nframes * nchannels:
+                self.assertLess(cycle, 100 * nfft * nframes * nchannels, "the array stalled")
+                cycle += 1
+                # random backpressure
+                yield dut.source.ready.eq(int(rng.integers(0, 2)))
+                yield Settle()
+                # the next frame follows the end of a frame without a gap
+                if ended:
+                    for core in dut.cores:
+                        if (yield core.source.valid):
+                            self.assertTrue((yield dut.source.valid))
+                ended = False
+                if (yield dut.source.valid) and (yield dut.source.ready):
+                    channel = yield dut.source.channel
+                    output[channel].append((yield dut.source.data))
+                    if (yield dut.source.last):
+                        cepstra[channel].append(output[channel])
+                        output[channel] = []
+                        ended = True
+                yield
+            for c, audio in enumerate(audios):
+                self.assertEqual(cepstra[c], model(audio).tolist())
+
+        sim.add_sync_process(sender)
+        sim.add_sync_process(receiver)
+        sim.run()
+
+    def test_cores_2(self):
+        self.check()
+
+    def test_cores_3_channels_2(self):
+        self.check(ncores=3, nchannels=2)
+
+
+if __name__ == "__main__":
+    import argparse
+    import numpy as np
+    from scipy.io import wavfile
+    from ..model import MFCCModel
+
+    parser = argparse.ArgumentParser(
+        description="Simulate MFCC arrays and report their aggregate frame rate.")
+    parser.add_argument("wav", nargs="?", default="f2bjrop1.0.wav",
+                        help="input audio file (default: %(default)s)")
+    parser.add_argument("--cores", default="1,2,4",
+                        help="comma-separated core counts (default: %(default)s)")
+    parser.add_argument("--channels", type=int, default=1,
+                        help="channels per core (default: %(default)s)")
+    parser.add_argument("-n", "--nframes", type=int, default=3,
+                        help="frames per channel (default: %(default)s)")
+    parser.add_argument("--link", type=int, default=1,
+                        help="cycles per coefficient of the output link (default: %(default)s)")
+    parser.add_argument("--clock", type=float, default=50,
+                        help="clock frequency, in MHz (default: %(default)s)")
+    args = parser.parse_args()
+
+    sample_rate, audio = wavfile.read(args.wav)
+    clock = args.clock * 1e6
+
+    print("| cores | channels | cycles per frame | frames/s at {:g} MHz | real-time channels "
+          "| output link used | model mismatches |".format(args.clock))
+    print("|------:|---------:|-----------------:|------:|------:|------:|------:|")
+
+    for ncores in map(int, args.cores.split(",")):
+        dut = MFCCArray(ncores=ncores, nchannels=args.channels,
+                        nfft=512, nfilters=32, nceptrums=16)
+        mfcc = dut.cores[0]
+        nchannels = ncores * args.channels
+        windowlen = mfcc.windowlen
+        stepsize = mfcc.nfft // 3
+        length = windowlen + (args.nframes - 1) * stepsize
+
+        audios = [np.roll(audio, c * len(audio) // nchannels)[:length] for c in range(nchannels)]
+        signal = [(int(a), c) for samples in zip(*audios) for c, a in enumerate(samples)]
+        cepstra = [[] for c in range(nchannels)]
+        ends = []
+
+        def bench():
+            idx = 0
+            cycle = 0
+            output = [[] for c in range(nchannels)]
+
+            while len(ends) < args.nframes * nchannels:
+                if idx < len(signal):
+                    yield dut.sink.data.eq(signal[idx][0])
+                    yield dut.sink.channel.eq(signal[idx][1])
+                    yield dut.sink.valid.eq(1)
+                else:
+                    yield dut.sink.valid.eq(0)
+                # the output link takes a coefficient every args.link cycles
+                yield dut.source.ready.eq(cycle % args.link == 0)
+                yield Settle()
+
+                if (yield dut.sink.valid) and (yield dut.sink.ready):
+                    idx += 1
+                if (yield dut.source.valid) and (yield dut.source.ready):
+                    channel = yield dut.source.channel
+                    output[channel].append((yield dut.source.data))
+                    if (yield dut.source.last):
+                        cepstra[channel].append(output[channel])
+                        ends.append(cycle)
+                        output[channel] = []
+                yield
+                cycle += 1
+
+        sim = Simulator(dut)
+        sim.add_clock(1 / clock)
+        sim.add_sync_process(bench)
+        sim.run()
+
+        # the first frame of every channel waits for a whole window
+        cycles = (ends[-1] - ends[nchannels - 1]) / (len(ends) - nchannels)
+        frames = clock / cycles
+        link_used = args.link * mfcc.nceptrums / cycles
+
+        model = MFCCModel(nfft=mfcc.nfft, windowlen=mfcc.windowlen, samplerate=mfcc.samplerate,
+                          nfilters=mfcc.nfilters, nceptrums=mfcc.nceptrums)
+        mismatches = sum(np.count_nonzero(np.array(c) != model(a)) for c, a in zip(cepstra, audios))
+
+        print("| {} | {} | {:.0f} | {:.0f} | {:.0f} | {:.0%} | {} |".format(
+              ncores, nchannels, cycles, frames, frames * stepsize / mfcc.samplerate,
+              link_used, mismatches))
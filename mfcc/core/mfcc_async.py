@@ -0,0 +1,238 @@
+from nmigen import *
+from nmigen.lib.cdc import FFSynchronizer
+from nmigen.sim import Simulator, Settle
+
+from .mfcc import *
+from ..misc import stream
+
+
+__all__ = ["MFCCAsync"]
+
+
+class MFCCAsync(Elaboratable):
+    """An MFCC core clocked by its own domain.
+
+    sink, source and reset are in the sync domain, the core runs in the
+    domain named domain, which must be created by the platform. The streams
+    cross through AsyncFIFOs of depth entries. The other arguments are given
+    to the MFCC.
+
+    The reset crosses with a toggle handshake, so that it is seen whatever
+    the ratio of the clocks. Until the core has been reset, sink is stalled
+    and source is empty: the samples given before the reset are dropped in
+    the core domain, and the cepstra computed before it in the sync domain.
+    """
+    def __init__(self, domain="mfcc", depth=16, **kwargs):
+        self.domain = domain
+        self.depth = depth
+        self.core = MFCC(**kwargs)
+
+        self.reset = Signal()
+        self.sink = stream.Endpoint(self.core.sink.description)
+        self.source = stream.Endpoint(self.core.source.description)
+
+    def elaborate(self, platform):
+        sink = self.sink
+        source = self.source
+        core = self.core
+
+        m = Module()
+
+        m.submodules.core = DomainRenamer(self.domain)(core)
+
+        fifo_i = stream.AsyncFIFO(core.sink.description, self.depth,
+                                  w_domain="sync", r_domain=self.domain)
+        fifo_o = stream.AsyncFIFO(core.source.description, self.depth,
+                                  w_domain=self.domain, r_domain="sync")
+        m.submodules.fifo_i = fifo_i
+        m.submodules.fifo_o = fifo_o
+
+        # reset handshake: the core is reset while req != ack
+        req = Signal()
+        ack = Signal()
+        req_core = Signal()
+        ack_sync = Signal()
+        m.submodules.req_sync = FFSynchronizer(req, req_core, o_domain=self.domain)
+        m.submodules.ack_sync = FFSynchronizer(ack, ack_sync, o_domain="sync")
+
+        pending = Signal()
+        flush = Signal()
+        m.d.comb += pending.eq(req != ack_sync)
+
+        with m.If(self.reset & ~pending):
+            m.d.sync += req.eq(~req)
+
+        # the cepstra written before the reset of the core have crossed
+        #  once it is acknowledged
+        with m.If(self.reset):
+            m.d.sync += flush.eq(1)
+        with m.Elif(~pending & ~fifo_o.source.valid):
+            m.d.sync += flush.eq(0)
+
+        with m.If(self.reset | flush):
+            m.d.comb += fifo_o.source.ready.eq(1)
+        with m.Else():
+            m.d.comb += [
+                sink.connect(fifo_i.sink),
+                fifo_o.source.connect(source),
+            ]
+
+        # the samples written before the request have crossed with it
+        core_reset = Signal()
+        m.d.comb += [
+            core_reset.eq(req_core != ack),
+            core.reset.eq(core_reset),
+            core.source.connect(fifo_o.sink),
+        ]
+
+        with m.If(core_reset):
+            m.d.comb += fifo_i.source.ready.eq(1)
+            with m.If(~fifo_i.source.valid):
+                m.d[self.domain] += ack.eq(req_core)
+        with m.Else():
+            m.d.comb += fifo_i.source.connect(core.sink)
+
+        return m
+
+
+import unittest
+
+class MFCCAsyncTestCase(unittest.TestCase):
+    def check(self, core_period, nfft=128, nfilters=8, nceptrums=8, nframes=2):
+        import numpy as np
+        from ..model import MFCCModel
+        from ..model.mfcc import chirp
+
+        dut = MFCCAsync(nfft=nfft, nfilters=nfilters, nceptrums=nceptrums)
+        model = MFCCModel(nfft=nfft, nfilters=nfilters, nceptrums=nceptrums)
+
+        audio = chirp(model.windowlen + (nframes - 1) * model.stepsize)
+        expected = model(audio)
+        # noise, cut short by a reset while its first frames are output and
+        # the next ones are computed
+        noise = chirp(model.windowlen + 4 * model.stepsize + nfft // 4, seed=1)
+        signal = [int(a) for a in noise] + [None] + [int(a) for a in audio]
+
+        def bench():
+            rng = np.random.default_rng(0)
+            cepstra = []
+            output = []
+            idx = 0
+            cycle = 0
+            while idx <= len(noise) or len(cepstra) < nframes:
+                self.assertLess(cycle, 200 * nfft * (nframes + 5), "the core stalled")
+                cycle += 1
+                if idx < len(signal) and signal[idx] is None:
+                    yield dut.reset.eq(1)
+                    yield dut.sink.valid.eq(0)
+                    yield
+                    yield dut.reset.eq(0)
+                    idx += 1
+                    cepstra = []
+                    output = []
+                    continue
+                if idx < len(signal):
+                    yield dut.sink.data.eq(signal[idx])
+                    yield dut.sink.valid.eq(1)
+                else:
+                    yield dut.sink.valid.eq(0)
+                # random backpressure
+                yield dut.source.ready.eq(int(rng.integers(0, 2)))
+                yield Settle()
+                if (yield dut.sink.valid) and (yield dut.sink.ready):
+                    idx += 1
+                if (yield dut.source.valid) and (yield dut.source.ready):
+                    output.append((yield dut.source.data))
+                    if (yield dut.source.last):
+                        cepstra.append(output)
+                        output = []
+                yield
+            self.assertEqual(cepstra, expected.tolist())
+
+        sim = Simulator(dut)
+        sim.add_clock(1e-6)
+        sim.add_clock(core_period, domain=dut.domain)
+        sim.add_sync_process(bench)
+        sim.run()
+
+    def test_slow_core(self):
+        self.check(core_period=2.7e-6)
+
+    def test_fast_core(self):
+        self.check(core_period=0.37e-6)
+
+
+if __name__ == "__main__":
+    import argparse
+    import numpy as np
+    from scipy.io import wavfile
+    from ..model import MFCCModel
+
+    parser = argparse.ArgumentParser(
+        description="Simulate an MFCC core in its own clock domain against the model.")
+    parser.add_argument("wav", nargs="?", default="f2bjrop1.0.wav",
+                        help="input audio file (default: %(default)s)")
+    parser.add_argument("--clock", type=float, default=100,
+                        help="clock frequency of the I/O, in MHz (default: %(default)s)")
+    parser.add_argument("--core-clock", type=float, default=37,
+                        help="clock frequency of the core, in MHz (default: %(default)s)")
+    parser.add_argument("-n", "--nframes", type=int, default=3,
+                        help="frames to compute (default: %(default)s)")
+    args = parser.parse_args()
+
+    dut = MFCCAsync(nfft=512, nfilters=32, nceptrums=16)
+    mfcc = dut.core
+    sample_rate, audio = wavfile.read(args.wav)
+    audio = audio[:mfcc.windowlen + (args.nframes - 1) * (mfcc.nfft // 3)]
+
+    model = MFCCModel(nfft=mfcc.nfft, windowlen=mfcc.windowlen, samplerate=mfcc.samplerate,
+                      nfilters=mfcc.nfilters, nceptrums=mfcc.nceptrums)
+    expected = model(audio)
+    cepstra = []
+
+    def bench():
+        # a frame and a half of noise, cut short by a reset
+        rng = np.random.default_rng(0)
+        signal = [int(a) for a in rng.integers(-2**15, 2**15, 3 * mfcc.nfft // 2)]
+        signal += [None] + [int(a) for a in audio]
+
+        idx = 0
+        output = []
+        yield dut.source.ready.eq(1)
+
+        while len(cepstra) < len(expected):
+            if idx < len(signal) and signal[idx] is None:
+                yield dut.reset.eq(1)
+                yield dut.sink.valid.eq(0)
+                yield
+                yield dut.reset.eq(0)
+                idx += 1
+                output = []
+                cepstra.clear()
+                continue
+            if idx < len(signal):
+                yield dut.sink.data.eq(signal[idx])
+                yield dut.sink.valid.eq(1)
+            else:
+                yield dut.sink.valid.eq(0)
+            yield Settle()
+
+            if (yield dut.sink.valid) and (yield dut.sink.ready):
+                idx += 1
+            if (yield dut.source.valid):
+                output.append((yield dut.source.data))
+                if (yield dut.source.last):
+                    cepstra.append(output)
+                    output = []
+            yield
+
+    sim = Simulator(dut)
+    sim.add_clock(1e-6 / args.clock)
+    sim.add_clock(1e-6 / args.core_clock, domain=dut.domain)
+    sim.add_sync_process(bench)
+    sim.run()
+
+    mismatches = np.count_nonzero(np.array(cepstra) != expected)
+    print("{} frames with the core at {:g} MHz and the I/O at {:g} MHz: "
+          "{} mismatching coefficients".format(len(cepstra), args.core_clock,
+                                               args.clock, mismatches))
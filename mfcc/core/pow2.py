@@ -17,35 +17,181 @@ class PowerSpectrumCalc(Elaboratable):
         m.submodules.mul_i = mul_i = self.mul_i
         m.submodules.mul_r = mul_r = self.mul_r
 
+        # The multipliers can take a bin in different clocks (see
+        # mfcc.misc.mul.MultiplierPool): the bin is held until both took it,
+        # and their products are consumed together.
+        taken_r = Signal()
+        taken_i = Signal()
+        issued_r = taken_r | (mul_r.i.valid & mul_r.i.ready)
+        issued_i = taken_i | (mul_i.i.valid & mul_i.i.ready)
+
         m.d.comb += [
-            self.i.ready.eq(mul_r.i.ready & mul_i.i.ready),
+            self.i.ready.eq(issued_r & issued_i),
 
             mul_r.i.a.eq(self.i.r),
             mul_r.i.b.eq(self.i.r),
-            mul_r.i.valid.eq(self.i.valid),
+            mul_r.i.valid.eq(self.i.valid & ~taken_r),
             mul_r.i.last.eq(self.i.last),
 
             mul_i.i.a.eq(self.i.i),
             mul_i.i.b.eq(self.i.i),
-            mul_i.i.valid.eq(self.i.valid),
+            mul_i.i.valid.eq(self.i.valid & ~taken_i),
 
             self.o.r.eq(mul_r.o.c + mul_i.o.c),
             self.o.valid.eq(mul_r.o.valid & mul_i.o.valid),
             self.o.last.eq(mul_r.o.last),
 
-            mul_r.o.ready.eq(self.o.ready),
-            mul_i.o.ready.eq(self.o.ready),
+            mul_r.o.ready.eq(self.o.ready & self.o.valid),
+            mul_i.o.ready.eq(self.o.ready & self.o.valid),
+        ]
+
+        with m.If(self.i.valid & self.i.ready):
+            m.d.sync += [
+                taken_r.eq(0),
+                taken_i.eq(0),
+            ]
+        with m.Else():
+            m.d.sync += [
+                taken_r.eq(issued_r),
+                taken_i.eq(issued_i),
+            ]
+
+        return m
+
+
+class PowerSpectrumAmax(Elaboratable):
+    """Multiplier-free |X|²: the magnitude is estimated as
+    max(hi, 7/8·hi + 1/2·lo) of the larger and smaller absolute values,
+    then squared from its upper lut_bits bits through a LUT.
+    """
+    def __init__(self, width=16, lut_bits=8):
+        if not 0 < lut_bits <= width:
+            raise ValueError("LUT bits must be within 1..{}, not {!r}"
+                             .format(width, lut_bits))
+        self.width = width
+        self.lut_bits = lut_bits
+        self.i = stream.Endpoint([("r", signed(width)), ("i", signed(width))])
+        self.o = stream.Endpoint([("r", 2 * width)])
+
+    def elaborate(self, platform):
+        m = Module()
+
+        ce = Signal()
+        m.d.comb += [
+            ce.eq(~self.o.valid | self.o.ready),
+            self.i.ready.eq(ce),
+        ]
+
+        # stage 1: absolute values, sorted
+
+        abs_r = Signal(self.width)
+        abs_i = Signal(self.width)
+        hi = Signal(self.width)
+        lo = Signal(self.width)
+        s1_valid = Signal()
+        s1_last = Signal()
+
+        m.d.comb += [
+            abs_r.eq(Mux(self.i.r < 0, -self.i.r, self.i.r)),
+            abs_i.eq(Mux(self.i.i < 0, -self.i.i, self.i.i)),
         ]
+        with m.If(ce):
+            m.d.sync += [
+                hi.eq(Mux(abs_r > abs_i, abs_r, abs_i)),
+                lo.eq(Mux(abs_r > abs_i, abs_i, abs_r)),
+                s1_valid.eq(self.i.valid),
+                s1_last.eq(self.i.last),
+            ]
+
+        # stage 2: magnitude estimate, below 1.375 * 2**(width-1)
+
+        est = Signal(self.width)
+        mag = Signal(self.width)
+        s2_valid = Signal()
+        s2_last = Signal()
+
+        m.d.comb += est.eq(hi - (hi >> 3) + (lo >> 1))
+        with m.If(ce):
+            m.d.sync += [
+                mag.eq(Mux(est > hi, est, hi)),
+                s2_valid.eq(s1_valid),
+                s2_last.eq(s1_last),
+            ]
+
+        # stage 3: a mantissa m shifted by e squares to m(m+1)·4**e, the
+        # square of the middle of its truncation interval.
+
+        k = self.lut_bits
+        lut = Memory(width=2 * k, depth=1 << k, init=[v * v for v in range(1 << k)])
+        m.submodules.lut = lut_rp = lut.read_port(domain="comb")
+
+        e = Signal(range(self.width - k + 1))
+        for b in range(k, self.width):
+            with m.If(mag[b]):
+                m.d.comb += e.eq(b - k + 1)
+
+        mant = Signal(k)
+        m.d.comb += [
+            mant.eq(mag >> e),
+            lut_rp.addr.eq(mant),
+        ]
+        with m.If(ce):
+            m.d.sync += [
+                self.o.r.eq((lut_rp.data + Mux(e != 0, mant, 0)) << (e << 1)),
+                self.o.valid.eq(s2_valid),
+                self.o.last.eq(s2_last),
+            ]
+
+        return m
+
+
+class PowerNormalize(Elaboratable):
+    """Truncate a power value to mant << exp, with a mant_width-bit
+    mantissa."""
+    def __init__(self, width=30, mant_width=18):
+        if not 0 < mant_width <= width:
+            raise ValueError("Mantissa width must be within 1..{}, not {!r}"
+                             .format(width, mant_width))
+        self.width = width
+        self.mant_width = mant_width
+        self.exp_width = (width - mant_width).bit_length()
+        self.sink = stream.Endpoint([("data", width)])
+        self.source = stream.Endpoint([("data", mant_width), ("exp", self.exp_width)])
+
+    def elaborate(self, platform):
+        m = Module()
+
+        exp = Signal(self.exp_width)
+        for b in range(self.mant_width, self.width):
+            with m.If(self.sink.data[b]):
+                m.d.comb += exp.eq(b - self.mant_width + 1)
+
+        with m.If(~self.source.valid | self.source.ready):
+            m.d.comb += self.sink.ready.eq(1)
+            m.d.sync += [
+                self.source.data.eq(self.sink.data >> exp),
+                self.source.exp.eq(exp),
+                self.source.valid.eq(self.sink.valid),
+                self.source.last.eq(self.sink.last),
+            ]
 
         return m
 
 
 class PowerSpectrum(Elaboratable):
-    def __init__(self, width=16, width_output=24, multiplier_cls=Multiplier):
+    def __init__(self, width=16, width_output=24, multiplier_cls=Multiplier,
+                 mode="exact", lut_bits=8):
+        if mode not in ("exact", "amax"):
+            raise ValueError("Mode must be 'exact' or 'amax', not {!r}"
+                             .format(mode))
         self.sink   = stream.Endpoint([("data_r", signed(width)), ("data_i", signed(width))])
         self.source = stream.Endpoint([("data", width_output)])
 
-        self.pow2 = PowerSpectrumCalc(width=width, multiplier_cls=multiplier_cls)
+        if mode == "amax":
+            self.pow2 = PowerSpectrumAmax(width=width, lut_bits=lut_bits)
+        else:
+            self.pow2 = PowerSpectrumCalc(width=width, multiplier_cls=multiplier_cls)
+        self.mode = mode
         self.width_output = width_output
         self.width = width
 
@@ -7,15 +7,28 @@ from ..misc import stream
 Preemph applies a pre-emphasis coefitient of 1-1/32 = 0,96875
 """
 class Preemph(Elaboratable):
-    def __init__(self, width=16):
+    """With nchannels > 1, the samples of the channels are interleaved in
+    any order and tagged with their channel, each channel keeps its own
+    previous sample."""
+    def __init__(self, width=16, nchannels=1):
         self.width = width
-        self.sink = stream.Endpoint([("data", signed(width))])
-        self.source = stream.Endpoint([("data", signed(width))])
+        self.nchannels = nchannels
+
+        layout = [("data", signed(width))]
+        if nchannels > 1:
+            layout.append(("channel", range(nchannels)))
+        self.sink = stream.Endpoint(layout)
+        self.source = stream.Endpoint(layout)
 
     def elaborate(self, platform):
         m = Module()
 
-        odata = Signal(signed(self.width))
+        if self.nchannels == 1:
+            odata = Signal(signed(self.width))
+        else:
+            odata = Array(Signal(signed(self.width), name="odata{}".format(k))
+                          for k in range(self.nchannels))[self.sink.channel]
+            m.d.comb += self.source.channel.eq(self.sink.channel)
 
         with m.If(self.sink.valid & self.sink.ready):
             m.d.sync += odata.eq(self.sink.data)
@@ -4,8 +4,13 @@ from nmigen import *
 from nmigen.hdl.rec import Layout
 from nmigen.utils import log2_int
 
+from . import stream
 
-__all__ = ["complex", "TwiddleROM", "Butterfly", "Scheduler", "FFT"]
+
+__all__ = [
+    "complex", "TwiddleROM", "Butterfly", "Butterfly4", "Scheduler", "ParallelScheduler", "FFT",
+    "DelayLine", "SdfStage", "SdfFFT",
+]
 
 
 def complex(width):
@@ -15,9 +20,33 @@ def complex(width):
     ])
 
 
+def memory_port(depth, width, mode):
+    fields = []
+    if "r" in mode:
+        fields.append(("rp", [
+            ("addr", range(depth)),
+            ("data", complex(width)),
+        ]))
+    if "w" in mode:
+        fields.append(("wp", [
+            ("addr", range(depth)),
+            ("en",   1),
+            ("data", complex(width)),
+        ]))
+    return Layout(fields)
+
+
+def mem_select(idx, width):
+    # memory of an index when the points are spread over 2**width memories:
+    # bit r is the parity of the index bits b with b % width == r. Any
+    # `width` adjacent bits of the index select all the memories.
+    return Cat(idx[r::width].xor() for r in range(width))
+
+
 class TwiddleROM(Elaboratable):
     def __init__(self, size, width, invert=False):
         self.rp_addr = Signal(range(size // 2))
+        self.rp_en   = Signal(reset=1)
         self.rp_data = Record(complex(width))
 
         self.size   = size
@@ -39,11 +68,15 @@ class TwiddleROM(Elaboratable):
         m = Module()
 
         mem = Memory(width=2 * self.width, depth=int(self.size // 4), init=self.init)
-        m.submodules.mem_rp = mem_rp = mem.read_port()
-        m.d.comb += mem_rp.addr.eq(self.rp_addr[:-1])
+        m.submodules.mem_rp = mem_rp = mem.read_port(transparent=False)
+        m.d.comb += [
+            mem_rp.addr.eq(self.rp_addr[:-1]),
+            mem_rp.en.eq(self.rp_en),
+        ]
 
         mem_rp_sel = Signal()
-        m.d.sync += mem_rp_sel.eq(self.rp_addr[-1])
+        with m.If(self.rp_en):
+            m.d.sync += mem_rp_sel.eq(self.rp_addr[-1])
 
         m.d.comb += self.rp_data.real.eq(mem_rp.data.word_select(mem_rp_sel, self.width))
 
@@ -181,23 +214,50 @@ class Butterfly(Elaboratable):
 
             # Stage 7
             self.o.stb.eq(s6_stb),
-            # Re(y₀) = Re(x₀) +  Re(x₁)Re(ω) - Im(x₁)Im(ω)
-            # Im(y₀) = Im(x₀) +  Im(x₁)Re(ω) + Re(x₁)Im(ω)
-            # Re(y₁) = Re(x₀) - (Re(x₁)Re(ω) - Im(x₁)Im(ω))
-            # Im(y₁) = Im(x₀) - (Im(x₁)Re(ω) + Re(x₁)Im(ω))
-            self.o.y0.real.eq((s6_x0.real + s6_sub_1[self.bias_width:])[self.scale_bit:]),
-            self.o.y0.imag.eq((s6_x0.imag + s6_sub_2[self.bias_width:])[self.scale_bit:]),
-            self.o.y1.real.eq((s6_x0.real - s6_sub_1[self.bias_width:])[self.scale_bit:]),
-            self.o.y1.imag.eq((s6_x0.imag - s6_sub_2[self.bias_width:])[self.scale_bit:]),
+        ]
+
+        # Re(y₀) = Re(x₀) +  Re(x₁)Re(ω) - Im(x₁)Im(ω)
+        # Im(y₀) = Im(x₀) +  Im(x₁)Re(ω) + Re(x₁)Im(ω)
+        # Re(y₁) = Re(x₀) - (Re(x₁)Re(ω) - Im(x₁)Im(ω))
+        # Im(y₁) = Im(x₀) - (Im(x₁)Re(ω) + Re(x₁)Im(ω))
+
+        # scale_bit is either a constant, or a signal holding the shift of
+        # the current stage.
+        def scale(value):
+            if isinstance(self.scale_bit, int):
+                return value[self.scale_bit:]
+            return value >> self.scale_bit
+
+        m.d.sync += [
+            self.o.y0.real.eq(scale(s6_x0.real + s6_sub_1[self.bias_width:].as_signed())),
+            self.o.y0.imag.eq(scale(s6_x0.imag + s6_sub_2[self.bias_width:].as_signed())),
+            self.o.y1.real.eq(scale(s6_x0.real - s6_sub_1[self.bias_width:].as_signed())),
+            self.o.y1.imag.eq(scale(s6_x0.imag - s6_sub_2[self.bias_width:].as_signed())),
         ]
 
         return m
 
 
 class Scheduler(Elaboratable):
-    def __init__(self, *, size, width):
-        self.start = Signal()
-        self.done  = Signal()
+    """Radix-2 butterfly scheduler.
+
+    With `skip_first`, the first stage is not run: its outputs must have been
+    written by the user. With `o_size`, the last stage only computes the
+    butterflies of the first `o_size` bins.
+    """
+    def __init__(self, *, size, width, drain=False, skip_first=False, o_size=None):
+        if o_size is None:
+            o_size = size
+        if not isinstance(o_size, int) or not 0 < o_size <= size:
+            raise ValueError("Output size must be an integer between 1 and {}, not {!r}"
+                             .format(size, o_size))
+        if skip_first and size < 4:
+            raise ValueError("The first stage can only be skipped with a size of at least 4, "
+                             "not {}".format(size))
+
+        self.start      = Signal()
+        self.done       = Signal()
+        self.stage_done = Signal()
 
         self.i = Record([
             ("stb", 1),
@@ -211,21 +271,6 @@ class Scheduler(Elaboratable):
             ("x1",  complex(width)),
         ])
 
-        def memory_port(depth, width, mode):
-            fields = []
-            if "r" in mode:
-                fields.append(("rp", [
-                    ("addr", range(depth)),
-                    ("data", complex(width)),
-                ]))
-            if "w" in mode:
-                fields.append(("wp", [
-                    ("addr", range(depth)),
-                    ("en",   1),
-                    ("data", complex(width)),
-                ]))
-            return Layout(fields)
-
         self.mem0 = Record(memory_port(size // 2, width, "rw"))
         self.mem1 = Record(memory_port(size // 2, width, "rw"))
         self.mem2 = Record(memory_port(size // 2, width, "rw"))
@@ -233,6 +278,9 @@ class Scheduler(Elaboratable):
 
         self.size       = size
         self.width      = width
+        self.drain      = drain
+        self.skip_first = skip_first
+        self.o_size     = o_size
 
     def elaborate(self, platform):
         m = Module()
@@ -315,21 +363,37 @@ class Scheduler(Elaboratable):
 
         m.d.comb += self.o.tw.eq(self.trom.rp.data)
 
+        # with drain, a stage only starts once the previous one has been
+        # written back.
+        stall = Signal()
+        if self.drain:
+            m.d.comb += stall.eq((consume.tap == 0) & (consume.stage != produce.stage))
+
+        m.d.comb += self.stage_done.eq(self.i.stb & produce.tap.all())
+
+        # the butterfly at tap t of the last stage computes the bins t and
+        # t + size/2.
+        first_stage = 1 if self.skip_first else 0
+        last_taps = min(self.o_size, self.size // 2)
+
         with m.FSM() as fsm:
             with m.State("IDLE"):
                 with m.If(self.start):
                     m.d.sync += [
-                        consume.eq(0),
-                        produce.eq(0),
+                        consume.tap.eq(0),
+                        consume.stage.eq(first_stage),
+                        produce.tap.eq(0),
+                        produce.stage.eq(first_stage),
                         self.trom.rp.addr.eq(0),
                     ]
                     m.next = "BUSY"
 
             with m.State("BUSY"):
-                m.d.sync += [
-                    consume.eq(consume + 1),
-                    self.trom.rp.addr.eq(trom_addr_next),
-                ]
+                with m.If(~stall):
+                    m.d.sync += [
+                        consume.eq(consume + 1),
+                        self.trom.rp.addr.eq(trom_addr_next),
+                    ]
                 with m.If(self.i.stb):
                     m.d.sync += produce.eq(produce + 1)
                     m.d.comb += [
@@ -337,149 +401,1077 @@ class Scheduler(Elaboratable):
                         self.mem1.wp.en.eq(~produce.stage[0]),
                         self.mem2.wp.en.eq( produce.stage[0]),
                     ]
-                with m.If(produce.tap.all() & (produce.stage == log2_int(self.size // 2))):
+                with m.If(self.i.stb & (produce.tap == last_taps - 1) &
+                          (produce.stage == log2_int(self.size // 2))):
                     m.d.comb += self.done.eq(1)
                     m.next = "IDLE"
 
-        m.d.sync += self.o.stb.eq(fsm.ongoing("BUSY"))
+        m.d.sync += self.o.stb.eq(fsm.ongoing("BUSY") & ~self.done & ~stall)
+
+        return m
+
+
+class Butterfly4(Elaboratable):
+    """Radix-2² butterfly.
+
+    Two layers of radix-2 butterflies compute two consecutive DIT stages on
+    the points x₀..x₃ at distance h. The second pair of the second layer uses
+    the twiddle of the first one rotated by -j. With `single` set, the second
+    layer is skipped and the two first-layer butterflies are independent.
+    """
+    def __init__(self, *, width, bias_width, scale_bit):
+        self.reset = Signal()
+
+        self.i = Record([
+            ("stb",    1),
+            ("single", 1),
+            ("tw0",    complex(width)),
+            ("tw1",    complex(width)),
+            ("x0",     complex(width)),
+            ("x1",     complex(width)),
+            ("x2",     complex(width)),
+            ("x3",     complex(width)),
+        ])
+        self.o = Record([
+            ("stb", 1),
+            ("y0",  complex(width)),
+            ("y1",  complex(width)),
+            ("y2",  complex(width)),
+            ("y3",  complex(width)),
+        ])
+
+        self.width      = width
+        self.bias_width = bias_width
+        self.scale_bit  = scale_bit
+        self.latency    = 14
+
+    def elaborate(self, platform):
+        m = Module()
+
+        bfs = []
+        for n in range(4):
+            bf = Butterfly(width=self.width, bias_width=self.bias_width, scale_bit=self.scale_bit)
+            m.submodules["bf{}".format(n)] = bf
+            m.d.comb += bf.reset.eq(self.reset)
+            bfs.append(bf)
+        bf0, bf1, bf2, bf3 = bfs
+
+        m = ResetInserter(self.reset)(m)
+
+        # the second layer twiddle and mode follow the data through the first layer
+        tw1    = Record.like(self.i.tw1)
+        single = Signal()
+        for n in range(self.latency // 2):
+            tw1_nxt    = Record.like(tw1)
+            single_nxt = Signal()
+            tw1_nxt.real.reset_less = True
+            tw1_nxt.imag.reset_less = True
+            m.d.sync += [
+                tw1_nxt.eq(self.i.tw1 if n == 0 else tw1),
+                single_nxt.eq(self.i.single if n == 0 else single),
+            ]
+            tw1, single = tw1_nxt, single_nxt
+
+        m.d.comb += [
+            bf0.i.stb.eq(self.i.stb),
+            bf0.i.tw .eq(self.i.tw0),
+            bf0.i.x0 .eq(self.i.x0),
+            bf0.i.x1 .eq(self.i.x1),
+
+            bf1.i.stb.eq(self.i.stb),
+            bf1.i.tw .eq(self.i.tw0),
+            bf1.i.x0 .eq(self.i.x2),
+            bf1.i.x1 .eq(self.i.x3),
+
+            bf2.i.stb.eq(bf0.o.stb & ~single),
+            bf2.i.tw .eq(tw1),
+            bf2.i.x0 .eq(bf0.o.y0),
+            bf2.i.x1 .eq(bf1.o.y0),
+
+            bf3.i.stb    .eq(bf0.o.stb & ~single),
+            bf3.i.tw.real.eq( tw1.imag),
+            bf3.i.tw.imag.eq(-tw1.real),
+            bf3.i.x0     .eq(bf0.o.y1),
+            bf3.i.x1     .eq(bf1.o.y1),
+        ]
+
+        with m.If(single):
+            m.d.comb += [
+                self.o.stb.eq(bf0.o.stb),
+                self.o.y0 .eq(bf0.o.y0),
+                self.o.y1 .eq(bf0.o.y1),
+                self.o.y2 .eq(bf1.o.y0),
+                self.o.y3 .eq(bf1.o.y1),
+            ]
+        with m.Else():
+            m.d.comb += [
+                self.o.stb.eq(bf2.o.stb),
+                self.o.y0 .eq(bf2.o.y0),
+                self.o.y1 .eq(bf3.o.y0),
+                self.o.y2 .eq(bf2.o.y1),
+                self.o.y3 .eq(bf3.o.y1),
+            ]
+
+        return m
+
+
+class ParallelScheduler(Elaboratable):
+    """Scheduler for several butterfly units.
+
+    Each clock cycle, `nbutterflies` units of the given radix work on a group
+    of points that differ in adjacent index bits, around the bit of the
+    current stage. With radix 4, each pass performs two DIT stages and, with
+    an odd number of stages, the first pass is a single radix-2 stage. The
+    points are spread over one memory per point of a group by `mem_select`,
+    so that each group reads and writes every memory once. The data is
+    updated in place, and each pass waits for the butterfly pipeline to drain
+    before the next one starts.
+    """
+    def __init__(self, *, size, width, radix=2, nbutterflies=1):
+        npoints = radix * nbutterflies
+
+        def unit_layout(io):
+            if io == "o" and radix == 4:
+                fields = [("single", 1), ("tw0", complex(width)), ("tw1", complex(width))]
+            elif io == "o":
+                fields = [("tw", complex(width))]
+            else:
+                fields = []
+            prefix = "x" if io == "o" else "y"
+            fields += [("{}{}".format(prefix, k), complex(width)) for k in range(radix)]
+            return fields
+
+        self.start = Signal()
+        self.done  = Signal()
+
+        self.i = Record([("stb", 1)] + [
+            ("bf{}".format(u), unit_layout("i")) for u in range(nbutterflies)
+        ])
+        self.o = Record([("stb", 1)] + [
+            ("bf{}".format(u), unit_layout("o")) for u in range(nbutterflies)
+        ])
+
+        self.mems  = [Record(memory_port(size // npoints, width, "rw"))
+                      for _ in range(npoints)]
+        self.troms = [Record(memory_port(size // 2, width, "r"))
+                      for _ in range(nbutterflies * radix // 2)]
+
+        self.size         = size
+        self.width        = width
+        self.radix        = radix
+        self.nbutterflies = nbutterflies
+        self.npoints      = npoints
+
+    def elaborate(self, platform):
+        m = Module()
+
+        nbits = log2_int(self.size)
+        gbits = log2_int(self.npoints)
+        rbits = log2_int(self.radix)
+
+        # A group is made of the points whose index differ in the gbits bits
+        # starting at `window`, and the units work on the rbits bits starting
+        # at `stage` inside of it.
+        stage  = Signal(range(nbits))
+        window = Signal(range(nbits))
+        offset = Signal(range(gbits))
+        m.d.comb += [
+            window.eq(Mux(stage > nbits - gbits, nbits - gbits, stage)),
+            offset.eq(stage - window),
+        ]
+
+        def insert(n, pos, bits, width):
+            mask = Signal(width)
+            res  = Signal(width)
+            m.d.comb += [
+                mask.eq((1 << pos) - 1),
+                res.eq(((n & ~mask) << bits) | (n & mask)),
+            ]
+            return res
+
+        def group(n):
+            base = insert(n, window, gbits, nbits)
+            idx = []
+            for u in range(self.nbutterflies):
+                unit = insert(Const(u, gbits), offset, rbits, gbits)
+                for k in range(self.radix):
+                    idx_k = Signal(nbits)
+                    m.d.comb += idx_k.eq(base | ((unit | (Const(k, rbits) << offset)) << window))
+                    idx.append(idx_k)
+            return idx
+
+        single = Signal()
+        last   = Signal()
+        if self.radix == 4 and nbits % 2:
+            m.d.comb += single.eq(stage == 0)
+        m.d.comb += last.eq(stage == nbits - self.radix // 2)
+
+        consume   = Signal(range(self.size // self.npoints))
+        produce   = Signal(range(self.size // self.npoints))
+        consuming = Signal()
+
+        consume_idx = group(consume)
+        produce_idx = group(produce)
+
+        units_o = [self.o["bf{}".format(u)] for u in range(self.nbutterflies)]
+        units_i = [self.i["bf{}".format(u)] for u in range(self.nbutterflies)]
+        xs = [getattr(unit, "x{}".format(k)) for unit in units_o for k in range(self.radix)]
+        ys = [getattr(unit, "y{}".format(k)) for unit in units_i for k in range(self.radix)]
+
+        # read
+
+        for q, x in enumerate(xs):
+            x_mem_sel = Signal(gbits, name="x{}_mem_sel".format(q))
+            m.d.sync += x_mem_sel.eq(mem_select(consume_idx[q], gbits))
+            for b, mem in enumerate(self.mems):
+                with m.If(mem_select(consume_idx[q], gbits) == b):
+                    m.d.comb += mem.rp.addr.eq(consume_idx[q][gbits:])
+
+            with m.Switch(x_mem_sel):
+                for b, mem in enumerate(self.mems):
+                    with m.Case(b):
+                        m.d.comb += x.eq(mem.rp.data)
+
+        # twiddles: with radix 4, the second layer uses the twiddle of the
+        # next stage.
+
+        mask = Signal(nbits)
+        tw_shift = Signal(range(nbits))
+        tw_shift_nxt = Signal(range(nbits))
+        m.d.comb += [
+            mask.eq((1 << stage) - 1),
+            tw_shift.eq(nbits - 1 - stage),
+            tw_shift_nxt.eq(nbits - 2 - stage),
+        ]
+
+        for u, unit in enumerate(units_o):
+            tw_base = Signal(nbits, name="tw{}_base".format(u))
+            m.d.comb += tw_base.eq(consume_idx[u * self.radix] & mask)
+            if self.radix == 4:
+                trom0 = self.troms[2 * u]
+                trom1 = self.troms[2 * u + 1]
+                m.d.comb += [
+                    trom0.rp.addr.eq(tw_base << tw_shift),
+                    trom1.rp.addr.eq(tw_base << tw_shift_nxt),
+                    unit.tw0.eq(trom0.rp.data),
+                    unit.tw1.eq(trom1.rp.data),
+                    unit.single.eq(single),
+                ]
+            else:
+                trom = self.troms[u]
+                m.d.comb += [
+                    trom.rp.addr.eq(tw_base << tw_shift),
+                    unit.tw.eq(trom.rp.data),
+                ]
+
+        # write back
+
+        for q, y in enumerate(ys):
+            for b, mem in enumerate(self.mems):
+                with m.If(mem_select(produce_idx[q], gbits) == b):
+                    m.d.comb += [
+                        mem.wp.addr.eq(produce_idx[q][gbits:]),
+                        mem.wp.data.eq(y),
+                    ]
+
+        if self.radix == 4:
+            stage_nxt = Mux(single, 1, stage + 2)
+        else:
+            stage_nxt = stage + 1
+
+        with m.FSM() as fsm:
+            with m.State("IDLE"):
+                with m.If(self.start):
+                    m.d.sync += [
+                        stage.eq(0),
+                        consume.eq(0),
+                        produce.eq(0),
+                        consuming.eq(1),
+                    ]
+                    m.next = "BUSY"
+
+            with m.State("BUSY"):
+                with m.If(consuming):
+                    m.d.sync += consume.eq(consume + 1)
+                    with m.If(consume == self.size // self.npoints - 1):
+                        m.d.sync += consuming.eq(0)
+
+                with m.If(self.i.stb):
+                    m.d.sync += produce.eq(produce + 1)
+                    m.d.comb += [mem.wp.en.eq(1) for mem in self.mems]
+
+                    with m.If(produce == self.size // self.npoints - 1):
+                        with m.If(last):
+                            m.d.comb += self.done.eq(1)
+                            m.next = "IDLE"
+                        with m.Else():
+                            m.d.sync += [
+                                stage.eq(stage_nxt),
+                                consume.eq(0),
+                                produce.eq(0),
+                                consuming.eq(1),
+                            ]
+
+        m.d.sync += self.o.stb.eq(fsm.ongoing("BUSY") & consuming)
 
         return m
 
 
 class FFT(Elaboratable):
-    def __init__(self, *, size, i_width, o_width, m_width, i_reversed=False):
+    def __init__(self, *, size, i_width, o_width, m_width, i_reversed=False, nbanks=1, real=False,
+                 radix=2, nbutterflies=1, bfp=False, i_size=None, o_size=None):
         if not isinstance(size, int) or size <= 0 or size & size - 1:
             raise ValueError("Size must be a positive power-of-two integer, not {!r}"
                              .format(size))
+        if i_size is None:
+            i_size = size
+        if not isinstance(i_size, int) or not 0 < i_size <= size:
+            raise ValueError("Input size must be an integer between 1 and {}, not {!r}"
+                             .format(size, i_size))
+        if o_size is None:
+            o_size = size
+        if not isinstance(o_size, int) or not 0 < o_size <= size:
+            raise ValueError("Output size must be an integer between 1 and {}, not {!r}"
+                             .format(size, o_size))
+        if not isinstance(nbanks, int) or nbanks <= 0:
+            raise ValueError("Bank count must be a positive integer, not {!r}"
+                             .format(nbanks))
+        if real and size < 8:
+            raise ValueError("Real FFT size must be at least 8, not {!r}"
+                             .format(size))
+        if real and i_reversed:
+            raise ValueError("Real FFT does not support bitreversed input addresses")
+        if radix not in (2, 4):
+            raise ValueError("Radix must be 2 or 4, not {!r}"
+                             .format(radix))
+        if nbutterflies not in (1, 2, 4):
+            raise ValueError("Butterfly count must be 1, 2 or 4, not {!r}"
+                             .format(nbutterflies))
+        if size < radix * nbutterflies:
+            raise ValueError("Size must be at least {}, not {!r}"
+                             .format(radix * nbutterflies, size))
+        if real and (radix != 2 or nbutterflies != 1):
+            raise ValueError("Real FFT is only supported with a single radix-2 butterfly")
+        if bfp and (real or radix != 2 or nbutterflies != 1):
+            raise ValueError("Block floating point is only supported by the complex FFT with "
+                             "a single radix-2 butterfly")
         # assert m_width >= max(i_width, o_width) TODO
 
-        self.size       = size
-        self.i_width    = i_width
-        self.o_width    = o_width
-        self.m_width    = m_width
-        self.i_reversed = i_reversed
-
+        self.size         = size
+        self.i_width      = i_width
+        self.o_width      = o_width
+        self.m_width      = m_width
+        self.i_reversed   = i_reversed
+        self.nbanks       = nbanks
+        self.real         = real
+        self.radix        = radix
+        self.nbutterflies = nbutterflies
+        self.bfp          = bfp
+        self.i_size       = i_size
+        self.o_size       = o_size
+
+        # Each bank is a complete set of data memories. While the butterfly
+        # works on one bank, the others can be loaded and read out.
+        # In real mode, only i.data.real is used, and only the first half of
+        # the output bins is available.
+        # Only the first i_size inputs may be non-zero, the others are not
+        # written. Only the first o_size bins can be read out. The single
+        # radix-2 butterfly uses them to skip work.
+        # The output data is the transform scaled by 2**-o.exp. Without block
+        # floating point, every stage is scaled by 1/2 and o.exp is log2(size),
+        # plus the number of bits dropped when i_width is above m_width.
         self.i = Record([
+            ("bank", range(nbanks)),
             ("addr", range(size)),
             ("en",   1),
             ("data", complex(i_width)),
         ])
         self.o = Record([
+            ("bank", range(nbanks)),
             ("addr", range(size)),
             ("data", complex(o_width)),
+            ("exp",  range(max(i_width - m_width, 0) + 2 * log2_int(size) + 1)),
         ])
 
         self.start = Signal()
+        self.bank  = Signal(range(nbanks))
         self.ready = Signal()
-        # self.scale = Signal(range(size)) TODO
 
     def elaborate(self, platform):
         m = Module()
 
-        m.submodules.trom  = trom  = TwiddleROM(size=self.size, width=self.m_width)
-        m.submodules.bf    = bf    = Butterfly(width=self.m_width, bias_width=self.m_width - 2, scale_bit=1)
-        m.submodules.sched = sched = Scheduler(size=self.size, width=self.m_width)
+        # A real transform of N points is computed as a complex transform
+        # of N/2 points of the packed even and odd samples, followed by a
+        # split pass. The split pass reuses the butterfly to compute
+        # X[k] = (Z[k] + Z*[N/2-k])/2 - jW^k(Z[k] - Z*[N/2-k])/2.
+        core_size = self.size // 2 if self.real else self.size
+        core_bits = log2_int(core_size)
+
+        # With several butterflies or radix 4, the points are spread over
+        # one memory per point processed each clock cycle.
+        parallel = self.radix != 2 or self.nbutterflies != 1
+
+        if parallel:
+            m.submodules.sched = sched = ParallelScheduler(size=self.size, width=self.m_width,
+                                                           radix=self.radix,
+                                                           nbutterflies=self.nbutterflies)
+
+            troms = []
+            for n in range(len(sched.troms)):
+                trom = TwiddleROM(size=self.size, width=self.m_width)
+                m.submodules["trom{}".format(n or "")] = trom
+                m.d.comb += sched.troms[n].rp.data.eq(trom.rp_data)
+                troms.append(trom)
+
+            bfs = []
+            for u in range(self.nbutterflies):
+                if self.radix == 4:
+                    bf = Butterfly4(width=self.m_width, bias_width=self.m_width - 2, scale_bit=1)
+                else:
+                    bf = Butterfly(width=self.m_width, bias_width=self.m_width - 2, scale_bit=1)
+                m.submodules["bf{}".format(u if self.nbutterflies > 1 else "")] = bf
+                sched_i = sched.i["bf{}".format(u)]
+                m.d.comb += [sched_i[name].eq(bf.o[name]) for name in sched_i.fields]
+                bfs.append(bf)
+            m.d.comb += sched.i.stb.eq(bfs[0].o.stb)
+
+            sched_mems = sched.mems
+            mem_depth  = self.size // sched.npoints
+        else:
+            # With block floating point, each stage is shifted by 0 to 2 bits,
+            # and stages do not overlap so that the shift of the next one is
+            # known before it starts. Stages shorter than the butterfly
+            # pipeline cannot overlap either.
+            shift = Signal(2)
+            drain = self.bfp or core_size <= 16
+
+            m.submodules.trom  = trom  = TwiddleROM(size=self.size, width=self.m_width)
+            m.submodules.bf    = bf    = Butterfly(width=self.m_width, bias_width=self.m_width - 2,
+                                                   scale_bit=shift if self.bfp else 1)
+            # When the upper half of the inputs is zero, the first stage only
+            # copies each input to both outputs, scaled by 1/2. It is done
+            # while loading instead.
+            fold = not self.bfp and core_size >= 4 and self.i_size <= self.size // 2
+
+            # The split pass of the real mode reads every bin.
+            if self.real:
+                o_size = core_size
+            else:
+                o_size = self.o_size
+
+            m.submodules.sched = sched = Scheduler(size=core_size, width=self.m_width,
+                                                   drain=drain, skip_first=fold,
+                                                   o_size=o_size)
 
-        mem0 = Memory(width=2 * self.m_width, depth=self.size // 2)
-        m.submodules.mem0_wp = mem0_wp = mem0.write_port()
-        m.submodules.mem0_rp = mem0_rp = mem0.read_port()
+            sched_mems = [sched.mem0, sched.mem1, sched.mem2]
+            mem_depth  = core_size // 2
+
+            m.d.comb += [
+                sched.i.stb.eq(bf.o.stb),
+                sched.i.y0 .eq(bf.o.y0),
+                sched.i.y1 .eq(bf.o.y1),
 
-        mem1 = Memory(width=2 * self.m_width, depth=self.size // 2)
-        m.submodules.mem1_wp = mem1_wp = mem1.write_port()
-        m.submodules.mem1_rp = mem1_rp = mem1.read_port()
+                sched.trom.rp.data.eq(trom.rp_data),
+            ]
 
-        mem2 = Memory(width=2 * self.m_width, depth=self.size // 2)
-        m.submodules.mem2_wp = mem2_wp = mem2.write_port()
-        m.submodules.mem2_rp = mem2_rp = mem2.read_port()
+        work_mems = [Record.like(sched_mem) for sched_mem in sched_mems]
+        m.d.comb += [sched_mem.rp.data.eq(work_mem.rp.data)
+                     for sched_mem, work_mem in zip(sched_mems, work_mems)]
 
+        # inputs wider than the memories keep their most significant bits,
+        # and the output exponent is increased by the number of dropped bits.
+        i_shift = max(self.i_width - self.m_width, 0)
+        i_data = Record(complex(self.m_width))
         m.d.comb += [
-            bf.i.stb.eq(sched.o.stb),
-            bf.i.x0 .eq(sched.o.x0),
-            bf.i.x1 .eq(sched.o.x1),
-            bf.i.tw .eq(sched.o.tw),
+            i_data.real.eq(self.i.data.real >> i_shift),
+            i_data.imag.eq(self.i.data.imag >> i_shift),
+        ]
 
-            sched.i.stb.eq(bf.o.stb),
-            sched.i.y0 .eq(bf.o.y0),
-            sched.i.y1 .eq(bf.o.y1),
+        i_data_sext = Record(complex(self.m_width))
+        i_addr_rev = Signal(core_bits)
 
-            sched.mem0.rp.data.eq(mem0_rp.data),
-            sched.mem1.rp.data.eq(mem1_rp.data),
-            sched.mem2.rp.data.eq(mem2_rp.data),
+        if self.real:
+            # even samples are held until the next odd sample arrives, and
+            # both are written as one complex word.
+            i_hold = Signal(signed(self.m_width))
+            with m.If(self.i.en & ~self.i.addr[0]):
+                m.d.sync += i_hold.eq(i_data.real)
 
-            trom.rp_addr.eq(sched.trom.rp.addr),
-            sched.trom.rp.data.eq(trom.rp_data),
-        ]
+            i_en = self.i.en & self.i.addr[0]
+            m.d.comb += [
+                i_addr_rev.eq(Cat(reversed(self.i.addr[1:]))),
+                i_data_sext.real.eq(i_hold),
+                i_data_sext.imag.eq(i_data.real),
+            ]
+        else:
+            i_en = self.i.en
+            if self.i_reversed:
+                # self.i.addr has already been bitreversed by user logic.
+                m.d.comb += i_addr_rev.eq(self.i.addr)
+            else:
+                m.d.comb += i_addr_rev.eq(Cat(reversed(self.i.addr)))
+
+            m.d.comb += i_data_sext.eq(i_data)
+
+        if not parallel and fold:
+            i_data_fold = Record(complex(self.m_width))
+            m.d.comb += [
+                i_data_fold.real.eq(i_data_sext.real >> 1),
+                i_data_fold.imag.eq(i_data_sext.imag >> 1),
+            ]
 
-        i_addr_rev = Signal.like(self.i.addr)
-        if self.i_reversed:
-            # self.i.addr has already been bitreversed by user logic.
-            m.d.comb += i_addr_rev.eq(self.i.addr)
+        busy = Signal()
+        work_bank = Signal.like(self.bank)
+
+        o_bank_sel = Signal.like(self.o.bank)
+        m.d.sync += o_bank_sel.eq(self.o.bank)
+
+        if not self.bfp:
+            m.d.comb += self.o.exp.eq(i_shift + log2_int(self.size))
+
+        if parallel:
+            mem_bits = log2_int(sched.npoints)
+            o_addr = self.o.addr[mem_bits:]
+            o_data_sel = Signal(mem_bits)
+            m.d.sync += o_data_sel.eq(mem_select(self.o.addr, mem_bits))
         else:
-            m.d.comb += i_addr_rev.eq(Cat(reversed(self.i.addr)))
+            o_addr = self.o.addr[:core_bits - 1]
+            o_data_sel = Signal()
+            m.d.sync += o_data_sel.eq(~self.o.addr[core_bits - 1])
+
+        for b in range(self.nbanks):
+            suffix = "_{}".format(b) if self.nbanks > 1 else ""
+
+            mem_wps = []
+            mem_rps = []
+            for n in range(len(work_mems)):
+                mem = Memory(width=2 * self.m_width, depth=mem_depth)
+                m.submodules["mem{}_wp{}".format(n, suffix)] = mem_wp = mem.write_port()
+                m.submodules["mem{}_rp{}".format(n, suffix)] = mem_rp = mem.read_port()
+                mem_wps.append(mem_wp)
+                mem_rps.append(mem_rp)
+
+            with m.If(busy & (work_bank == b)):
+                for mem_wp, mem_rp, work_mem in zip(mem_wps, mem_rps, work_mems):
+                    m.d.comb += [
+                        mem_wp.addr.eq(work_mem.wp.addr),
+                        mem_wp.data.eq(work_mem.wp.data),
+                        mem_wp.en.eq(work_mem.wp.en),
 
-        i_data_sext = Record(complex(self.m_width))
-        m.d.comb += [
-            i_data_sext.real.eq(self.i.data.real),
-            i_data_sext.imag.eq(self.i.data.imag),
-        ]
+                        mem_rp.addr.eq(work_mem.rp.addr),
+                        work_mem.rp.data.eq(mem_rp.data),
+                    ]
 
-        o_data_sel = Signal()
-        m.d.sync += o_data_sel.eq(~self.o.addr[-1])
+            with m.Else():
+                bank_en = i_en & (self.i.bank == b)
+                for mem_wp, mem_rp in zip(mem_wps, mem_rps):
+                    m.d.comb += [
+                        mem_wp.data.eq(i_data_sext),
+                        mem_rp.addr.eq(o_addr),
+                    ]
 
-        with m.If(o_data_sel):
-            m.d.comb += self.o.data.eq(mem0_rp.data)
-        with m.Else():
-            if log2_int(self.size) % 2:
-                m.d.comb += self.o.data.eq(mem1_rp.data)
-            else:
-                m.d.comb += self.o.data.eq(mem2_rp.data)
+                if parallel:
+                    for n, mem_wp in enumerate(mem_wps):
+                        m.d.comb += [
+                            mem_wp.addr.eq(i_addr_rev[mem_bits:]),
+                            mem_wp.en.eq(bank_en & (mem_select(i_addr_rev, mem_bits) == n)),
+                        ]
+                elif fold:
+                    mem0_wp, mem1_wp, mem2_wp = mem_wps
+                    m.d.comb += [
+                        mem0_wp.addr.eq(i_addr_rev[1:]),
+                        mem1_wp.addr.eq(i_addr_rev[1:]),
+                        mem0_wp.data.eq(i_data_fold),
+                        mem1_wp.data.eq(i_data_fold),
 
-        with m.FSM():
-            with m.State("INIT"):
-                m.d.comb += [
-                    mem0_wp.addr.eq(i_addr_rev[1:]),
-                    mem1_wp.addr.eq(i_addr_rev[1:]),
-                    mem2_wp.addr.eq(i_addr_rev[1:]),
+                        mem0_wp.en.eq(bank_en & ~i_addr_rev[0]),
+                        mem1_wp.en.eq(bank_en & ~i_addr_rev[0]),
+                    ]
+                else:
+                    mem0_wp, mem1_wp, mem2_wp = mem_wps
+                    m.d.comb += [
+                        mem0_wp.addr.eq(i_addr_rev[1:]),
+                        mem1_wp.addr.eq(i_addr_rev[1:]),
+                        mem2_wp.addr.eq(i_addr_rev[1:]),
+
+                        mem0_wp.en.eq(bank_en & ~i_addr_rev[0]),
+                        mem1_wp.en.eq(bank_en &  i_addr_rev[0]),
+                        mem2_wp.en.eq(bank_en &  i_addr_rev[0]),
+                    ]
+
+            with m.If(o_bank_sel == b):
+                if parallel:
+                    with m.Switch(o_data_sel):
+                        for n, mem_rp in enumerate(mem_rps):
+                            with m.Case(n):
+                                m.d.comb += self.o.data.eq(mem_rp.data)
+                else:
+                    mem0_rp, mem1_rp, mem2_rp = mem_rps
+                    with m.If(o_data_sel):
+                        m.d.comb += self.o.data.eq(mem0_rp.data)
+                    with m.Else():
+                        if core_bits % 2:
+                            m.d.comb += self.o.data.eq(mem1_rp.data)
+                        else:
+                            m.d.comb += self.o.data.eq(mem2_rp.data)
+
+        if parallel:
+            with m.FSM():
+                with m.State("INIT"):
+                    m.d.comb += self.ready.eq(1)
+                    with m.If(self.start):
+                        m.d.comb += sched.start.eq(1)
+                        m.d.sync += work_bank.eq(self.bank)
+                        m.next = "BUSY"
+
+                with m.State("BUSY"):
+                    m.d.comb += busy.eq(1)
+                    for u, bf in enumerate(bfs):
+                        sched_o = sched.o["bf{}".format(u)]
+                        m.d.comb += bf.i.stb.eq(sched.o.stb)
+                        m.d.comb += [bf.i[name].eq(sched_o[name]) for name in sched_o.fields]
+                    for trom, sched_trom in zip(troms, sched.troms):
+                        m.d.comb += trom.rp_addr.eq(sched_trom.rp.addr)
+                    m.d.comb += [work_mem.wp.eq(sched_mem.wp)
+                                 for sched_mem, work_mem in zip(sched_mems, work_mems)]
+                    m.d.comb += [work_mem.rp.addr.eq(sched_mem.rp.addr)
+                                 for sched_mem, work_mem in zip(sched_mems, work_mems)]
+
+                    with m.If(sched.done):
+                        m.d.comb += [bf.reset.eq(1) for bf in bfs]
+                        m.next = "INIT"
+
+            return m
+
+        work_mem0, work_mem1, work_mem2 = work_mems
+
+        # the upper half of the complex transform ends up in mem1 or mem2
+        # depending on the number of stages.
+        if core_bits % 2:
+            work_upper = work_mem1
+        else:
+            work_upper = work_mem2
+
+        if self.real:
+            half = core_size // 2
+
+            split_k = Signal(range(half + 2))
+            split_p = Signal(range(half + 1))
+            split_issue = Signal()
+
+            # Stage 1: read Z[k] and Z[N/2-k], which are always in different
+            # memories, except for k=0 and k=N/4 where they are the same bin.
+
+            s1_stb  = Signal()
+            s1_low  = Signal()
+            s1_high = Signal()
+            m.d.sync += [
+                s1_stb .eq(split_issue),
+                s1_low .eq(split_k == 0),
+                s1_high.eq(split_k == half),
+            ]
+
+            z_k  = Record(complex(self.m_width))
+            z_nk = Record(complex(self.m_width))
+            with m.If(s1_high):
+                m.d.comb += z_k.eq(work_upper.rp.data)
+            with m.Else():
+                m.d.comb += z_k.eq(work_mem0.rp.data)
+            with m.If(s1_low):
+                m.d.comb += z_nk.eq(work_mem0.rp.data)
+            with m.Else():
+                m.d.comb += z_nk.eq(work_upper.rp.data)
+
+            # Stage 2: P = (Z[k] + Z*[N/2-k])/2 and Q = -j(Z[k] - Z*[N/2-k])/2
+            # go through the butterfly, giving y0 = X[k] and y1 = X*[N/2-k].
+
+            split_x0 = Record(complex(self.m_width))
+            split_x1 = Record(complex(self.m_width))
+            m.d.comb += [
+                split_x0.real.eq((z_k.real + z_nk.real)[1:]),
+                split_x0.imag.eq((z_k.imag - z_nk.imag)[1:]),
+                split_x1.real.eq((z_k.imag + z_nk.imag)[1:]),
+                split_x1.imag.eq((z_nk.real - z_k.real)[1:]),
+            ]
 
-                    mem0_wp.data.eq(i_data_sext),
-                    mem1_wp.data.eq(i_data_sext),
-                    mem2_wp.data.eq(i_data_sext),
+            y1_conj = Record(complex(self.m_width))
+            m.d.comb += [
+                y1_conj.real.eq( bf.o.y1.real),
+                y1_conj.imag.eq(-bf.o.y1.imag),
+            ]
 
-                    mem0_wp.en.eq(self.i.en & ~i_addr_rev[0]),
-                    mem1_wp.en.eq(self.i.en &  i_addr_rev[0]),
-                    mem2_wp.en.eq(self.i.en &  i_addr_rev[0]),
+        if self.bfp:
+            # The shift of a stage is chosen from the largest value it reads:
+            # a butterfly can grow its inputs by up to 1+√2, so values using
+            # more than m_width-2 bits need one bit of scaling, and values
+            # using more than m_width-1 bits need two.
+            def overflow(value):
+                flags = Signal(2)
+                for n, nbits in enumerate((3, 2)):
+                    tops = [value.real[-nbits:], value.imag[-nbits:]]
+                    m.d.comb += flags[n].eq(Cat(~top.all() & top.any() for top in tops).any())
+                return flags
+
+            def flags_shift(flags):
+                return flags[0] + flags[1]
+
+            load_flags = Array(Signal(2, name="load_flags{}".format(b)) for b in range(self.nbanks))
+            exps       = Array(Signal.like(self.o.exp, name="exp{}".format(b)) for b in range(self.nbanks))
+
+            work_flags = Signal(2)
+            work_exp   = Signal.like(self.o.exp)
+
+            with m.If(i_en):
+                m.d.sync += load_flags[self.i.bank].eq(load_flags[self.i.bank] | overflow(i_data_sext))
+
+            stage_flags = Signal(2)
+            with m.If(busy & bf.o.stb):
+                m.d.comb += stage_flags.eq(work_flags | overflow(bf.o.y0) | overflow(bf.o.y1))
+            with m.Else():
+                m.d.comb += stage_flags.eq(work_flags)
+            m.d.sync += work_flags.eq(stage_flags)
 
-                    mem0_rp.addr.eq(self.o.addr[:-1]),
-                    mem1_rp.addr.eq(self.o.addr[:-1]),
-                    mem2_rp.addr.eq(self.o.addr[:-1]),
+            with m.If(sched.start):
+                m.d.sync += [
+                    shift.eq(flags_shift(load_flags[self.bank])),
+                    work_exp.eq(i_shift + flags_shift(load_flags[self.bank])),
+                    load_flags[self.bank].eq(0),
+                    work_flags.eq(0),
+                ]
+            with m.If(sched.done):
+                m.d.sync += exps[work_bank].eq(work_exp)
+            with m.Elif(sched.stage_done):
+                m.d.sync += [
+                    shift.eq(flags_shift(stage_flags)),
+                    work_exp.eq(work_exp + flags_shift(stage_flags)),
+                    work_flags.eq(0),
+                ]
 
+            m.d.comb += self.o.exp.eq(exps[o_bank_sel])
+
+        with m.FSM():
+            with m.State("INIT"):
+                m.d.comb += [
                     self.ready.eq(1),
+                    bf.i.stb.eq(sched.o.stb),
                 ]
                 with m.If(self.start):
                     m.d.comb += sched.start.eq(1)
+                    m.d.sync += work_bank.eq(self.bank)
                     m.next = "BUSY"
 
             with m.State("BUSY"):
                 m.d.comb += [
-                    mem0_wp.addr.eq(sched.mem0.wp.addr),
-                    mem1_wp.addr.eq(sched.mem1.wp.addr),
-                    mem2_wp.addr.eq(sched.mem2.wp.addr),
+                    busy.eq(1),
 
-                    mem0_wp.data.eq(sched.mem0.wp.data),
-                    mem1_wp.data.eq(sched.mem1.wp.data),
-                    mem2_wp.data.eq(sched.mem2.wp.data),
+                    bf.i.stb.eq(sched.o.stb),
+                    bf.i.x0 .eq(sched.o.x0),
+                    bf.i.x1 .eq(sched.o.x1),
+                    bf.i.tw .eq(sched.o.tw),
 
-                    mem0_wp.en.eq(sched.mem0.wp.en),
-                    mem1_wp.en.eq(sched.mem1.wp.en),
-                    mem2_wp.en.eq(sched.mem2.wp.en),
+                    work_mem0.wp.eq(sched.mem0.wp),
+                    work_mem1.wp.eq(sched.mem1.wp),
+                    work_mem2.wp.eq(sched.mem2.wp),
 
-                    mem0_rp.addr.eq(sched.mem0.rp.addr),
-                    mem1_rp.addr.eq(sched.mem1.rp.addr),
-                    mem2_rp.addr.eq(sched.mem2.rp.addr),
+                    work_mem0.rp.addr.eq(sched.mem0.rp.addr),
+                    work_mem1.rp.addr.eq(sched.mem1.rp.addr),
+                    work_mem2.rp.addr.eq(sched.mem2.rp.addr),
                 ]
+                if self.real:
+                    m.d.comb += trom.rp_addr.eq(sched.trom.rp.addr << 1)
+                else:
+                    m.d.comb += trom.rp_addr.eq(sched.trom.rp.addr)
+
                 with m.If(sched.done):
                     m.d.comb += bf.reset.eq(1)
-                    m.next = "INIT"
+                    if self.real:
+                        m.d.sync += [
+                            split_k.eq(0),
+                            split_p.eq(0),
+                        ]
+                        m.next = "SPLIT"
+                    else:
+                        m.next = "INIT"
+
+            if self.real:
+                with m.State("SPLIT"):
+                    m.d.comb += [
+                        busy.eq(1),
+                        split_issue.eq(split_k <= half),
+
+                        work_mem0.rp.addr.eq(split_k),
+                        work_upper.rp.addr.eq(half - split_k),
+                        trom.rp_addr.eq(split_k),
+
+                        bf.i.stb.eq(s1_stb),
+                        bf.i.x0 .eq(split_x0),
+                        bf.i.x1 .eq(split_x1),
+                        bf.i.tw .eq(trom.rp_data),
+                    ]
+
+                    with m.If(split_issue):
+                        m.d.sync += split_k.eq(split_k + 1)
+
+                    with m.If(bf.o.stb):
+                        m.d.sync += split_p.eq(split_p + 1)
+
+                        with m.If(split_p == half):
+                            m.d.comb += [
+                                work_upper.wp.addr.eq(0),
+                                work_upper.wp.data.eq(bf.o.y0),
+                                work_upper.wp.en.eq(1),
+                                bf.reset.eq(1),
+                            ]
+                            m.next = "INIT"
+                        with m.Else():
+                            m.d.comb += [
+                                work_mem0.wp.addr.eq(split_p),
+                                work_mem0.wp.data.eq(bf.o.y0),
+                                work_mem0.wp.en.eq(1),
+
+                                work_upper.wp.addr.eq(half - split_p),
+                                work_upper.wp.data.eq(y1_conj),
+                                work_upper.wp.en.eq(split_p != 0),
+                            ]
+
+        return m
+
+
+class DelayLine(Elaboratable):
+    """Delay of `depth` clock enables, registered on the output."""
+    def __init__(self, width, depth):
+        if not isinstance(depth, int) or depth <= 0:
+            raise ValueError("Depth must be a positive integer, not {!r}"
+                             .format(depth))
+
+        self.ce = Signal()
+        self.i  = Signal(width)
+        self.o  = Signal(width)
+
+        self.width = width
+        self.depth = depth
+
+    def elaborate(self, platform):
+        m = Module()
+
+        if self.depth <= 4:
+            regs = [Signal(self.width, name="r{}".format(n)) for n in range(self.depth)]
+            with m.If(self.ce):
+                m.d.sync += [r.eq(r_prev) for r, r_prev in zip(regs, [self.i] + regs)]
+            m.d.comb += self.o.eq(regs[-1])
+
+        else:
+            # the read port adds one more register after the memory.
+            mem = Memory(width=self.width, depth=self.depth - 1)
+            m.submodules.mem_wp = mem_wp = mem.write_port()
+            m.submodules.mem_rp = mem_rp = mem.read_port(transparent=False)
+
+            ptr = Signal(range(self.depth - 1))
+            with m.If(self.ce):
+                m.d.sync += ptr.eq(Mux(ptr == self.depth - 2, 0, ptr + 1))
+
+            m.d.comb += [
+                mem_wp.addr.eq(ptr),
+                mem_wp.data.eq(self.i),
+                mem_wp.en.eq(self.ce),
+
+                mem_rp.addr.eq(ptr),
+                mem_rp.en.eq(self.ce),
+                self.o.eq(mem_rp.data),
+            ]
+
+        return m
+
+
+class SdfStage(Elaboratable):
+    """Radix-2 DIT stage of a streaming FFT.
+
+    The points are streamed in index order, one per clock enable. The first
+    point of each pair is delayed until the second one arrives, and the second
+    result is delayed until the first one has been emitted. `offset` is the
+    number of clock enables between the first point of the first frame and the
+    reset.
+    """
+    def __init__(self, *, size, stage, width, offset=0):
+        self.ce = Signal()
+        self.i = Record([
+            ("valid", 1),
+            ("data",  complex(width)),
+        ])
+        self.o = Record.like(self.i)
+
+        self.size    = size
+        self.stage   = stage
+        self.width   = width
+        self.offset  = offset
+        self.latency = (1 << stage) + 8
+
+    def elaborate(self, platform):
+        m = Module()
+
+        h = 1 << self.stage
+
+        m.submodules.x0  = x0_delay = DelayLine(len(self.i), h + 1)
+        m.submodules.y1  = y1_delay = DelayLine(len(self.i), h)
+        m.submodules.trom = trom = TwiddleROM(size=self.size, width=self.width)
+        m.submodules.bf  = bf = EnableInserter(self.ce)(
+            Butterfly(width=self.width, bias_width=self.width - 2, scale_bit=1))
+
+        pos = Signal(range(self.size), reset=-self.offset % self.size)
+        with m.If(self.ce):
+            m.d.sync += pos.eq(pos + 1)
+
+        x0 = Record.like(self.i)
+        x1 = Record.like(self.i)
+        x1_odd = Signal()
+        with m.If(self.ce):
+            m.d.sync += [
+                x1.eq(self.i),
+                x1_odd.eq(pos[self.stage]),
+            ]
+
+        m.d.comb += [
+            x0_delay.ce.eq(self.ce),
+            x0_delay.i.eq(self.i),
+            x0.eq(x0_delay.o),
+
+            trom.rp_en.eq(self.ce),
+            trom.rp_addr.eq((pos & (h - 1)) << (log2_int(self.size) - 1 - self.stage)),
+
+            bf.i.stb.eq(x1.valid & x1_odd),
+            bf.i.x0 .eq(x0.data),
+            bf.i.x1 .eq(x1.data),
+            bf.i.tw .eq(trom.rp_data),
+
+            y1_delay.ce.eq(self.ce),
+            y1_delay.i.eq(Cat(bf.o.stb, bf.o.y1)),
+        ]
+
+        o_pos = Signal.like(pos)
+        m.d.comb += o_pos.eq(pos - self.latency)
+
+        with m.If(o_pos[self.stage]):
+            m.d.comb += self.o.eq(y1_delay.o)
+        with m.Else():
+            m.d.comb += [
+                self.o.valid.eq(bf.o.stb),
+                self.o.data .eq(bf.o.y0),
+            ]
+
+        return m
+
+
+class SdfFFT(Elaboratable):
+    """Streaming FFT.
+
+    The samples of each frame are streamed in natural order, one per clock,
+    and the bins come out in natural order after a fixed latency. A frame is
+    first bit-reversed in a single memory, whose read and write addresses
+    alternate between natural and bit-reversed order from one frame to the
+    next. It then goes through one `SdfStage` per radix-2 stage. The results
+    are identical to `FFT`.
+
+    Frames must be streamed back to back: the pipeline only stalls within a
+    frame. When the sink is idle at a frame boundary, empty frames are pushed
+    through until all the bins have come out.
+    """
+    def __init__(self, *, size, width):
+        if not isinstance(size, int) or size < 4 or size & size - 1:
+            raise ValueError("Size must be a power-of-two integer of at least 4, not {!r}"
+                             .format(size))
+
+        self.sink   = stream.Endpoint([("data_r", (width, True)), ("data_i", (width, True))])
+        self.source = stream.Endpoint([("data_r", (width, True)), ("data_i", (width, True))])
+
+        self.size    = size
+        self.width   = width
+        self.latency = 2 * size + 8 * log2_int(size)
+
+    def elaborate(self, platform):
+        sink = self.sink
+        source = self.source
+
+        m = Module()
+
+        nbits = log2_int(self.size)
+
+        ce = Signal()
+        i = Record([
+            ("valid", 1),
+            ("data",  complex(self.width)),
+        ])
+
+        # bit reversal
+
+        i_pos = Signal(nbits)
+        i_odd = Signal()
+        with m.If(ce):
+            m.d.sync += i_pos.eq(i_pos + 1)
+            with m.If(i_pos.all()):
+                m.d.sync += i_odd.eq(~i_odd)
+
+        rev = Memory(width=len(i), depth=self.size)
+        m.submodules.rev_wp = rev_wp = rev.write_port()
+        m.submodules.rev_rp = rev_rp = rev.read_port(transparent=False)
+
+        rev_addr = Mux(i_odd, Cat(reversed(i_pos)), i_pos)
+        m.d.comb += [
+            rev_wp.addr.eq(rev_addr),
+            rev_wp.data.eq(i),
+            rev_wp.en.eq(ce),
+
+            rev_rp.addr.eq(rev_addr),
+            rev_rp.en.eq(ce),
+        ]
+
+        # stages
+
+        o = Record.like(i)
+        m.d.comb += o.eq(rev_rp.data)
+
+        offset = self.size + 1
+        for n in range(nbits):
+            stage = SdfStage(size=self.size, stage=n, width=self.width, offset=offset)
+            m.submodules["stage{}".format(n)] = stage
+            m.d.comb += [
+                stage.ce.eq(ce),
+                stage.i.eq(o),
+            ]
+            o = stage.o
+            offset += stage.latency
+
+        o_pos = Signal(nbits, reset=-offset % self.size)
+        with m.If(ce):
+            m.d.sync += o_pos.eq(o_pos + 1)
+
+        # flow control: the whole pipeline moves at once, so a bin can only
+        # be emitted when a sample or an empty slot goes in. Empty frames are
+        # inserted at frame boundaries to flush it.
+
+        bubble = Signal()
+        flushing = Signal()
+        inflight = Signal(range(self.latency + 2))
+
+        m.d.comb += bubble.eq(Mux(i_pos == 0, ~sink.valid & (inflight != 0), flushing))
+        with m.If(ce & (i_pos == 0)):
+            m.d.sync += flushing.eq(bubble)
+
+        m.d.comb += [
+            source.valid.eq(o.valid & (bubble | sink.valid)),
+            source.last.eq(o_pos.all()),
+            source.data_r.eq(o.data.real),
+            source.data_i.eq(o.data.imag),
+
+            ce.eq((bubble | sink.valid) & (~o.valid | source.ready)),
+            sink.ready.eq(~bubble & (~o.valid | source.ready)),
+
+            i.valid.eq(~bubble),
+            i.data.real.eq(sink.data_r),
+            i.data.imag.eq(sink.data_i),
+        ]
+
+        with m.If(ce):
+            m.d.sync += inflight.eq(inflight + i.valid - o.valid)
 
         return m
 
@@ -3,29 +3,214 @@ from nmigen import *
 from mfcc.misc import stream
 
 
-__all__ = ["Multiplier"]
+__all__ = ["Multiplier", "MultiplierPort", "MultiplierPool"]
 
 
 class Multiplier(Elaboratable):
-    def __init__(self, shape_a, shape_b):
+    """a * b, registered over pipe_stages stages.
+
+    With 2 stages or more, the operands are registered first, then the
+    product over the other stages. The whole pipeline advances when its
+    output is free or taken (i.ready), so the stages of a consumer can
+    follow it in lock step.
+    """
+    def __init__(self, shape_a, shape_b, pipe_stages=1):
+        if not isinstance(pipe_stages, int) or pipe_stages <= 0:
+            raise ValueError("Pipeline stage count must be a positive integer, not {!r}"
+                             .format(pipe_stages))
+        shape_a = Shape.cast(shape_a)
+        shape_b = Shape.cast(shape_b)
+        shape_c = Shape(shape_a.width + shape_b.width, shape_a.signed or shape_b.signed)
+        self.i = stream.Endpoint([("a", shape_a), ("b", shape_b)])
+        self.o = stream.Endpoint([("c", shape_c)])
+
+        self.pipe_stages = pipe_stages
+
+    def elaborate(self, platform):
+        m = Module()
+
+        ce = Signal()
+        m.d.comb += [
+            ce.eq(~self.o.valid | self.o.ready),
+            self.i.ready.eq(ce),
+        ]
+
+        if self.pipe_stages == 1:
+            a, b = self.i.a, self.i.b
+            valid, first, last = self.i.valid, self.i.first, self.i.last
+        else:
+            a = Signal.like(self.i.a, name="a_r")
+            b = Signal.like(self.i.b, name="b_r")
+            valid = Signal(name="valid_r")
+            first = Signal(name="first_r")
+            last  = Signal(name="last_r")
+            with m.If(ce):
+                m.d.sync += [
+                    a.eq(self.i.a),
+                    b.eq(self.i.b),
+                    valid.eq(self.i.valid),
+                    first.eq(self.i.first),
+                    last .eq(self.i.last),
+                ]
+
+        c = a * b
+        for j in range(max(self.pipe_stages - 2, 0)):
+            c_r = Signal.like(self.o.c, name="c_{}".format(j))
+            valid_r = Signal(name="valid_{}".format(j))
+            first_r = Signal(name="first_{}".format(j))
+            last_r  = Signal(name="last_{}".format(j))
+            with m.If(ce):
+                m.d.sync += [
+                    c_r.eq(c),
+                    valid_r.eq(valid),
+                    first_r.eq(first),
+                    last_r .eq(last),
+                ]
+            c, valid, first, last = c_r, valid_r, first_r, last_r
+
+        with m.If(ce):
+            m.d.sync += [
+                self.o.c.eq(c),
+                self.o.valid.eq(valid),
+                self.o.first.eq(first),
+                self.o.last .eq(last),
+            ]
+
+        return m
+
+
+class MultiplierPort(Elaboratable):
+    """A Multiplier whose product is computed by a MultiplierPool.
+
+    The port keeps the pipeline registers of the multiplier: it takes its
+    input when the pool grants it one of the multipliers. As in Multiplier,
+    the pipeline only advances with i.ready, a port waiting for the pool
+    holds its stages and drops its output once taken.
+    """
+    def __init__(self, shape_a, shape_b, pipe_stages=1):
         shape_a = Shape.cast(shape_a)
         shape_b = Shape.cast(shape_b)
         shape_c = Shape(shape_a.width + shape_b.width, shape_a.signed or shape_b.signed)
         self.i = stream.Endpoint([("a", shape_a), ("b", shape_b)])
         self.o = stream.Endpoint([("c", shape_c)])
 
-        self.pipe_stages = 1
+        self.pipe_stages = pipe_stages
+
+        self.req   = Signal()
+        self.grant = Signal()
+        self.c     = Signal(shape_c)
 
     def elaborate(self, platform):
         m = Module()
 
-        with m.If(~self.o.valid | self.o.ready):
-            m.d.comb += self.i.ready.eq(1)
+        ce = Signal()
+        m.d.comb += ce.eq(~self.o.valid | self.o.ready)
+
+        with m.If(ce):
+            m.d.comb += [
+                self.req.eq(self.i.valid),
+                self.i.ready.eq(~self.i.valid | self.grant),
+            ]
+
+        # the product is taken when granted, then delayed by the other stages
+        c, valid = self.c, self.i.valid
+        first, last = self.i.first, self.i.last
+        for j in range(self.pipe_stages - 1):
+            c_r = Signal.like(self.o.c, name="c_{}".format(j))
+            valid_r = Signal(name="valid_{}".format(j))
+            first_r = Signal(name="first_{}".format(j))
+            last_r  = Signal(name="last_{}".format(j))
+            with m.If(self.i.ready):
+                m.d.sync += [
+                    c_r.eq(c),
+                    valid_r.eq(valid),
+                    first_r.eq(first),
+                    last_r .eq(last),
+                ]
+            c, valid, first, last = c_r, valid_r, first_r, last_r
+
+        with m.If(self.i.ready):
             m.d.sync += [
-                self.o.c.eq(self.i.a * self.i.b),
-                self.o.valid.eq(self.i.valid),
-                self.o.first.eq(self.i.first),
-                self.o.last .eq(self.i.last),
+                self.o.c.eq(c),
+                self.o.valid.eq(valid),
+                self.o.first.eq(first),
+                self.o.last .eq(last),
             ]
+        with m.Elif(ce):
+            m.d.sync += self.o.valid.eq(0)
+
+        return m
+
+
+class MultiplierPool(Elaboratable):
+    """size multipliers shared by the ports built by port(), which can be
+    given as the multiplier_cls of the stages.
+
+    Port k is served by multiplier k % size, which takes the requests of its
+    ports in a round-robin order. The ports are granted independently, a
+    stage must not rely on several of its multipliers taking their inputs
+    in the same clock.
+    """
+    def __init__(self, size=1, pipe_stages=1):
+        if not isinstance(size, int) or size <= 0:
+            raise ValueError("Pool size must be a positive integer, not {!r}"
+                             .format(size))
+        if not isinstance(pipe_stages, int) or pipe_stages <= 0:
+            raise ValueError("Pipeline stage count must be a positive integer, not {!r}"
+                             .format(pipe_stages))
+        self.size = size
+        self.pipe_stages = pipe_stages
+        self.ports = []
+
+    def port(self, shape_a, shape_b):
+        port = MultiplierPort(shape_a, shape_b, pipe_stages=self.pipe_stages)
+        self.ports.append(port)
+        return port
+
+    def elaborate(self, platform):
+        m = Module()
+
+        # the operands of all the ports fit in the shapes of the multipliers
+        def common(shapes):
+            signed = any(shape.signed for shape in shapes)
+            width = max(shape.width + (signed and not shape.signed) for shape in shapes)
+            return Shape(width, signed)
+
+        shape_a = common([port.i.a.shape() for port in self.ports])
+        shape_b = common([port.i.b.shape() for port in self.ports])
+
+        for u in range(min(self.size, len(self.ports))):
+            ports = self.ports[u::self.size]
+
+            # operands are sign or zero extended, depending on their port
+            a = Signal(shape_a, name="a{}".format(u))
+            b = Signal(shape_b, name="b{}".format(u))
+            c = Signal(Shape(shape_a.width + shape_b.width, shape_a.signed or shape_b.signed),
+                       name="c{}".format(u))
+            sel = Signal(range(len(ports)), name="sel{}".format(u))
+            prev = Signal(range(len(ports)), name="prev{}".format(u))
+
+            with m.Switch(prev):
+                for j in range(len(ports)):
+                    with m.Case(j):
+                        for offset in reversed(range(1, len(ports) + 1)):
+                            k = (j + offset) % len(ports)
+                            with m.If(ports[k].req):
+                                m.d.comb += sel.eq(k)
+
+            with m.Switch(sel):
+                for k, port in enumerate(ports):
+                    with m.Case(k):
+                        m.d.comb += [
+                            a.eq(port.i.a),
+                            b.eq(port.i.b),
+                            port.grant.eq(port.req),
+                        ]
+                        with m.If(port.req):
+                            m.d.sync += prev.eq(k)
+
+            m.d.comb += c.eq(a * b)
+            for port in ports:
+                m.d.comb += port.c.eq(c)
 
         return m
@@ -3,7 +3,7 @@ from nmigen.hdl.rec import *
 from nmigen.lib import fifo
 
 
-__all__ = ["Endpoint", "SyncFIFO", "AsyncFIFO"]
+__all__ = ["Endpoint", "SyncFIFO", "AsyncFIFO", "PipeValid", "PipeReady", "SkidBuffer"]
 
 
 def _make_fanout(layout):
@@ -111,3 +111,171 @@ class AsyncFIFO(Elaboratable, _FIFOWrapper):
         self.depth   = self.fifo.depth
         self.r_rst   = self.fifo.r_rst
         self.r_level = self.fifo.r_level
+
+
+class PipeValid(Elaboratable):
+    """Register slice of valid and the payload. sink.ready still depends on
+    source.ready."""
+    def __init__(self, layout):
+        self.sink   = Endpoint(layout)
+        self.source = Endpoint(layout)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        with m.If(~self.source.valid | self.source.ready):
+            m.d.comb += self.sink.ready.eq(1)
+            m.d.sync += [
+                self.source.valid.eq(self.sink.valid),
+                self.source.first.eq(self.sink.first),
+                self.source.last.eq(self.sink.last),
+                self.source.payload.eq(self.sink.payload),
+            ]
+
+        return m
+
+
+class PipeReady(Elaboratable):
+    """Register slice of ready. The data taken while source is stalled is
+    kept in a buffer, and sink.ready is only deasserted while it is full."""
+    def __init__(self, layout):
+        self.sink   = Endpoint(layout)
+        self.source = Endpoint(layout)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        buf = Record(self.sink.layout)
+        buffered = Signal()
+
+        m.d.comb += self.sink.ready.eq(~buffered)
+
+        with m.If(buffered):
+            m.d.comb += [
+                self.source.valid.eq(1),
+                self.source.first.eq(buf.first),
+                self.source.last.eq(buf.last),
+                self.source.payload.eq(buf.payload),
+            ]
+            with m.If(self.source.ready):
+                m.d.sync += buffered.eq(0)
+        with m.Else():
+            m.d.comb += [
+                self.source.valid.eq(self.sink.valid),
+                self.source.first.eq(self.sink.first),
+                self.source.last.eq(self.sink.last),
+                self.source.payload.eq(self.sink.payload),
+            ]
+            with m.If(self.sink.valid & ~self.source.ready):
+                m.d.sync += [
+                    buffered.eq(1),
+                    buf.first.eq(self.sink.first),
+                    buf.last.eq(self.sink.last),
+                    buf.payload.eq(self.sink.payload),
+                ]
+
+        return m
+
+
+class SkidBuffer(Elaboratable):
+    """Register slice of both valid and ready, at full throughput."""
+    def __init__(self, layout):
+        self.sink   = Endpoint(layout)
+        self.source = Endpoint(layout)
+
+    def elaborate(self, platform):
+        m = Module()
+
+        m.submodules.pipe_ready = pipe_ready = PipeReady(self.sink.description)
+        m.submodules.pipe_valid = pipe_valid = PipeValid(self.sink.description)
+        m.d.comb += [
+            self.sink.connect(pipe_ready.sink),
+            pipe_ready.source.connect(pipe_valid.sink),
+            pipe_valid.source.connect(self.source),
+        ]
+
+        return m
+
+
+import unittest
+
+class PipeTestCase(unittest.TestCase):
+    def check(self, cls, count=100):
+        import random
+        from nmigen.sim import Simulator, Settle
+
+        dut = cls([("data", 8)])
+        sim = Simulator(dut)
+        sim.add_clock(1e-6)
+
+        rng = random.Random(0)
+        data = [rng.randrange(256) for n in range(count)]
+
+        def sender():
+            rng = random.Random(1)
+            for n, value in enumerate(data):
+                while rng.random() < 0.3:
+                    yield dut.sink.valid.eq(0)
+                    yield
+                yield dut.sink.valid.eq(1)
+                yield dut.sink.data.eq(value)
+                yield dut.sink.first.eq(n % 10 == 0)
+                yield dut.sink.last.eq(n % 10 == 9)
+                yield Settle()
+                while not (yield dut.sink.ready):
+                    yield
+                    yield Settle()
+                yield
+            yield dut.sink.valid.eq(0)
+
+        def receiver():
+            rng = random.Random(2)
+            output = []
+            while len(output) < count:
+                yield dut.source.ready.eq(rng.random() < 0.7)
+                yield Settle()
+                if (yield dut.source.valid) and (yield dut.source.ready):
+                    n = len(output)
+                    output.append((yield dut.source.data))
+                    self.assertEqual((yield dut.source.first), n % 10 == 0)
+                    self.assertEqual((yield dut.source.last), n % 10 == 9)
+                yield
+            self.assertEqual(output, data)
+
+        sim.add_sync_process(sender)
+        sim.add_sync_process(receiver)
+        sim.run()
+
+    def check_throughput(self, cls, count=20):
+        from nmigen.sim import Simulator, Settle
+
+        dut = cls([("data", 8)])
+        sim = Simulator(dut)
+        sim.add_clock(1e-6)
+
+        def bench():
+            # always valid and ready: one transfer per cycle
+            yield dut.sink.valid.eq(1)
+            yield dut.source.ready.eq(1)
+            for cycle in range(count):
+                yield dut.sink.data.eq(cycle)
+                yield Settle()
+                self.assertTrue((yield dut.sink.ready))
+                if cycle > 2:
+                    self.assertTrue((yield dut.source.valid))
+                yield
+
+        sim.add_sync_process(bench)
+        sim.run()
+
+    def test_pipe_valid(self):
+        self.check(PipeValid)
+        self.check_throughput(PipeValid)
+
+    def test_pipe_ready(self):
+        self.check(PipeReady)
+        self.check_throughput(PipeReady)
+
+    def test_skid_buffer(self):
+        self.check(SkidBuffer)
+        self.check_throughput(SkidBuffer)
@@ -0,0 +1 @@
+from .mfcc import MFCCModel
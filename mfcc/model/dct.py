@@ -0,0 +1,127 @@
+import numpy as np
+
+from .fft import wrap, fft, twiddles, butterfly
+from ..core.dct_mac import dct_coefficients
+
+
+__all__ = ["dct", "dct_makhoul", "dct_coefficients", "dct_mac"]
+
+
+def dct(x, width=16):
+    """DCT-II of mfcc.core.dct_stream.DCTStream, along the last axis.
+
+    The input is zero-interleaved and mirrored into a 4N-point sequence,
+    and only the real part of the first N bins of its FFT is kept.
+    """
+    x = np.asarray(x, dtype=np.int64)
+    n = x.shape[-1]
+    seq = np.zeros(x.shape[:-1] + (4 * n,), dtype=np.int64)
+    seq[..., 1:2*n:2] = x
+    seq[..., 2*n+1::2] = x[..., ::-1]
+    r, _ = fft(seq, width=width)
+    return r[..., :n]
+
+
+def dct_makhoul(x, width=16):
+    """DCT-II of mfcc.core.dct_stream.DCTStream(engine="makhoul"), along the
+    last axis.
+
+    The even samples followed by the odd samples in reverse order go through
+    an N-point FFT, and bin k is rotated by exp(-jπk/2N) with the butterfly
+    rounding. The scale is the same as dct().
+    """
+    x = np.asarray(x, dtype=np.int64)
+    n = x.shape[-1]
+    seq = np.concatenate([x[..., 0::2], x[..., 1::2][..., ::-1]], axis=-1)
+    v_r, v_i = fft(seq, width=width)
+    tw_r, tw_i = twiddles(4 * n, width)
+    zero = np.zeros_like(v_r)
+    y0_r, _, _, _ = butterfly(zero, zero, v_r, v_i, tw_r[:n], tw_i[:n],
+                              width=width, bias_width=width - 2, scale_bit=1)
+    return y0_r
+
+
+def dct_mac(x, first=0, count=None, width=16, coef_width=16):
+    """DCT-II of mfcc.core.dct_mac.DCTMac, along the last axis.
+
+    Only the coefficients first..first+count-1 are computed, as rounded dot
+    products with dct_coefficients(), at the same scale as dct().
+    """
+    x = np.asarray(x, dtype=np.int64)
+    n = x.shape[-1]
+    acc = x @ dct_coefficients(n, first, count, coef_width).T
+    shift = coef_width - 2 + (2 * n).bit_length() - 1
+    return wrap((acc + (1 << shift - 1)) >> shift, width)
+
+
+import unittest
+
+class DCTTestCase(unittest.TestCase):
+    def check(self, engine, size=32, nframes=2, first=0, count=None, nlanes=1, pipe_stages=1):
+        from nmigen.sim import Simulator, Settle
+        from ..core.dct_stream import DCTStream
+        from ..core.dct_mac import DCTMac
+        from ..misc.mul import Multiplier
+        from functools import partial
+
+        rng = np.random.default_rng(size)
+        data = rng.integers(-2**15, 2**15, (nframes, size))
+        if engine == "mac":
+            model = dct_mac(data, first, count)
+            dut = DCTMac(width=16, nfft=size, first=first, count=count, nlanes=nlanes,
+                         multiplier_cls=partial(Multiplier, pipe_stages=pipe_stages))
+        else:
+            model = dct_makhoul(data) if engine == "makhoul" else dct(data)
+            dut = DCTStream(width=16, nfft=size, engine=engine)
+        nout = model.shape[-1]
+        sim = Simulator(dut)
+        sim.add_clock(1e-6)
+
+        def sender():
+            for frame in data:
+                for i, value in enumerate(frame):
+                    yield dut.sink.valid.eq(1)
+                    yield dut.sink.data.eq(int(value))
+                    yield dut.sink.last.eq(i == size - 1)
+                    yield Settle()
+                    while not (yield dut.sink.ready):
+                        yield
+                        yield Settle()
+                    yield
+            yield dut.sink.valid.eq(0)
+
+        def receiver():
+            output = []
+            cycle = 0
+            while len(output) < nframes * nout:
+                # ready every other cycle to exercise backpressure
+                cycle += 1
+                yield dut.source.ready.eq(cycle % 2)
+                yield Settle()
+                if (yield dut.source.valid) and (yield dut.source.ready):
+                    output.append((yield dut.source.data))
+                    self.assertEqual((yield dut.source.last), len(output) % nout == 0)
+                yield
+            self.assertEqual(output, list(model.flat))
+
+        sim.add_sync_process(sender)
+        sim.add_sync_process(receiver)
+        sim.run()
+
+    def test_fft4(self):
+        self.check("fft4")
+
+    def test_makhoul(self):
+        self.check("makhoul")
+
+    def test_makhoul_16(self):
+        self.check("makhoul", size=16)
+
+    def test_mac(self):
+        self.check("mac", first=0, count=13)
+
+    def test_mac_lanes(self):
+        self.check("mac", first=1, count=12, nlanes=4, nframes=3)
+
+    def test_mac_pipe_3(self):
+        self.check("mac", first=0, count=13, nlanes=2, pipe_stages=3)
@@ -0,0 +1,379 @@
+import numpy as np
+
+
+__all__ = ["wrap", "twiddles", "butterfly", "fft", "rfft", "fft_bfp", "fft_rescale"]
+
+
+def wrap(x, width):
+    # two's complement truncation of an integer array to `width` bits
+    mask = (1 << width) - 1
+    half = 1 << (width - 1)
+    return ((x + half) & mask) - half
+
+
+def twiddles(size, width):
+    # content of mfcc.misc.fft.TwiddleROM, unfolded over the half circle
+    p = np.linspace(start=0, stop=np.pi / 2, num=int(size // 4), endpoint=False)
+    rom = np.round((1 << (width - 2)) * np.exp(-1j * p))
+    c = rom.real.astype(np.int64)
+    s = rom.imag.astype(np.int64)
+    tw_r = np.concatenate([c,  s])
+    tw_i = np.concatenate([s, -c])
+    return wrap(tw_r, width), wrap(tw_i, width)
+
+
+def butterfly(x0_r, x0_i, x1_r, x1_i, tw_r, tw_i, *, width, bias_width, scale_bit):
+    # same rounding as mfcc.misc.fft.Butterfly: biased product truncated by
+    # bias_width bits, then the sum truncated by scale_bit bits.
+    if bias_width > 0:
+        bias = (1 << bias_width - 1) - 1
+    else:
+        bias = 0
+
+    p_r = (x1_r * tw_r - x1_i * tw_i + bias) >> bias_width
+    p_i = (x1_i * tw_r + x1_r * tw_i + bias) >> bias_width
+
+    y0_r = wrap((x0_r + p_r) >> scale_bit, width)
+    y0_i = wrap((x0_i + p_i) >> scale_bit, width)
+    y1_r = wrap((x0_r - p_r) >> scale_bit, width)
+    y1_i = wrap((x0_i - p_i) >> scale_bit, width)
+    return y0_r, y0_i, y1_r, y1_i
+
+
+def _bitrev(size):
+    bits = size.bit_length() - 1
+    idx = np.arange(size)
+    rev = np.zeros_like(idx)
+    for b in range(bits):
+        rev |= ((idx >> b) & 1) << (bits - 1 - b)
+    return rev
+
+
+def fft(x_r, x_i=None, *, width=16, bias_width=None, scale_bit=1):
+    """Radix-2 DIT block FFT of mfcc.misc.fft.FFT, along the last axis.
+
+    Inputs are integer arrays of shape (..., size); the result is a pair of
+    int64 arrays (real, imag) in natural order, scaled by 1/size.
+    """
+    x_r = np.asarray(x_r, dtype=np.int64)
+    if x_i is None:
+        x_i = np.zeros_like(x_r)
+    else:
+        x_i = np.asarray(x_i, dtype=np.int64)
+
+    size = x_r.shape[-1]
+    if size <= 0 or size & size - 1:
+        raise ValueError("Size must be a positive power-of-two integer, not {!r}"
+                         .format(size))
+    if bias_width is None:
+        bias_width = width - 2
+
+    rev = _bitrev(size)
+    a_r = wrap(x_r, width)[..., rev]
+    a_i = wrap(x_i, width)[..., rev]
+
+    tw_r, tw_i = twiddles(size, width)
+    lead = a_r.shape[:-1]
+
+    half = 1
+    while half < size:
+        groups = size // (2 * half)
+        a_r = a_r.reshape(lead + (groups, 2, half))
+        a_i = a_i.reshape(lead + (groups, 2, half))
+
+        k = np.arange(half) * (size // (2 * half))
+        y0_r, y0_i, y1_r, y1_i = butterfly(
+            a_r[..., 0, :], a_i[..., 0, :],
+            a_r[..., 1, :], a_i[..., 1, :],
+            tw_r[k], tw_i[k],
+            width=width, bias_width=bias_width, scale_bit=scale_bit)
+
+        a_r = np.stack([y0_r, y1_r], axis=-2).reshape(lead + (size,))
+        a_i = np.stack([y0_i, y1_i], axis=-2).reshape(lead + (size,))
+        half *= 2
+
+    return a_r, a_i
+
+
+def rfft(x, *, width=16, bias_width=None, scale_bit=1):
+    """Real-input FFT of mfcc.misc.fft.FFT(real=True), along the last axis.
+
+    The even and odd samples are packed into a complex FFT of half the size,
+    which is then split with one more butterfly pass. The result is a pair of
+    int64 arrays (real, imag) holding the first size/2 bins, scaled by 1/size.
+    """
+    x = np.asarray(x, dtype=np.int64)
+    size = x.shape[-1]
+    if size < 8 or size & size - 1:
+        raise ValueError("Size must be a power-of-two integer of at least 8, not {!r}"
+                         .format(size))
+    if bias_width is None:
+        bias_width = width - 2
+
+    x = wrap(x, width)
+    z_r, z_i = fft(x[..., 0::2], x[..., 1::2], width=width,
+                   bias_width=bias_width, scale_bit=scale_bit)
+
+    half = size // 4
+    k = np.arange(half + 1)
+    zk_r  = z_r[..., k % (2 * half)]
+    zk_i  = z_i[..., k % (2 * half)]
+    znk_r = z_r[..., (2 * half - k) % (2 * half)]
+    znk_i = z_i[..., (2 * half - k) % (2 * half)]
+
+    tw_r, tw_i = twiddles(size, width)
+    y0_r, y0_i, y1_r, y1_i = butterfly(
+        (zk_r + znk_r) >> 1, (zk_i - znk_i) >> 1,
+        (zk_i + znk_i) >> 1, (znk_r - zk_r) >> 1,
+        tw_r[k], tw_i[k],
+        width=width, bias_width=bias_width, scale_bit=scale_bit)
+
+    # y0 is X[k], y1 is conj(X[size/2-k])
+    o_r = np.concatenate([y0_r[..., :half], y1_r[..., half:0:-1]], axis=-1)
+    o_i = np.concatenate([y0_i[..., :half], -y1_i[..., half:0:-1]], axis=-1)
+    o_r[..., half] = y0_r[..., half]
+    o_i[..., half] = y0_i[..., half]
+    return o_r, wrap(o_i, width)
+
+
+def _bfp_shift(a_r, a_i, width):
+    # overflow flags of mfcc.misc.fft.FFT(bfp=True): one bit of scaling if
+    # any value needs more than width-2 bits, two if it needs more than
+    # width-1 bits.
+    def fits(bits):
+        lim = 1 << (bits - 1)
+        return np.all((a_r >= -lim) & (a_r < lim) & (a_i >= -lim) & (a_i < lim), axis=-1)
+    return (~fits(width - 2)).astype(np.int64) + (~fits(width - 1)).astype(np.int64)
+
+
+def fft_bfp(x_r, x_i=None, *, width=16, i_width=None, bias_width=None):
+    """Block floating point FFT of mfcc.misc.fft.FFT(bfp=True), along the last axis.
+
+    Each stage is scaled by 0 to 2 bits depending on its largest input. The
+    result is a tuple (real, imag, exp) where the transform is scaled by
+    2**-exp; exp has one value per frame.
+    """
+    x_r = np.asarray(x_r, dtype=np.int64)
+    if x_i is None:
+        x_i = np.zeros_like(x_r)
+    else:
+        x_i = np.asarray(x_i, dtype=np.int64)
+
+    size = x_r.shape[-1]
+    if size <= 0 or size & size - 1:
+        raise ValueError("Size must be a positive power-of-two integer, not {!r}"
+                         .format(size))
+    if i_width is None:
+        i_width = width
+    if bias_width is None:
+        bias_width = width - 2
+
+    # inputs wider than the memories keep their most significant bits
+    base = max(i_width - width, 0)
+    rev = _bitrev(size)
+    a_r = wrap(x_r >> base, width)[..., rev]
+    a_i = wrap(x_i >> base, width)[..., rev]
+
+    tw_r, tw_i = twiddles(size, width)
+    lead = a_r.shape[:-1]
+
+    shift = _bfp_shift(a_r, a_i, width)
+    exp = base + shift
+
+    half = 1
+    while half < size:
+        groups = size // (2 * half)
+        a_r = a_r.reshape(lead + (groups, 2, half))
+        a_i = a_i.reshape(lead + (groups, 2, half))
+
+        k = np.arange(half) * (size // (2 * half))
+        y0_r, y0_i, y1_r, y1_i = butterfly(
+            a_r[..., 0, :], a_i[..., 0, :],
+            a_r[..., 1, :], a_i[..., 1, :],
+            tw_r[k], tw_i[k],
+            width=width, bias_width=bias_width, scale_bit=shift[..., None, None])
+
+        a_r = np.stack([y0_r, y1_r], axis=-2).reshape(lead + (size,))
+        a_i = np.stack([y0_i, y1_i], axis=-2).reshape(lead + (size,))
+        half *= 2
+
+        if half < size:
+            shift = _bfp_shift(a_r, a_i, width)
+            exp = exp + shift
+
+    return a_r, a_i, exp
+
+
+
+def fft_rescale(x, exp, *, size, width):
+    """Bring a transform scaled by 2**-exp back to the 1/size scale of fft(),
+    saturated to `width` bits, as mfcc.core.fft_stream.FftStream does."""
+    x = np.asarray(x, dtype=np.int64)
+    shift = np.asarray(exp, dtype=np.int64)[..., None] - (size.bit_length() - 1)
+    y = np.where(shift >= 0, x << np.maximum(shift, 0), x >> np.maximum(-shift, 0))
+    lim = 1 << (width - 1)
+    return np.clip(y, -lim, lim - 1)
+
+
+import unittest
+
+class FFTTestCase(unittest.TestCase):
+    def check(self, size, real=False, radix=2, nbutterflies=1, bfp=False, m_width=16, amplitude=2**15,
+              i_size=None, o_size=None):
+        from nmigen.sim import Simulator, Delay
+        from ..misc.fft import FFT
+
+        rng = np.random.default_rng(size)
+        data_r = rng.integers(-amplitude, amplitude, size)
+        if real:
+            data_i = np.zeros_like(data_r)
+        else:
+            data_i = rng.integers(-amplitude, amplitude, size)
+        if i_size is not None:
+            data_r[i_size:] = 0
+            data_i[i_size:] = 0
+
+        model_exp = size.bit_length() - 1
+        if real:
+            model_r, model_i = rfft(data_r, width=16)
+        elif bfp:
+            model_r, model_i, model_exp = fft_bfp(data_r, data_i, width=m_width, i_width=16)
+        else:
+            model_r, model_i = fft(data_r, data_i, width=16)
+        if o_size is not None:
+            model_r, model_i = model_r[:o_size], model_i[:o_size]
+
+        dut = FFT(size=size, i_width=16, o_width=m_width, m_width=m_width, real=real, radix=radix,
+                  nbutterflies=nbutterflies, bfp=bfp, i_size=i_size, o_size=o_size)
+        sim = Simulator(dut)
+        sim.add_clock(1e-6)
+
+        def process():
+            for i in range(size):
+                yield dut.i.addr.eq(i)
+                yield dut.i.data.real.eq(int(data_r[i]))
+                yield dut.i.data.imag.eq(int(data_i[i]))
+                yield dut.i.en.eq(1)
+                yield
+            yield dut.i.en.eq(0)
+            yield dut.start.eq(1)
+            yield
+            yield dut.start.eq(0)
+            yield
+            while not (yield dut.ready):
+                yield
+            yield
+
+            for i in range(len(model_r)):
+                yield dut.o.addr.eq(i)
+                yield; yield Delay()
+                self.assertEqual((yield dut.o.data.real), model_r[i])
+                self.assertEqual((yield dut.o.data.imag), model_i[i])
+                self.assertEqual((yield dut.o.exp), model_exp)
+
+        sim.add_sync_process(process)
+        sim.run()
+
+    def test_16(self):
+        self.check(16)
+
+    def test_128(self):
+        self.check(128)
+
+    def test_512(self):
+        self.check(512)
+
+    def test_real_128(self):
+        self.check(128, real=True)
+
+    def test_real_512(self):
+        self.check(512, real=True)
+
+    def test_radix4_128(self):
+        self.check(128, radix=4)
+
+    def test_radix4_512(self):
+        self.check(512, radix=4)
+
+    def test_parallel_512(self):
+        self.check(512, nbutterflies=4)
+
+    def test_parallel_radix4_128(self):
+        self.check(128, radix=4, nbutterflies=2)
+
+    def test_bfp_512(self):
+        self.check(512, bfp=True)
+
+    def test_bfp_narrow_512(self):
+        self.check(512, bfp=True, m_width=12)
+
+    def test_bfp_small_128(self):
+        self.check(128, bfp=True, amplitude=2**6)
+
+    def test_pruned_512(self):
+        self.check(512, i_size=200, o_size=100)
+
+    def test_pruned_real_128(self):
+        self.check(128, real=True, i_size=64)
+
+    def test_sdf(self):
+        from nmigen.sim import Simulator, Settle
+        from ..misc.fft import SdfFFT
+
+        size, nframes = 64, 3
+        rng = np.random.default_rng(size)
+        data_r = rng.integers(-2**15, 2**15, (nframes, size))
+        data_i = rng.integers(-2**15, 2**15, (nframes, size))
+        model_r, model_i = fft(data_r, data_i, width=16)
+
+        dut = SdfFFT(size=size, width=16)
+        sim = Simulator(dut)
+        sim.add_clock(1e-6)
+
+        def process():
+            yield dut.source.ready.eq(1)
+            o_r, o_i = [], []
+            for n in range(nframes * size + dut.latency):
+                if n < nframes * size:
+                    yield dut.sink.valid.eq(1)
+                    yield dut.sink.data_r.eq(int(data_r.flat[n]))
+                    yield dut.sink.data_i.eq(int(data_i.flat[n]))
+                else:
+                    yield dut.sink.valid.eq(0)
+                yield Settle()
+                if (yield dut.source.valid):
+                    o_r.append((yield dut.source.data_r))
+                    o_i.append((yield dut.source.data_i))
+                yield
+            self.assertEqual(o_r, list(model_r.flat))
+            self.assertEqual(o_i, list(model_i.flat))
+
+        sim.add_sync_process(process)
+        sim.run()
+
+
+if __name__ == "__main__":
+    import sys
+    from scipy.io import wavfile
+    from .mfcc import MFCCModel
+
+    # accuracy of the FFT stage of the pipeline against a floating point
+    # transform of the same windowed frames, with the 1/nfft scale.
+    configs = [
+        ("fixed, 16-bit", dict()),
+        ("fixed, 12-bit", dict(fft_m_width=12)),
+        ("bfp, 16-bit",   dict(fft_bfp=True)),
+        ("bfp, 12-bit",   dict(fft_bfp=True, fft_m_width=12)),
+    ]
+
+    names = sys.argv[1:] or ["f2bjrop1.0.wav"]
+    for name in names:
+        audio = wavfile.read(name)[1]
+        print(name)
+        for label, kwargs in configs:
+            model = MFCCModel(nfft=512, nfilters=32, nceptrums=16, **kwargs)
+            out = model.stages(model.frames(audio))
+            ref = np.fft.fft(out["window"])[..., :model.nfft//2] / model.nfft
+            err = out["fft"] + 1j * out["fft_i"] - ref
+            snr = 10 * np.log10(np.sum(np.abs(ref)**2) / np.sum(np.abs(err)**2))
+            print("  {:<14} FFT SNR {:5.1f} dB".format(label, snr))
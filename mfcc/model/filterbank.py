@@ -0,0 +1,304 @@
+import math
+import numpy as np
+
+
+__all__ = ["freq_to_mel", "mel_to_freq", "get_filter_points", "calc_filters",
+           "filterbank_bins", "filterbank_terms", "filterbank_matrix", "filterbank",
+           "filterbank_drop", "filterbank_float"]
+
+
+def freq_to_mel(freq):
+    return 2595.0 * np.log10(1.0 + freq / 700.0)
+
+def mel_to_freq(mels):
+    return 700.0 * (10.0**(mels / 2595.0) - 1.0)
+
+def get_filter_points(fmin, fmax, mel_filter_num, FFT_size, sample_rate=44100):
+    fmin_mel = freq_to_mel(fmin)
+    fmax_mel = freq_to_mel(fmax)
+    mels = np.linspace(fmin_mel, fmax_mel, num=mel_filter_num+2)
+    freqs = mel_to_freq(mels)
+    return np.floor((FFT_size + 1) / sample_rate * freqs).astype(int)
+
+def calc_filters(tab, wsize=9):
+    output = []
+    max_acc = 1 << ((2*wsize))
+    for i in range(len(tab)-1):
+        diff = int(tab[i+1] - tab[i] -1)
+        if(diff):
+            step = (max_acc//diff) -1
+        else:
+            step = max_acc-1
+        output.append(step)
+    return output
+
+
+def filterbank_bins(sample_rate=16000, nfft=512, ntap=16, fmin=0, fmax=None):
+    """First bin and number of bins taken by mfcc.core.filterbank.FilterBank:
+    the bins from the first filter point up to the last one, excluded."""
+    if fmax is None:
+        fmax = sample_rate/2
+    points = get_filter_points(fmin, fmax, ntap, nfft, sample_rate=sample_rate)
+    return int(points[0]), int(min(points[-1], nfft//2)) - int(points[0])
+
+
+def filterbank_terms(width=24, width_mul=None, sample_rate=16000, nfft=512, ntap=16,
+                     fmin=0, fmax=None):
+    """Replay the ascending/descending accumulators of
+    mfcc.core.filterbank.FilterBank over the bins of one frame, from the
+    first to the last filter point.
+
+    The accumulators add the product c = x*w of each bin with its weight w,
+    and the bin scaled as d = x << width_mul. Returns the weights, the
+    (ntap, nbins) matrices of the coefficients of the c and d terms in each
+    filter output, and maxvalrange.
+    """
+    if width_mul is None:
+        width_mul = width
+    if fmax is None:
+        fmax = sample_rate/2
+
+    points = get_filter_points(fmin, fmax, ntap, nfft, sample_rate=sample_rate)
+    filters = calc_filters(points, wsize=width_mul)
+    maxvalrange = int(math.log2(points[-1] - points[-3])) + width + width_mul
+
+    _, nbins = filterbank_bins(sample_rate, nfft, ntap, fmin, fmax)
+    acc_mask = (1 << 2 * width_mul) - 1
+    highest = (1 << width_mul) - 1
+
+    i_acc = 0
+    filter_adr = 0
+    weights = np.zeros(nbins, dtype=np.int64)
+    rega = np.zeros((2, nbins), dtype=np.int64)
+    regb = np.zeros((2, nbins), dtype=np.int64)
+    rows = []
+
+    for k in range(nbins):
+        last = (k == nbins - 1)
+        w = i_acc >> width_mul
+        weights[k] = w
+        if w == highest or last:
+            if filter_adr != 0:
+                rows.append(regb)
+            regb = rega.copy()
+            regb[1, k] += 1
+            rega = np.zeros((2, nbins), dtype=np.int64)
+            filter_adr = 0 if last else filter_adr + 1
+            i_acc = 0
+        else:
+            rega[0, k] += 1
+            regb[0, k] -= 1
+            regb[1, k] += 1
+            i_acc = (i_acc + filters[filter_adr]) & acc_mask
+
+    rows = np.array(rows).reshape(-1, 2, nbins)
+    return weights, rows[:, 0], rows[:, 1], maxvalrange
+
+
+def filterbank_matrix(width=24, width_mul=None, sample_rate=16000, nfft=512, ntap=16,
+                      fmin=0, fmax=None):
+    """Returns the (ntap, nbins) matrix of integer weights such that each
+    filter output of mfcc.core.filterbank.FilterBank is the matrix product
+    with the power bins, modulo 2**maxvalrange, together with maxvalrange.
+    """
+    if width_mul is None:
+        width_mul = width
+
+    weights, c, d, maxvalrange = filterbank_terms(width, width_mul, sample_rate, nfft, ntap,
+                                                  fmin, fmax)
+    matrix = c.astype(object) * weights.astype(object) + d.astype(object) * (1 << width_mul)
+    return matrix % (1 << maxvalrange), maxvalrange
+
+
+def filterbank(power, matrix, maxvalrange, width_output=24, gain=0):
+    lsb = max(maxvalrange - (gain + width_output), 0)
+    if lsb + width_output <= 64:
+        # the output bits only depend on the accumulators modulo 2**64,
+        # where wrapping uint64 arithmetic is exact
+        matrix = (matrix % (1 << 64)).astype(np.uint64)
+        acc = np.asarray(power).astype(np.uint64) @ matrix.T
+        out = (acc >> np.uint64(lsb)) & np.uint64((1 << width_output) - 1)
+    else:
+        acc = (np.asarray(power).astype(object) @ matrix.T) % (1 << maxvalrange)
+        out = (acc >> lsb) & ((1 << width_output) - 1)
+    return out.astype(np.int64)
+
+
+def filterbank_drop(maxvalrange, width_output=24, gain=0, guard=0):
+    # accumulator bits below the output, and its guard bits, are not kept
+    return max(maxvalrange - (gain + width_output) - guard, 0)
+
+
+def filterbank_float(mant, exp, terms, width_mul, width_output=24, gain=0, guard=0):
+    """mfcc.core.filterbank.FilterBank(mant_width=...) on power bins
+    normalised to mant << exp: every term is truncated to the accumulator
+    bits that are kept, see filterbank_drop()."""
+    weights, c, d, maxvalrange = terms
+    mant = np.asarray(mant, dtype=np.int64)
+    exp = np.asarray(exp, dtype=np.int64)
+    drop = filterbank_drop(maxvalrange, width_output, gain, guard)
+    t_c = ((mant * weights) << exp) >> drop
+    t_d = (mant << width_mul + exp) >> drop
+    acc = (t_c @ c.T + t_d @ d.T) % (1 << maxvalrange - drop)
+    lsb = max(maxvalrange - (gain + width_output) - drop, 0)
+    return (acc >> lsb) & ((1 << width_output) - 1)
+
+
+import unittest
+
+class FilterBankTestCase(unittest.TestCase):
+    def check(self, mant_width=None, lanes=1, nfft=128, ntap=12, nframes=2, pipe_stages=1,
+              mul_pool=None, fmin=0, fmax=None):
+        from nmigen import Module
+        from nmigen.sim import Simulator, Settle, Passive
+        from functools import partial
+        from ..core.filterbank import FilterBank
+        from ..misc.mul import Multiplier, MultiplierPool
+        from .pow2 import power_normalize
+
+        width, width_output, gain = 30, 16, 18
+        if mul_pool is None:
+            multiplier_cls = partial(Multiplier, pipe_stages=pipe_stages)
+        else:
+            pool = MultiplierPool(size=mul_pool, pipe_stages=pipe_stages)
+            multiplier_cls = pool.port
+        dut = FilterBank(width=width, width_output=width_output, width_mul=mant_width,
+                         gain=gain, nfft=nfft, ntap=ntap, fmin=fmin, fmax=fmax,
+                         mant_width=mant_width, lanes=lanes, multiplier_cls=multiplier_cls)
+        top = dut
+        hogs = []
+        if mul_pool is not None:
+            # other ports contend for every multiplier of the pool, at random
+            top = Module()
+            top.submodules.dut = dut
+            top.submodules.pool = pool
+            for u in range(mul_pool):
+                top.submodules["hog_{}".format(u)] = hog = pool.port(8, 8)
+                top.d.comb += hog.o.ready.eq(1)
+                hogs.append(hog)
+
+        rng = np.random.default_rng(nfft)
+        power = rng.integers(0, 1 << width, (nframes, dut.nbins)) >> rng.integers(0, width, (nframes, dut.nbins))
+        if mant_width is None:
+            matrix, maxvalrange = filterbank_matrix(width=width, nfft=nfft, ntap=ntap,
+                                                    fmin=fmin, fmax=fmax)
+            model = filterbank(power, matrix, maxvalrange, width_output=width_output, gain=gain)
+            data, exp = power, np.zeros_like(power)
+        else:
+            terms = filterbank_terms(width=width, width_mul=mant_width, nfft=nfft, ntap=ntap,
+                                     fmin=fmin, fmax=fmax)
+            data, exp = power_normalize(power, width, mant_width)
+            model = filterbank_float(data, exp, terms, mant_width, width_output=width_output,
+                                     gain=gain, guard=dut.guard_bits)
+
+        self.assertEqual(model.shape, (nframes, ntap))
+
+        sim = Simulator(top)
+        sim.add_clock(1e-6)
+
+        def pack(values, width):
+            return sum(int(v) << l * width for l, v in enumerate(values))
+
+        dw = len(dut.sink.data) // lanes
+        ew = len(dut.sink.exp) // lanes if mant_width is not None else 0
+
+        def sender():
+            for frame, frame_exp in zip(data, exp):
+                for k in range(0, dut.nbins, lanes):
+                    yield dut.sink.valid.eq(1)
+                    yield dut.sink.data.eq(pack(frame[k:k + lanes], dw))
+                    if mant_width is not None:
+                        yield dut.sink.exp.eq(pack(frame_exp[k:k + lanes], ew))
+                    yield dut.sink.last.eq(k + lanes >= dut.nbins)
+                    yield Settle()
+                    while not (yield dut.sink.ready):
+                        yield
+                        yield Settle()
+                    yield
+            yield dut.sink.valid.eq(0)
+
+        def receiver():
+            output = []
+            cycle = 0
+            while len(output) < model.size:
+                # ready every other cycle to exercise backpressure
+                cycle += 1
+                yield dut.source.ready.eq(cycle % 2)
+                yield Settle()
+                if (yield dut.source.valid) and (yield dut.source.ready):
+                    output.append((yield dut.source.data))
+                    self.assertEqual((yield dut.source.last), len(output) % model.shape[-1] == 0)
+                yield
+            self.assertEqual(output, list(model.flat))
+
+        def contender():
+            yield Passive()
+            while True:
+                for hog in hogs:
+                    yield hog.i.valid.eq(int(rng.integers(0, 2)))
+                yield
+
+        sim.add_sync_process(sender)
+        sim.add_sync_process(receiver)
+        if hogs:
+            sim.add_sync_process(contender)
+        sim.run()
+
+    def test_fixed(self):
+        self.check()
+
+    def test_float(self):
+        self.check(mant_width=18)
+
+    def test_lanes_2(self):
+        self.check(lanes=2)
+
+    def test_lanes_4(self):
+        self.check(lanes=4, nfft=512, ntap=32)
+
+    def test_float_lanes_4(self):
+        self.check(mant_width=18, lanes=4, nfft=256, ntap=16)
+
+    def test_pipe_4(self):
+        self.check(pipe_stages=4)
+
+    def test_lanes_2_pipe_3(self):
+        self.check(lanes=2, pipe_stages=3)
+
+    def test_pool_pipe_2(self):
+        self.check(mul_pool=1, pipe_stages=2)
+
+    def test_float_lanes_2_pool_pipe_3(self):
+        self.check(mant_width=18, lanes=2, mul_pool=1, pipe_stages=3)
+
+    def test_lanes_4_pool_2(self):
+        self.check(lanes=4, nfft=512, ntap=32, mul_pool=2)
+
+    def test_lanes_2_pool_2_pipe_2(self):
+        self.check(lanes=2, mul_pool=2, pipe_stages=2)
+
+    def test_band(self):
+        self.check(nfft=512, ntap=16, fmin=300, fmax=3400)
+
+    def test_float_band(self):
+        self.check(mant_width=18, nfft=512, ntap=32, fmin=300, fmax=6000)
+
+    def test_bands(self):
+        from ..core.filterbank import FilterBank
+        for nfft, ntap in [(256, 16), (512, 16), (512, 32)]:
+            for fmin in [0, 100, 300, 500]:
+                for fmax in [3400, 4000, 6000, 7600, 8000]:
+                    with self.subTest(nfft=nfft, ntap=ntap, fmin=fmin, fmax=fmax):
+                        dut = FilterBank(nfft=nfft, ntap=ntap, fmin=fmin, fmax=fmax)
+                        self.assertEqual(filterbank_bins(nfft=nfft, ntap=ntap, fmin=fmin, fmax=fmax),
+                                         (dut.first_bin, dut.nbins))
+                        emits = [emit for _, _, emit in dut.lane_table()]
+                        self.assertEqual(sum(emits), ntap)
+                        self.assertEqual(emits[-1], 1)
+                        _, c, _, _ = filterbank_terms(nfft=nfft, ntap=ntap, fmin=fmin, fmax=fmax)
+                        self.assertEqual(c.shape, (ntap, dut.nbins))
+
+    def test_narrow_band(self):
+        from ..core.filterbank import FilterBank
+        with self.assertRaisesRegex(ValueError, r"too narrow for 16 filters"):
+            FilterBank(nfft=64, ntap=16)
@@ -0,0 +1,93 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+__all__ = ["nframes", "frame"]
+
+
+def nframes(length, windowlen, stepsize):
+    if length < windowlen:
+        return 0
+    return (length - windowlen) // stepsize + 1
+
+
+def frame(x, windowlen=400, stepsize=160, nfft=512):
+    """Strided (nframes, nfft) view of the frames produced by
+    mfcc.core.frame.Frame, zero-padded from windowlen to nfft."""
+    assert(windowlen <= nfft)
+    x = np.asarray(x, dtype=np.int64)
+    n = nframes(len(x), windowlen, stepsize)
+
+    frames = sliding_window_view(x, windowlen)[:n * stepsize:stepsize]
+    if windowlen < nfft:
+        frames = np.pad(frames, ((0, 0), (0, nfft - windowlen)))
+    return frames
+
+
+import unittest
+
+class FrameTestCase(unittest.TestCase):
+    def check(self, nchannels=1, windowlen=25, stepsize=8, nfft=32, length=100):
+        from nmigen.sim import Simulator, Settle
+        from ..core.frame import Frame
+
+        rng = np.random.default_rng(nchannels)
+        data = rng.integers(-2**15, 2**15, (nchannels, length))
+        model = [frame(x, windowlen=windowlen, stepsize=stepsize, nfft=nfft) for x in data]
+        count = sum(len(m) for m in model)
+
+        dut = Frame(windowlen=windowlen, stepsize=stepsize, nfft=nfft, nchannels=nchannels)
+        sim = Simulator(dut)
+        sim.add_clock(1e-6)
+
+        def sender():
+            # the samples of the channels are interleaved
+            for n in range(length):
+                for k in range(nchannels):
+                    yield dut.sink.valid.eq(1)
+                    yield dut.sink.data.eq(int(data[k, n]))
+                    if nchannels > 1:
+                        yield dut.sink.channel.eq(k)
+                    yield Settle()
+                    while not (yield dut.sink.ready):
+                        yield
+                        yield Settle()
+                    yield
+            yield dut.sink.valid.eq(0)
+
+        def receiver():
+            frames = [[] for k in range(nchannels)]
+            output = []
+            cycle = 0
+            while sum(len(f) for f in frames) < count:
+                # ready every other cycle to exercise backpressure
+                cycle += 1
+                yield dut.source.ready.eq(cycle % 2)
+                yield Settle()
+                if (yield dut.source.valid) and (yield dut.source.ready):
+                    channel = (yield dut.source.channel) if nchannels > 1 else 0
+                    self.assertEqual((yield dut.source.first), len(output) == 0)
+                    output.append((yield dut.source.data))
+                    # frames are output whole
+                    if (yield dut.source.last):
+                        self.assertEqual(len(output), nfft)
+                        frames[channel].append(output)
+                        output = []
+                    else:
+                        self.assertLess(len(output), nfft)
+                yield
+            for f, m in zip(frames, model):
+                self.assertEqual(f, m.tolist())
+
+        sim.add_sync_process(sender)
+        sim.add_sync_process(receiver)
+        sim.run()
+
+    def test_single(self):
+        self.check()
+
+    def test_channels(self):
+        self.check(nchannels=3)
+
+    def test_channels_nopadding(self):
+        self.check(nchannels=2, windowlen=32)
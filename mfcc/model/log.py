@@ -0,0 +1,197 @@
+import math
+import numpy as np
+
+from ..core.log import log2_table
+
+
+__all__ = ["log2_precision", "log2fix", "log2_table", "log2table"]
+
+
+def log2_precision(width, width_output):
+    return width_output - math.ceil(math.log2(width))
+
+
+def log2fix(x, width, width_output):
+    """Turner's iterative binary logarithm of mfcc.core.log.Log2Fix.
+
+    The integer part comes from the SHIFT-RIGHT normalisation, and each of
+    the precision-1 CALC iterations squares the mantissa to get one more
+    fractional bit. The last fractional bit is never computed.
+    """
+    precision = log2_precision(width, width_output)
+    x = np.asarray(x, dtype=np.int64)
+    x = np.where(x == 0, 1, x)
+
+    # normalise x << precision to precision+1 bits
+    shift = np.zeros_like(x)
+    for b in range(1, width + 1):
+        shift = np.where(x >> b != 0, b, shift)
+    z = (x << precision) >> shift
+    out = shift << precision
+
+    mask = (1 << precision + 1) - 1
+    b = 1 << (precision - 1)
+    for _ in range(precision - 1):
+        c = (z & mask) * (z & mask)
+        top = (c >> (2 * precision + 1)) & 1
+        z = np.where(top, c >> (precision + 1), c >> precision)
+        out = out + top * b
+        b >>= 1
+
+    return out & ((1 << width_output) - 1)
+
+
+def log2table(x, width, width_output, table_bits, guard_bits=2):
+    """Lookup and linear interpolation logarithm of mfcc.core.log.Log2FixTable,
+    wrapped like mfcc.core.log.Log2Fix."""
+    precision = log2_precision(width, width_output)
+    x = np.asarray(x, dtype=np.int64)
+    x = np.where(x == 0, 1, x)
+
+    shift = np.zeros_like(x)
+    for b in range(1, width + 1):
+        shift = np.where(x >> b != 0, b, shift)
+    z = (x << precision) >> shift
+
+    table = log2_table(precision, table_bits, guard_bits)
+    frac = z & ((1 << precision) - 1)
+    idx = frac >> (precision - table_bits)
+    rem = frac & ((1 << precision - table_bits) - 1)
+    y0 = table[idx]
+    d = table[idx + 1] - table[idx]
+    y = (y0 + ((d * rem) >> (precision - table_bits))) >> guard_bits
+
+    out = (shift << precision) + y
+    return out & ((1 << width_output) - 1)
+
+
+def log2_report(width=16, width_output=15, table_bits=range(2, 10), guard_bits=2):
+    """Compare Log2FixTable against Log2FixCalc (Turner) and the exact
+    logarithm over every input value, in LSBs of the fixed-point output."""
+    precision = log2_precision(width, width_output)
+    x = np.arange(1, 1 << width)
+    exact = np.log2(x) * (1 << precision)
+    turner = log2fix(x, width, width_output)
+
+    rows = [("turner", 0, "{0}x{0}".format(precision + 1),
+             np.abs(turner - exact), np.zeros_like(exact))]
+    for k in table_bits:
+        if k >= precision:
+            continue
+        table = log2table(x, width, width_output, k, guard_bits)
+        y = log2_table(precision, k, guard_bits)
+        y_width = int(y.max()).bit_length()
+        d_width = int(np.diff(y).max()).bit_length()
+        rows.append(("table k={}".format(k), (y_width + d_width) << k,
+                     "{}x{}".format(d_width, precision - k),
+                     np.abs(table - exact), np.abs(table - turner)))
+
+    print("precision: {} fractional bits".format(precision))
+    print("{:<12} {:>8} {:>10} {:>12} {:>12} {:>12} {:>12}".format(
+          "engine", "rom bits", "multiplier",
+          "max |exact|", "rms |exact|", "max |turner|", "rms |turner|"))
+    for name, rom_bits, mul, err, diff in rows:
+        print("{:<12} {:>8} {:>10} {:>12.3f} {:>12.3f} {:>12.0f} {:>12.3f}".format(
+              name, rom_bits, mul, err.max(), np.sqrt(np.mean(err**2)),
+              diff.max(), np.sqrt(np.mean(diff**2))))
+
+
+import unittest
+
+class Log2FixTestCase(unittest.TestCase):
+    def check(self, calc_cls, model, count=200, pipe_stages=1, mul_pool=None):
+        from nmigen import Module
+        from nmigen.sim import Simulator, Settle
+        from functools import partial
+        from ..core.log import Log2Fix
+        from ..misc.mul import Multiplier, MultiplierPool
+
+        width, width_output = 16, 15
+        rng = np.random.default_rng(0)
+        x = rng.integers(0, 1 << width, count) >> rng.integers(0, width, count)
+        x[:4] = [0, 1, 2, (1 << width) - 1]
+        expected = model(x, width, width_output)
+
+        if mul_pool is None:
+            multiplier_cls = partial(Multiplier, pipe_stages=pipe_stages)
+        else:
+            pool = MultiplierPool(size=mul_pool, pipe_stages=pipe_stages)
+            multiplier_cls = pool.port
+        dut = Log2Fix(width, width_output, calc_cls=calc_cls, multiplier_cls=multiplier_cls)
+        top = dut
+        if mul_pool is not None:
+            # another port keeps every multiplier of the pool busy
+            top = Module()
+            top.submodules.dut = dut
+            top.submodules.pool = pool
+            for u in range(mul_pool):
+                top.submodules["hog_{}".format(u)] = hog = pool.port(8, 8)
+                top.d.comb += [hog.i.valid.eq(1), hog.o.ready.eq(1)]
+        sim = Simulator(top)
+        sim.add_clock(1e-6)
+
+        def sender():
+            for n in range(count):
+                yield dut.sink.valid.eq(1)
+                yield dut.sink.data.eq(int(x[n]))
+                yield dut.sink.last.eq(n == count - 1)
+                yield Settle()
+                while not (yield dut.sink.ready):
+                    yield
+                    yield Settle()
+                yield
+            yield dut.sink.valid.eq(0)
+
+        def receiver():
+            output = []
+            while len(output) < count:
+                # random backpressure
+                yield dut.source.ready.eq(int(rng.integers(0, 2)))
+                yield Settle()
+                if (yield dut.source.valid) and (yield dut.source.ready):
+                    output.append((yield dut.source.data))
+                    self.assertEqual((yield dut.source.last), len(output) == count)
+                yield
+            self.assertEqual(output, list(expected))
+
+        sim.add_sync_process(sender)
+        sim.add_sync_process(receiver)
+        sim.run()
+
+    def check_pipe(self, **kwargs):
+        from ..core.log import Log2FixPipe
+        self.check(Log2FixPipe, log2fix, **kwargs)
+
+    def test_pipe(self):
+        self.check_pipe()
+
+    def test_pipe_mul_2(self):
+        self.check_pipe(pipe_stages=2)
+
+    def test_pipe_mul_3(self):
+        self.check_pipe(pipe_stages=3)
+
+    def test_pipe_pool_2(self):
+        self.check_pipe(mul_pool=2, pipe_stages=2)
+
+    def check_table(self, table_bits, **kwargs):
+        from functools import partial
+        from ..core.log import Log2FixTable
+        self.check(partial(Log2FixTable, table_bits=table_bits),
+                   partial(log2table, table_bits=table_bits), **kwargs)
+
+    def test_table_4(self):
+        self.check_table(4)
+
+    def test_table_6(self):
+        self.check_table(6)
+
+    def test_table_9(self):
+        self.check_table(9)
+
+    def test_table_pool_pipe_3(self):
+        self.check_table(6, mul_pool=1, pipe_stages=3)
+
+
+if __name__ == "__main__":
+    log2_report()
@@ -0,0 +1,364 @@
+import numpy as np
+
+from .preemph import *
+from .frame import *
+from .window import *
+from .fft import *
+from .pow2 import *
+from .filterbank import *
+from .log import *
+from .dct import *
+
+
+__all__ = ["MFCCModel"]
+
+
+class MFCCModel:
+    """Bit-exact NumPy model of mfcc.core.mfcc.MFCC.
+
+    Each utterance is framed into one (nframes, nfft) array and every stage
+    is applied to all of its frames at once. An utterance starts from the
+    reset state of the core, and the audio is not padded: only the frames
+    that fit entirely in the input are computed.
+    """
+    def __init__(self, width=16, nfft=512, samplerate=16e3,
+                 nfilters=16, nceptrums=16, fmin=0, fmax=None,
+                 fft_real=False, fft_m_width=None,
+                 fft_bfp=False, power_mode="exact", filter_mant_width=None,
+                 dct_engine="fft4", windowlen=None):
+        self.width = width
+        self.nfft = nfft
+        self.samplerate = samplerate
+        self.nfilters = nfilters
+        self.nceptrums = nceptrums
+        self.fmin = fmin
+        self.fmax = samplerate/2 if fmax is None else fmax
+        self.fft_real = fft_real
+        self.fft_m_width = width if fft_m_width is None else fft_m_width
+        self.fft_bfp = fft_bfp
+        self.power_mode = power_mode
+        self.filter_mant_width = filter_mant_width
+        self.dct_engine = dct_engine
+
+        # the windows are zero-padded from windowlen to nfft samples
+        self.windowlen = nfft if windowlen is None else windowlen
+        self.stepsize = nfft//3
+        self.window_precision = 8
+        self.power_width = 30
+        self.filter_width = 16
+        self.filter_gain = 18
+        self.log_width = 15
+
+        self.curve = window_curve(nfft=nfft, precision=self.window_precision)
+        self.first_bin, self.nbins = filterbank_bins(
+            sample_rate=samplerate, nfft=nfft, ntap=nfilters,
+            fmin=self.fmin, fmax=self.fmax)
+        self.matrix, self.maxvalrange = filterbank_matrix(
+            width=self.power_width, width_mul=filter_mant_width,
+            sample_rate=samplerate, nfft=nfft, ntap=nfilters,
+            fmin=self.fmin, fmax=self.fmax)
+        if filter_mant_width is not None:
+            self.terms = filterbank_terms(
+                width=self.power_width, width_mul=filter_mant_width,
+                sample_rate=samplerate, nfft=nfft, ntap=nfilters,
+                fmin=self.fmin, fmax=self.fmax)
+            points = get_filter_points(self.fmin, self.fmax, nfilters, nfft,
+                                       sample_rate=samplerate)
+            self.filter_guard = int(points[-1] - points[-3]).bit_length() + 1
+
+    def frames(self, audio):
+        return frame(preemph(audio, self.width),
+                     windowlen=self.windowlen,
+                     stepsize=self.stepsize,
+                     nfft=self.nfft)
+
+    def stages(self, frames):
+        """Run framed audio through the pipeline and return the output of
+        every stage, keyed like the collectors of mfcc-sim."""
+        out = {"frame": np.asarray(frames, dtype=np.int64)}
+        out["window"] = window(out["frame"], self.curve,
+                               width=self.width,
+                               precision=self.window_precision)
+        # inputs wider than the FFT memories keep their most significant bits
+        m_shift = max(self.width - self.fft_m_width, 0)
+        if self.fft_bfp:
+            fft_r, fft_i, fft_exp = fft_bfp(out["window"], width=self.fft_m_width,
+                                            i_width=self.width)
+        elif self.fft_real:
+            fft_r, fft_i = rfft(out["window"] >> m_shift, width=self.fft_m_width)
+            fft_exp = m_shift + self.nfft.bit_length() - 1
+        else:
+            fft_r, fft_i = fft(out["window"] >> m_shift, width=self.fft_m_width)
+            fft_exp = m_shift + self.nfft.bit_length() - 1
+        if self.fft_bfp or self.fft_m_width != self.width:
+            fft_r = fft_rescale(fft_r, fft_exp, size=self.nfft, width=self.width)
+            fft_i = fft_rescale(fft_i, fft_exp, size=self.nfft, width=self.width)
+        # only the bins used by the filters are emitted
+        bins = slice(self.first_bin, self.first_bin + self.nbins)
+        out["fft"] = fft_r[..., bins]
+        out["fft_i"] = fft_i[..., bins]
+        if self.power_mode == "amax":
+            out["power"] = power_spectrum_amax(out["fft"], out["fft_i"],
+                                               width=self.width,
+                                               width_output=self.power_width)
+        else:
+            out["power"] = power_spectrum(out["fft"], out["fft_i"],
+                                          width=self.width,
+                                          width_output=self.power_width)
+        if self.filter_mant_width is not None:
+            mant, exp = power_normalize(out["power"], self.power_width,
+                                        self.filter_mant_width)
+            out["filter"] = filterbank_float(mant, exp, self.terms,
+                                             self.filter_mant_width,
+                                             width_output=self.filter_width,
+                                             gain=self.filter_gain,
+                                             guard=self.filter_guard)
+        else:
+            out["filter"] = filterbank(out["power"], self.matrix, self.maxvalrange,
+                                       width_output=self.filter_width,
+                                       gain=self.filter_gain)
+        out["log"] = log2fix(out["filter"], self.filter_width, self.log_width)
+        if self.dct_engine == "mac":
+            out["dct"] = dct_mac(out["log"], count=self.nceptrums, width=self.width)
+        elif self.dct_engine == "makhoul":
+            out["dct"] = dct_makhoul(out["log"], width=self.width)
+        else:
+            out["dct"] = dct(out["log"], width=self.width)
+        out["discard"] = out["dct"][..., :self.nceptrums]
+        return out
+
+    def __call__(self, audio):
+        return self.stages(self.frames(audio))["discard"]
+
+    def batch(self, audios):
+        # frames of all utterances go through the pipeline as a single array
+        frames = [self.frames(audio) for audio in audios]
+        if not frames:
+            return []
+        cepstra = self.stages(np.concatenate(frames))["discard"]
+        bounds = np.cumsum([len(f) for f in frames])[:-1]
+        return np.split(cepstra, bounds)
+
+
+import unittest
+
+def chirp(length, samplerate=16e3, seed=0):
+    """Test audio for the cores: a chirp over noise, with some clipping."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(length) / samplerate
+    f = 200 + 100 * seed + 2e5 * t
+    audio = 20000 * np.sin(2 * np.pi * f * t) + rng.normal(0, 2000, length)
+    return np.clip(audio, -2**15, 2**15 - 1).astype(np.int64)
+
+
+class MFCCTestCase(unittest.TestCase):
+    def check(self, nfft=128, nfilters=8, nceptrums=8, nframes=3, **kwargs):
+        import inspect
+        from nmigen.sim import Simulator, Settle
+        from ..core.mfcc import MFCC
+
+        dut = MFCC(nfft=nfft, nfilters=nfilters, nceptrums=nceptrums, **kwargs)
+        params = inspect.signature(MFCCModel).parameters
+        model = MFCCModel(nfft=nfft, nfilters=nfilters, nceptrums=nceptrums,
+                          **{k: v for k, v in kwargs.items() if k in params})
+
+        audio = chirp(model.windowlen + (nframes - 1) * model.stepsize)
+        expected = model(audio)
+        self.assertEqual(expected.shape, (nframes, nceptrums))
+
+        sim = Simulator(dut)
+        sim.add_clock(1e-6)
+
+        def sender():
+            for sample in audio:
+                yield dut.sink.valid.eq(1)
+                yield dut.sink.data.eq(int(sample))
+                yield Settle()
+                while not (yield dut.sink.ready):
+                    yield
+                    yield Settle()
+                yield
+            yield dut.sink.valid.eq(0)
+
+        def receiver():
+            cepstra = []
+            output = []
+            cycle = 0
+            while len(cepstra) < nframes:
+                self.assertLess(cycle, 100 * nfft * nframes, "the core stalled")
+                # ready every other cycle to exercise backpressure
+                cycle += 1
+                yield dut.source.ready.eq(cycle % 2)
+                yield Settle()
+                if (yield dut.source.valid) and (yield dut.source.ready):
+                    output.append((yield dut.source.data))
+                    if (yield dut.source.last):
+                        cepstra.append(output)
+                        output = []
+                yield
+            self.assertEqual(cepstra, expected.tolist())
+
+        sim.add_sync_process(sender)
+        sim.add_sync_process(receiver)
+        sim.run()
+
+    def test_default(self):
+        self.check()
+
+    def test_nfft_256(self):
+        self.check(nfft=256, nfilters=16, nceptrums=12)
+
+    def test_band(self):
+        self.check(fmin=300, fmax=3400)
+
+    def test_fft_real(self):
+        self.check(fft_real=True)
+
+    def test_fft_radix_4(self):
+        self.check(fft_radix=4, fft_nbanks=2)
+
+    def test_fft_sdf(self):
+        self.check(fft_engine="sdf")
+
+    def test_fft_sdf_nfft_64(self):
+        self.check(nfft=64, fft_engine="sdf")
+
+    def test_fft_m_width(self):
+        self.check(fft_m_width=12)
+
+    def test_fft_bfp(self):
+        self.check(fft_m_width=12, fft_bfp=True)
+
+    def test_power_amax(self):
+        self.check(power_mode="amax")
+
+    def test_filter_mant_width(self):
+        self.check(filter_mant_width=18)
+
+    def test_dct_makhoul(self):
+        self.check(dct_engine="makhoul")
+
+    def test_dct_mac(self):
+        self.check(dct_engine="mac", dct_nlanes=2, nceptrums=5)
+
+    def test_mul_pipe_3(self):
+        self.check(mul_pipe_stages=3)
+
+    def test_mul_pool_pipe_2(self):
+        self.check(mul_pool=1, mul_pipe_stages=2, filter_mant_width=18)
+
+    def test_register_slices(self):
+        self.check(register_slices="skid")
+
+    def test_fifo_depths(self):
+        self.check(fifo_depths={"power": 2, "filter": 2})
+
+    def check_channels(self, nchannels, nfft=128, nfilters=8, nceptrums=8, nframes=3, **kwargs):
+        from nmigen.sim import Simulator, Settle
+        from ..core.mfcc import MFCC
+
+        dut = MFCC(nfft=nfft, nfilters=nfilters, nceptrums=nceptrums, nchannels=nchannels,
+                   **kwargs)
+        model = MFCCModel(nfft=nfft, nfilters=nfilters, nceptrums=nceptrums)
+
+        length = model.windowlen + (nframes - 1) * model.stepsize
+        audios = [chirp(length, seed=c) for c in range(nchannels)]
+        expected = [model(audio).tolist() for audio in audios]
+
+        # the channels come in bursts of random lengths, some channels
+        # more often than others, so that a channel runs ahead and fills
+        # its frame memory while the others lag
+        rng = np.random.default_rng(nchannels)
+        weights = np.arange(1, nchannels + 1) / sum(range(1, nchannels + 1))
+        left = [list(audio) for audio in audios]
+        signal = []
+        while any(left):
+            c = rng.choice(nchannels, p=weights)
+            burst = int(rng.integers(1, nfft // 2))
+            signal += [(int(a), c) for a in left[c][:burst]]
+            del left[c][:burst]
+
+        sim = Simulator(dut)
+        sim.add_clock(1e-6)
+
+        def sender():
+            for data, channel in signal:
+                yield dut.sink.valid.eq(1)
+                yield dut.sink.data.eq(data)
+                yield dut.sink.channel.eq(channel)
+                yield Settle()
+                while not (yield dut.sink.ready):
+                    yield
+                    yield Settle()
+                yield
+            yield dut.sink.valid.eq(0)
+
+        def receiver():
+            cepstra = [[] for c in range(nchannels)]
+            output = [[] for c in range(nchannels)]
+            cycle = 0
+            while sum(map(len, cepstra)) < nframes * nchannels:
+                self.assertLess(cycle, 100 * nfft * nframes * nchannels, "the core stalled")
+                # random backpressure
+                cycle += 1
+                yield dut.source.ready.eq(int(rng.integers(0, 2)))
+                yield Settle()
+                if (yield dut.source.valid) and (yield dut.source.ready):
+                    channel = yield dut.source.channel
+                    output[channel].append((yield dut.source.data))
+                    if (yield dut.source.last):
+                        cepstra[channel].append(output[channel])
+                        output[channel] = []
+                yield
+            self.assertEqual(cepstra, expected)
+
+        sim.add_sync_process(sender)
+        sim.add_sync_process(receiver)
+        sim.run()
+
+    def test_channels_2(self):
+        self.check_channels(2, fifo_depths={"channels": 2})
+
+    def test_channels_3(self):
+        self.check_channels(3, fifo_depths={"channels": 2, "power": 2, "filter": 2})
+
+    def test_channels_3_fft_sdf(self):
+        self.check_channels(3, fft_engine="sdf", fifo_depths={"channels": 2})
+
+    def test_windowlen(self):
+        self.check(windowlen=96)
+
+    def test_windowlen_fold(self):
+        self.check(windowlen=64)
+
+    def test_windowlen_real(self):
+        self.check(windowlen=64, fft_real=True)
+
+    def test_windowlen_sdf(self):
+        self.check(windowlen=96, fft_engine="sdf")
+
+    def test_windowlen_step(self):
+        from ..core.mfcc import MFCC
+        with self.assertRaisesRegex(ValueError, r"between the step \(42\)"):
+            MFCC(nfft=128, windowlen=40)
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    from scipy.io import wavfile
+
+    model = MFCCModel(nfft=512, nfilters=32, nceptrums=16)
+    names = sys.argv[1:] or ["f2bjrop1.0.wav"]
+    audios = [wavfile.read(name)[1] for name in names]
+
+    start = time.time()
+    cepstra = model.batch(audios)
+    elapsed = time.time() - start
+
+    nframes = sum(len(c) for c in cepstra)
+    duration = sum(len(a) for a in audios) / model.samplerate
+    print("{} frames in {:.3f}s: {:.0f} frames/s, {:.0f}x real time"
+          .format(nframes, elapsed, nframes / elapsed, duration / elapsed))
+    for name, c in zip(names, cepstra):
+        np.save(name.rsplit(".", 1)[0] + ".mfcc.npy", c)
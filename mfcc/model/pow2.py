@@ -0,0 +1,161 @@
+import numpy as np
+
+
+__all__ = ["power_spectrum", "power_spectrum_amax", "power_normalize"]
+
+
+def power_spectrum(r, i, width=16, width_output=24):
+    # r² + i² keeping the width_output upper bits of the 2*width result
+    r = np.asarray(r, dtype=np.int64)
+    i = np.asarray(i, dtype=np.int64)
+    p = (r * r + i * i) & ((1 << 2 * width) - 1)
+    return p >> (2 * width - width_output)
+
+
+def power_spectrum_amax(r, i, width=16, width_output=24, lut_bits=8):
+    """|X|² of mfcc.core.pow2.PowerSpectrum(mode="amax").
+
+    The magnitude is estimated as max(hi, 7/8·hi + 1/2·lo) of the larger
+    and smaller absolute values, and squared from its upper lut_bits bits:
+    a mantissa m shifted by e squares to m(m+1)·4**e, the square of the
+    middle of its truncation interval.
+    """
+    r = np.abs(np.asarray(r, dtype=np.int64))
+    i = np.abs(np.asarray(i, dtype=np.int64))
+    hi = np.maximum(r, i)
+    lo = np.minimum(r, i)
+    mag = np.maximum(hi, hi - (hi >> 3) + (lo >> 1))
+
+    e = np.zeros_like(mag)
+    for b in range(lut_bits, width):
+        e = np.where(mag >> b != 0, b - lut_bits + 1, e)
+    m = mag >> e
+    p = (m * m + np.where(e != 0, m, 0)) << 2 * e
+    return p >> (2 * width - width_output)
+
+
+def power_normalize(x, width=30, mant_width=18):
+    """mfcc.core.pow2.PowerNormalize: x truncated to mant << exp, with a
+    mant_width-bit mantissa."""
+    x = np.asarray(x, dtype=np.int64)
+    exp = np.zeros_like(x)
+    for b in range(mant_width, width):
+        exp = np.where(x >> b != 0, b - mant_width + 1, exp)
+    return x >> exp, exp
+
+
+import unittest
+
+class PowerSpectrumTestCase(unittest.TestCase):
+    def check(self, mode, count=200, mul_pool=None, pipe_stages=1):
+        from nmigen import Module
+        from nmigen.sim import Simulator, Settle
+        from ..core.pow2 import PowerSpectrum
+        from ..misc.mul import Multiplier, MultiplierPool
+        from functools import partial
+
+        rng = np.random.default_rng(0)
+        r, i = rng.integers(-2**15, 2**15, (2, count))
+        r[:4] = [-2**15, 2**15 - 1, 0, 1]
+        i[:4] = [-2**15, -2**15, 0, 0]
+        if mode == "amax":
+            model = power_spectrum_amax(r, i, width_output=30)
+        else:
+            model = power_spectrum(r, i, width_output=30)
+
+        if mul_pool is None:
+            dut = PowerSpectrum(width=16, width_output=30, mode=mode,
+                                multiplier_cls=partial(Multiplier, pipe_stages=pipe_stages))
+            top = dut
+        else:
+            pool = MultiplierPool(size=mul_pool, pipe_stages=pipe_stages)
+            dut = PowerSpectrum(width=16, width_output=30, mode=mode,
+                                multiplier_cls=pool.port)
+            top = Module()
+            top.submodules.dut = dut
+            top.submodules.pool = pool
+        sim = Simulator(top)
+        sim.add_clock(1e-6)
+
+        def sender():
+            for n in range(count):
+                yield dut.sink.valid.eq(1)
+                yield dut.sink.data_r.eq(int(r[n]))
+                yield dut.sink.data_i.eq(int(i[n]))
+                yield dut.sink.last.eq(n == count - 1)
+                yield Settle()
+                while not (yield dut.sink.ready):
+                    yield
+                    yield Settle()
+                yield
+            yield dut.sink.valid.eq(0)
+
+        def receiver():
+            output = []
+            cycle = 0
+            while len(output) < count:
+                # ready every other cycle to exercise backpressure
+                cycle += 1
+                yield dut.source.ready.eq(cycle % 2)
+                yield Settle()
+                if (yield dut.source.valid) and (yield dut.source.ready):
+                    output.append((yield dut.source.data))
+                    self.assertEqual((yield dut.source.last), len(output) == count)
+                yield
+            self.assertEqual(output, list(model))
+
+        sim.add_sync_process(sender)
+        sim.add_sync_process(receiver)
+        sim.run()
+
+    def test_exact(self):
+        self.check("exact")
+
+    def test_amax(self):
+        self.check("amax")
+
+    def test_pool(self):
+        self.check("exact", mul_pool=1)
+
+    def test_pipe_3(self):
+        self.check("exact", pipe_stages=3)
+
+    def test_pool_pipe_2(self):
+        self.check("exact", mul_pool=1, pipe_stages=2)
+
+
+if __name__ == "__main__":
+    import sys
+    from scipy.io import wavfile
+    from .mfcc import MFCCModel
+
+    # error of the magnitude estimate against the exact power over the
+    # whole input range, then through the filter bank and the logarithm.
+    rng = np.random.default_rng(0)
+    r, i = rng.integers(-2**15, 2**15, (2, 1 << 20))
+    exact = power_spectrum(r, i, width_output=32).astype(np.float64)
+    approx = power_spectrum_amax(r, i, width_output=32)
+    ok = exact >= 1 << 16
+    err = (approx[ok] - exact[ok]) / exact[ok] * 100
+    print("|X|²: error {:+.2f}% .. {:+.2f}%, mean {:+.2f}%".format(
+          err.min(), err.max(), err.mean()))
+
+    names = sys.argv[1:] or ["f2bjrop1.0.wav"]
+    for name in names:
+        audio = wavfile.read(name)[1]
+        print(name)
+        models = [MFCCModel(nfft=512, nfilters=32, nceptrums=16, power_mode=mode)
+                  for mode in ("exact", "amax")]
+        ref, out = [model.stages(model.frames(audio)) for model in models]
+        # the small filter outputs are dominated by their quantization, and
+        # the outputs wrap on overflow: percentiles are reported
+        ok = ref["filter"] >= 256
+        err = (out["filter"][ok] - ref["filter"][ok]) / ref["filter"][ok] * 100
+        print("  filter bank: error {:+.2f}% .. {:+.2f}% (1st-99th percentile), "
+              "median {:+.2f}%".format(*np.percentile(err, [1, 99, 50])))
+        err = np.abs(out["log"] - ref["log"])
+        print("  log:         |error| {:.0f} LSB median, {:.0f} LSB 99th percentile"
+              .format(*np.percentile(err, [50, 99])))
+        ref, err = ref["discard"], out["discard"] - ref["discard"]
+        snr = 10 * np.log10(np.sum(ref**2.) / np.sum(err**2.))
+        print("  cepstra:     SNR {:.1f} dB against the exact power".format(snr))
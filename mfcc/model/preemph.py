@@ -0,0 +1,58 @@
+import numpy as np
+
+from .fft import wrap
+
+
+__all__ = ["preemph"]
+
+
+def preemph(x, width=16):
+    # y(t) = x(t) - x(t-1) + x(t-1) >> 5, see mfcc.core.preemph.Preemph
+    x = np.asarray(x, dtype=np.int64)
+    prev = np.concatenate([np.zeros(1, dtype=np.int64), x[:-1]])
+    return wrap(x + (prev >> 5) - prev, width)
+
+
+import unittest
+
+class PreemphTestCase(unittest.TestCase):
+    def check(self, nchannels=1, length=50):
+        from nmigen.sim import Simulator, Settle
+        from ..core.preemph import Preemph
+
+        rng = np.random.default_rng(nchannels)
+        data = rng.integers(-2**15, 2**15, (nchannels, length))
+        model = [preemph(x) for x in data]
+        # the samples of the channels come in any order
+        order = rng.permutation(np.repeat(np.arange(nchannels), length))
+
+        dut = Preemph(nchannels=nchannels)
+        sim = Simulator(dut)
+        sim.add_clock(1e-6)
+
+        def bench():
+            output = [[] for k in range(nchannels)]
+            index = [0] * nchannels
+            yield dut.source.ready.eq(1)
+            for k in order:
+                yield dut.sink.valid.eq(1)
+                yield dut.sink.data.eq(int(data[k, index[k]]))
+                if nchannels > 1:
+                    yield dut.sink.channel.eq(int(k))
+                index[k] += 1
+                yield Settle()
+                if nchannels > 1:
+                    self.assertEqual((yield dut.source.channel), k)
+                output[k].append((yield dut.source.data))
+                yield
+            for o, m in zip(output, model):
+                self.assertEqual(o, m.tolist())
+
+        sim.add_sync_process(bench)
+        sim.run()
+
+    def test_single(self):
+        self.check()
+
+    def test_channels(self):
+        self.check(nchannels=4)
@@ -0,0 +1,53 @@
+import numpy as np
+from scipy.signal import get_window
+
+from .fft import wrap
+
+
+__all__ = ["window_curve", "window"]
+
+
+def window_curve(nfft=512, precision=8):
+    # Hamming curve as rebuilt by mfcc.core.window.WindowHamming from its
+    # compressed ROM. The first point is interpolated from the last point of
+    # the previous frame, which always reads the first (null) ROM entry, so
+    # the curve does not depend on the frame index.
+    maxheight = 2**(precision + 1) - 1
+    win = get_window("hamm", nfft, fftbins=True)
+    winfull = (win * maxheight).astype(int)
+
+    mem = np.copy(winfull[:nfft//4][1::2])
+    off_fst = int(mem[0])
+    mem -= off_fst
+    off_lst = int(2 * (winfull[nfft//4] - off_fst))
+
+    mask = (1 << (precision + 1)) - 1
+    bits = nfft.bit_length() - 1
+    naddr = len(mem) - 1
+
+    def point(n):
+        msb = (n >> (bits - 1)) & 1
+        dir = (n >> (bits - 2)) & 1
+        addr = (n >> 1) & naddr
+        if dir:
+            addr = ~addr & naddr
+        if msb ^ dir:
+            return (off_lst - int(mem[addr])) & mask
+        return int(mem[addr])
+
+    curve = []
+    point_r = point(nfft - 1)
+    for n in range(nfft):
+        p = point(n)
+        if n & 1:
+            curve.append((off_fst + p) & mask)
+            point_r = p
+        else:
+            curve.append((off_fst + ((p + point_r) >> 1)) & mask)
+    return np.array(curve, dtype=np.int64)
+
+
+def window(frames, curve, width=16, precision=8):
+    # (x * curve) truncated to the `width` upper bits of the product
+    frames = np.asarray(frames, dtype=np.int64)
+    return wrap((frames * curve) >> (precision + 1), width)
@@ -22,6 +22,10 @@ class Top(Elaboratable):
         i2s_pins = platform.request("i2s_in", 0)
         m.submodules.mic  = mic  = AudioReceiver(clk_freq=100e6, sample_freq=16e3, i2s_pins=i2s_pins)
 
+        # the serial link holds the cepstra back while it sends them, which
+        # stalls the core and its input: the FIFO keeps 32 ms of audio.
+        # With an output always ready, the core takes a sample well before
+        # the next one (see mfcc-fifos --realtime).
         m.submodules.mic_fifo = mic_fifo = stream.SyncFIFO([("data", 16)], 512, buffered=True)
         m.d.comb += [
             mic.source.connect(mic_fifo.sink),
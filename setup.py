@@ -27,6 +27,7 @@ setup(
             "wav2mfcc = mfcc.targets.wav2mfcc:build",
             "mic2mfcc = mfcc.targets.mic2mfcc:build",
             "mfcc-sim = mfcc.core.mfcc:test",
+            "mfcc-fifos = mfcc.core.fifo_sizing:main",
         ],
     },
     project_urls={